@@ -0,0 +1,205 @@
+"""Benchmarks for the streaming diff previews on large files.
+
+Run with ``python -m benchmarks.diffs --sizes 2000 10000 50000``.
+"""
+
+import argparse
+import difflib
+import logging
+import random
+import re
+import time
+from typing import Any, Callable, List
+
+from bosskit.tools import diffs
+
+from .benchmark import BenchmarkResult, BenchmarkRunner
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = [2_000, 10_000, 50_000]
+
+
+def make_synthetic_file(num_lines: int, seed: int = 0) -> List[str]:
+    """Python-like source with the blank lines and repeated statements of
+    real code, so not every line is unique."""
+    rnd = random.Random(seed)
+
+    lines = []
+    while len(lines) < num_lines:
+        func = len(lines)
+        lines.append(f"def func_{func}(value, config):\n")
+        for _ in range(rnd.randint(3, 12)):
+            kind = rnd.random()
+            if kind < 0.3:
+                lines.append("        return None\n")
+            elif kind < 0.5:
+                lines.append("    if value is None:\n")
+            else:
+                lines.append(f"    value = helper_{rnd.randrange(num_lines)}(value, config)\n")
+        lines.append("\n")
+    return lines[:num_lines]
+
+
+def make_update(lines: List[str], num_edits: int, seed: int = 0) -> List[str]:
+    """A copy of lines with num_edits scattered insertions, deletions,
+    changes and rewritten runs of lines, like a model rewriting a few
+    functions of a whole file."""
+    rnd = random.Random(seed)
+
+    updated = list(lines)
+    for _ in range(num_edits):
+        i = rnd.randrange(len(updated))
+        kind = rnd.choice(["insert", "delete", "change", "rewrite"])
+        if kind == "insert":
+            updated[i:i] = [f"    log_{rnd.random()}(value)\n" for _ in range(rnd.randint(1, 6))]
+        elif kind == "delete":
+            del updated[i : i + rnd.randint(1, 6)]
+        elif kind == "change":
+            updated[i] = updated[i].rstrip("\n") + "  # changed\n"
+        else:
+            for j in range(i, min(len(updated), i + rnd.randint(20, 100))):
+                updated[j] = updated[j].replace("value", "result")
+    return updated
+
+
+def baseline_last_non_deleted(lines_orig: List[str], lines_updated: List[str]):
+    """The difflib.ndiff version of diffs.find_last_non_deleted()."""
+    num_orig = 0
+    last_non_deleted_orig = None
+    for line in difflib.ndiff(lines_orig, lines_updated):
+        if line[0] == " ":
+            num_orig += 1
+            last_non_deleted_orig = num_orig
+        elif line[0] == "-":
+            num_orig += 1
+    return last_non_deleted_orig
+
+
+def baseline_partial_update(lines_orig: List[str], lines_updated: List[str]) -> str:
+    """The difflib version of diffs.diff_partial_update()."""
+    last_non_deleted = baseline_last_non_deleted(lines_orig, lines_updated)
+    if last_non_deleted is None:
+        return ""
+    bar = diffs.format_progress(last_non_deleted, len(lines_orig))
+    diff = difflib.unified_diff(lines_orig[:last_non_deleted], lines_updated[:-1] + [bar], n=5)
+    return diffs.fence_diff("".join(list(diff)[2:]))
+
+
+def get_progress(show: str) -> str:
+    """The "N / M lines" progress of a diff_partial_update() preview."""
+    match = re.search(r"\d+ / +\d+ lines", show)
+    return match.group(0) if match else None
+
+
+def time_prefixes(
+    runner: BenchmarkRunner,
+    name: str,
+    func: Callable,
+    lines_orig: List[str],
+    lines_updated: List[str],
+    num_prefixes: int,
+    metrics: dict,
+) -> List[Any]:
+    """Time func on num_prefixes evenly spaced prefixes of lines_updated, as
+    if it was called while the update streamed in. Every other prefix ends
+    part way through a line, like a streamed reply mostly does, the rest end
+    right after a newline.
+
+    Returns:
+        What func returned for each prefix.
+    """
+    step = max(1, len(lines_updated) // num_prefixes)
+    prefixes = []
+    for i, end in enumerate(range(step, len(lines_updated), step)):
+        partial_line = lines_updated[end]
+        partial_line = partial_line[: len(partial_line) // 2] if i % 2 else ""
+        prefixes.append(lines_updated[:end] + [partial_line])
+    results = []
+
+    start_time = time.perf_counter()
+    for prefix in prefixes:
+        results.append(func(lines_orig, prefix))
+    duration = time.perf_counter() - start_time
+
+    metrics = dict(metrics, calls=len(results), per_call=duration / max(1, len(results)))
+    runner.results.append(BenchmarkResult(name=name, duration=duration, success=True, metrics=metrics))
+    logger.info("%s: %.3fs, %.2fms per call", name, duration, metrics["per_call"] * 1000)
+    return results
+
+
+def time_streaming(
+    runner: BenchmarkRunner, name: str, lines_orig: List[str], lines_updated: List[str], metrics: dict
+) -> BenchmarkResult:
+    """Time diffs.PartialDiff fed the update a line at a time, showing the
+    diff after every line."""
+    start_time = time.perf_counter()
+    partial_diff = diffs.PartialDiff(lines_orig)
+    for line in lines_updated:
+        partial_diff.add_line(line)
+        partial_diff.show()
+    partial_diff.finish()
+    partial_diff.show(final=True)
+    duration = time.perf_counter() - start_time
+
+    metrics = dict(metrics, calls=len(lines_updated), per_call=duration / max(1, len(lines_updated)))
+    result = BenchmarkResult(name=name, duration=duration, success=True, metrics=metrics)
+    runner.results.append(result)
+    logger.info("%s: %.3fs, %.3fms per line", name, duration, metrics["per_call"] * 1000)
+    return result
+
+
+def benchmark_size(runner: BenchmarkRunner, num_lines: int, num_edits: int, num_prefixes: int, seed: int, baseline: bool):
+    lines_orig = make_synthetic_file(num_lines, seed=seed)
+    lines_updated = make_update(lines_orig, num_edits, seed=seed)
+    metrics = dict(num_lines=num_lines, num_edits=num_edits)
+
+    time_prefixes(
+        runner,
+        f"find_last_non_deleted_{num_lines}",
+        diffs.find_last_non_deleted,
+        lines_orig,
+        lines_updated,
+        num_prefixes,
+        metrics,
+    )
+    shows = time_prefixes(
+        runner, f"diff_partial_update_{num_lines}", diffs.diff_partial_update, lines_orig, lines_updated, num_prefixes, metrics
+    )
+    time_streaming(runner, f"partial_diff_stream_{num_lines}", lines_orig, lines_updated, metrics)
+
+    if baseline:
+        baseline_shows = time_prefixes(
+            runner, f"baseline_partial_update_{num_lines}", baseline_partial_update, lines_orig, lines_updated, num_prefixes, metrics
+        )
+        # both should see the update progress the same way
+        same_progress = list(map(get_progress, shows)) == list(map(get_progress, baseline_shows))
+        runner.results[-1].metrics["same_progress"] = same_progress
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the streaming diff previews on large files")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="file sizes, in lines")
+    parser.add_argument("--edits", type=int, default=20, help="edits made to each file")
+    parser.add_argument("--prefixes", type=int, default=20, help="partial updates diffed per file")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic files")
+    parser.add_argument(
+        "--baseline",
+        action="store_true",
+        help="also time the difflib.ndiff implementation, slow above a few thousand lines",
+    )
+    parser.add_argument("--output", default="diffs_benchmark.json", help="JSON report path")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    runner = BenchmarkRunner("diffs")
+    for num_lines in args.sizes:
+        benchmark_size(runner, num_lines, args.edits, args.prefixes, args.seed, args.baseline)
+
+    runner.save_report(args.output)
+    logger.info("Wrote %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
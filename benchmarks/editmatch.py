@@ -0,0 +1,122 @@
+"""Benchmarks for locating and applying edit blocks in large files.
+
+Run with ``python -m benchmarks.editmatch --sizes 2000 20000``.
+"""
+
+import argparse
+import logging
+import random
+import time
+from typing import Callable, List, Tuple
+
+from bosskit.tools.editmatch import IndexedFile
+
+from .benchmark import BenchmarkResult, BenchmarkRunner
+from .diffs import make_synthetic_file
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = [2_000, 20_000]
+
+
+def make_blocks(lines: List[str], num_blocks: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """(original, updated) edit blocks for num_blocks scattered, non
+    overlapping runs of 3 to 12 lines, in file order like a reply has them.
+    Some get the trailing whitespace or the indentation of their original
+    lines wrong, like models do."""
+    rnd = random.Random(seed)
+
+    starts = sorted(rnd.sample(range(0, len(lines) - 12, 12), num_blocks))
+    blocks = []
+    for start in starts:
+        run = lines[start : start + rnd.randint(3, 12)]
+        kind = rnd.random()
+        if kind < 0.1:
+            original = [line.rstrip("\n") + "  \n" for line in run]
+        elif kind < 0.2:
+            original = [line[4:] if line.startswith("    ") else line for line in run]
+        else:
+            original = run
+        updated = [line.replace("value", "result") for line in original]
+        blocks.append(("".join(original), "".join(updated)))
+    return blocks
+
+
+def baseline_replace(content: str, original: str, updated: str) -> str:
+    """The replace_block() this replaced: a substring search, then a scan
+    of every run of lines with trailing whitespace ignored."""
+    if original in content:
+        return content.replace(original, updated, 1)
+
+    content_lines = content.splitlines(keepends=True)
+    original_lines = [line.rstrip() for line in original.splitlines()]
+    num = len(original_lines)
+    for i in range(len(content_lines) - num + 1):
+        if all(content_lines[i + j].rstrip() == original_lines[j] for j in range(num)):
+            return "".join(content_lines[:i] + updated.splitlines(keepends=True) + content_lines[i + num :])
+
+
+def apply_baseline(content: str, blocks: List[Tuple[str, str]]) -> Tuple[str, int]:
+    applied = 0
+    for original, updated in blocks:
+        new_content = baseline_replace(content, original, updated)
+        if new_content is not None:
+            content = new_content
+            applied += 1
+    return content, applied
+
+
+def apply_indexed(content: str, blocks: List[Tuple[str, str]]) -> Tuple[str, int]:
+    indexed = IndexedFile(content)
+    applied = sum(indexed.replace(original, updated) for original, updated in blocks)
+    return indexed.get_content(), applied
+
+
+def time_apply(
+    runner: BenchmarkRunner, name: str, func: Callable, content: str, blocks: List[Tuple[str, str]], metrics: dict
+) -> Tuple[str, int]:
+    start_time = time.perf_counter()
+    new_content, applied = func(content, blocks)
+    duration = time.perf_counter() - start_time
+
+    metrics = dict(metrics, applied=applied, per_block=duration / max(1, len(blocks)))
+    runner.results.append(BenchmarkResult(name=name, duration=duration, success=True, metrics=metrics))
+    logger.info("%s: %.3fs, %d/%d blocks, %.3fms per block", name, duration, applied, len(blocks), metrics["per_block"] * 1000)
+    return new_content, applied
+
+
+def benchmark_size(runner: BenchmarkRunner, num_lines: int, num_blocks: int, seed: int, baseline: bool):
+    content = "".join(make_synthetic_file(num_lines, seed=seed))
+    blocks = make_blocks(content.splitlines(keepends=True), num_blocks, seed=seed)
+    metrics = dict(num_lines=num_lines, num_blocks=num_blocks)
+
+    indexed_content, _ = time_apply(runner, f"indexed_{num_lines}", apply_indexed, content, blocks, metrics)
+
+    if baseline:
+        baseline_content, _ = time_apply(runner, f"baseline_{num_lines}", apply_baseline, content, blocks, metrics)
+        # the blocks the baseline can place, the index should place the same way
+        exact_blocks = [block for block in blocks if baseline_replace(content, *block) is not None]
+        runner.results[-1].metrics["same_content"] = apply_indexed(content, exact_blocks)[0] == baseline_content
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark locating and applying edit blocks in large files")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="file sizes, in lines")
+    parser.add_argument("--blocks", type=int, default=50, help="edit blocks applied to each file")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic files")
+    parser.add_argument("--baseline", action="store_true", help="also time the line scanning implementation")
+    parser.add_argument("--output", default="editmatch_benchmark.json", help="JSON report path")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    runner = BenchmarkRunner("editmatch")
+    for num_lines in args.sizes:
+        benchmark_size(runner, num_lines, args.blocks, args.seed, args.baseline)
+
+    runner.save_report(args.output)
+    logger.info("Wrote %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Scaling benchmarks for RepoMap on synthetic repositories.
+
+Run with ``python -m benchmarks.repomap --sizes 1000 10000 100000``.
+"""
+
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+import psutil
+
+from bosskit.tools.io import InputOutput
+from bosskit.tools.repomap import RepoMap
+
+from .benchmark import BenchmarkResult, BenchmarkRunner
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+# method names shared by many classes, the source of most of the edges in
+# a real repo's reference graph
+COMMON_METHODS = ["run", "get", "update", "close", "load", "save", "render", "validate"]
+
+# names which are referenced everywhere but never defined in the repo
+EXTERNAL_NAMES = ["os", "path", "join", "logging", "getLogger", "json", "dumps", "time"]
+
+# RepoMap methods timed by StageTimer, see get_stages()
+TIMED_METHODS = [
+    "run_ctags_batch",
+    "get_name_identifiers_batch",
+    "update_ref_graph",
+    "rank_edges",
+    "rank_local_push",
+    "rank_sharded",
+    "get_ranked_tags",
+    "get_ranked_tags_map",
+]
+
+
+def make_synthetic_repo(root: str, num_files: int, seed: int = 0, files_per_dir: int = 25) -> List[str]:
+    """Write a synthetic python repo of num_files modules under root.
+
+    Modules are spread over a two level package tree. Which modules get
+    referenced follows a Zipf distribution, so a few core modules are used
+    everywhere and most are barely used, and half of all references stay
+    within the referencing module's own package.
+
+    Returns:
+        The absolute paths of the modules, in creation order.
+    """
+    rnd = random.Random(seed)
+
+    modules = []
+    for i in range(num_files):
+        pkg = i // files_per_dir
+        dname = os.path.join(root, f"pkg{pkg // 20}", f"sub{pkg % 20}")
+        funcs = [f"func_{i}_{j}" for j in range(rnd.randint(2, 6))]
+        methods = rnd.sample(COMMON_METHODS, rnd.randint(1, 3))
+        modules.append((os.path.join(dname, f"module_{i}.py"), pkg, funcs, f"Model{i}", methods))
+
+    popularity = list(range(num_files))
+    rnd.shuffle(popularity)
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, num_files + 1):
+        total += 1.0 / rank**1.1
+        cum_weights.append(total)
+
+    by_pkg = dict()
+    for module in modules:
+        by_pkg.setdefault(module[1], []).append(module)
+
+    def pick_target(pkg):
+        if rnd.random() < 0.5:
+            return rnd.choice(by_pkg[pkg])
+        return modules[popularity[rnd.choices(range(num_files), cum_weights=cum_weights)[0]]]
+
+    for fname, pkg, funcs, cls, methods in modules:
+        lines = ["import os", "import logging", "", "logger = logging.getLogger(__name__)", ""]
+        for func in funcs:
+            lines.append(f"def {func}(value, config):")
+            for _ in range(rnd.randint(1, 5)):
+                target = pick_target(pkg)
+                call = rnd.choice(target[2])
+                method = rnd.choice(target[4])
+                lines.append(f"    value = {call}(value, config) or {target[3]}().{method}()")
+            lines.append(f"    return os.path.join(str(value), {rnd.choice(EXTERNAL_NAMES)!r})")
+            lines.append("")
+
+        lines.append(f"class {cls}:")
+        for method in methods:
+            target = pick_target(pkg)
+            lines.append(f"    def {method}(self):")
+            lines.append(f"        return {rnd.choice(target[2])}(self, None)")
+            lines.append("")
+
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+    return [module[0] for module in modules]
+
+
+class StageTimer:
+    """Accumulate the time spent in selected methods of one object."""
+
+    def __init__(self, obj: Any, method_names: List[str]):
+        self.times = {name: 0.0 for name in method_names}
+        for name in method_names:
+            setattr(obj, name, self._wrap(name, getattr(obj, name)))
+
+    def _wrap(self, name: str, method: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.times[name] += time.perf_counter() - start_time
+
+        return timed
+
+    def get_stages(self, total: float) -> Dict[str, float]:
+        """Split total into the RepoMap pipeline stages.
+
+        The timed methods nest, so each stage is its own method's time minus
+        the time of the stages inside it.
+        """
+        t = self.times
+        stages = {
+            "ctags": t["run_ctags_batch"],
+            "lexing": t["get_name_identifiers_batch"],
+            "graph_build": t["update_ref_graph"] - t["run_ctags_batch"] - t["get_name_identifiers_batch"],
+            "pagerank": t["rank_edges"] + t["rank_local_push"] + t["rank_sharded"],
+            "tree_fitting": t["get_ranked_tags_map"] - t["get_ranked_tags"],
+        }
+        stages["other"] = total - sum(stages.values())
+        return stages
+
+
+class PeakMemorySampler:
+    """Track the peak RSS of this process from a background thread.
+
+    ctags and the lexing worker pool run in child processes, which are not
+    included.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.start_rss = 0
+        self.peak_rss = 0
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = self.process.memory_info().rss
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def _sample(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+
+def make_repo_map(root: str, store_path: str, map_tokens: int, **kwargs) -> RepoMap:
+    """A RepoMap whose tag store lives at store_path rather than in ~/.bosskit."""
+
+    class BenchmarkRepoMap(RepoMap):
+        TAG_STORE_FILE = store_path
+
+    io = InputOutput(pretty=False, yes=True)
+    return BenchmarkRepoMap(map_tokens=map_tokens, root=root, io=io, **kwargs)
+
+
+def time_repo_map(
+    runner: BenchmarkRunner,
+    name: str,
+    repo_map: RepoMap,
+    chat_files: List[str],
+    other_files: List[str],
+    metrics: Dict[str, Any],
+) -> BenchmarkResult:
+    """Time one get_repo_map() call, by stage, and record it on runner."""
+    timer = StageTimer(repo_map, TIMED_METHODS)
+    success = True
+    error = None
+    repo_content = None
+
+    with PeakMemorySampler() as memory:
+        start_time = time.perf_counter()
+        try:
+            repo_content = repo_map.get_repo_map(chat_files, other_files)
+        except Exception as e:  # noqa: BLE001
+            success = False
+            error = str(e)
+            logger.error("Benchmark %s failed: %s", name, e)
+        duration = time.perf_counter() - start_time
+
+    metrics = dict(metrics)
+    metrics.update(
+        stages=timer.get_stages(duration),
+        peak_rss=memory.peak_rss,
+        peak_rss_delta=memory.peak_rss - memory.start_rss,
+        graph_files=len(repo_map.ref_graph),
+        graph_idents=len(repo_map.ref_graph.idents),
+        map_tokens=repo_map.token_count(repo_content) if repo_content else 0,
+    )
+
+    result = BenchmarkResult(name=name, duration=duration, success=success, error=error, metrics=metrics)
+    runner.results.append(result)
+    logger.info("%s: %.2fs %s", name, duration, {k: round(v, 3) for k, v in metrics["stages"].items()})
+    return result
+
+
+def benchmark_size(
+    runner: BenchmarkRunner,
+    workdir: str,
+    num_files: int,
+    map_tokens: int,
+    seed: int,
+    **repo_map_kwargs,
+):
+    """Run the cold, warm and incremental scenarios on one repo size."""
+    root = os.path.join(workdir, f"repo_{num_files}")
+    store_path = os.path.join(workdir, f"store_{num_files}", "repomap.db")
+
+    start_time = time.perf_counter()
+    fnames = make_synthetic_repo(root, num_files, seed=seed)
+    logger.info("Generated %d files in %.1fs", num_files, time.perf_counter() - start_time)
+
+    rnd = random.Random(seed)
+    chat_files = rnd.sample(fnames, 2)
+    other_files = [fname for fname in fnames if fname not in chat_files]
+    metrics = dict(num_files=num_files, max_map_tokens=map_tokens, **repo_map_kwargs)
+
+    # empty tag store, nothing in memory
+    repo_map = make_repo_map(root, store_path, map_tokens, **repo_map_kwargs)
+    time_repo_map(runner, f"repomap_{num_files}_cold", repo_map, chat_files, other_files, metrics)
+
+    # tags and idents come from the store, the graph and ranking are redone
+    repo_map = make_repo_map(root, store_path, map_tokens, **repo_map_kwargs)
+    time_repo_map(runner, f"repomap_{num_files}_warm", repo_map, chat_files, other_files, metrics)
+
+    # one file changed under a RepoMap which has already seen the repo
+    with open(other_files[0], "a", encoding="utf-8") as f:
+        f.write("\n\ndef benchmark_edit(value):\n    return func_0_0(value, None)\n")
+    time_repo_map(runner, f"repomap_{num_files}_incremental", repo_map, chat_files, other_files, metrics)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark RepoMap on synthetic repositories")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="repo sizes, in files")
+    parser.add_argument("--map-tokens", type=int, default=1024, help="token budget for the map")
+    parser.add_argument("--shard-depth", type=int, help="rank in shards this many directories deep")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic repos")
+    parser.add_argument("--workdir", help="where to generate the repos (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated repos in the temp dir")
+    parser.add_argument("--output", default="repomap_benchmark.json", help="JSON report path")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="repomap_benchmark_")
+    runner = BenchmarkRunner("repomap")
+    try:
+        for num_files in args.sizes:
+            benchmark_size(runner, workdir, num_files, args.map_tokens, args.seed, shard_depth=args.shard_depth)
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    runner.save_report(args.output)
+    logger.info("Wrote %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
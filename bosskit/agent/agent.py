@@ -11,12 +11,19 @@ import openai
 import requests
 from openai.error import RateLimitError
 from rich.console import Console
-from rich.live import Live
-from rich.markdown import Markdown
 
 from bosskit import diffs, editors, models, prompts, utils
 from bosskit.commands import Commands
 from bosskit.repomap import RepoMap
+from bosskit.tools.commitworker import CommitMessageWorker
+from bosskit.tools.editstream import StreamingEdits
+from bosskit.tools.filecontent import QuotedFileCache
+from bosskit.tools.gitbatch import UNTRACKED, GitBatch
+from bosskit.tools.gitindex import GitFileIndex
+from bosskit.tools.history import ChatHistory
+from bosskit.tools.mdstream import MarkdownStream
+from bosskit.tools.promptcache import CacheWarmer, ChatChunks
+from bosskit.tools.watch import FileWatcher
 
 from ..dump import dump  # noqa: F401
 
@@ -28,9 +35,18 @@ class MissingAPIKeyError(ValueError):
 class Coder:
     abs_fnames = None
     repo = None
+    git_index = None
+    git_batch = None
+    commit_worker = None
     last_bosskit_commit_hash = None
     last_asked_for_commit_time = 0
     repo_map = None
+    watcher = None
+    file_changes = None
+    last_modified = 0
+    whole_preview = None
+    edit_stream = None
+    cache_warmer = None
 
     def check_model_availability(self, main_model):
         available_models = openai.Model.list()
@@ -46,12 +62,18 @@ class Coder:
         show_diffs=False,
         auto_commits=True,
         dirty_commits=True,
+        background_commits=True,
         dry_run=False,
         map_tokens=1024,
         verbose=False,
         openai_api_key=None,
         openai_api_agent=None,
         assistant_output_color="blue",
+        watch_files=False,
+        stream_fps=20,
+        cache_keepalive_pings=0,
+        stream_output=True,
+        root=None,
     ):
         if not openai_api_key:
             raise MissingAPIKeyError("No OpenAI API key provided.")
@@ -60,8 +82,8 @@ class Coder:
 
         self.verbose = verbose
         self.abs_fnames = set()
+        self.quoted_files = QuotedFileCache(utils.quoted_file)
         self.cur_messages = []
-        self.done_messages = []
 
         self.io = io
 
@@ -70,7 +92,10 @@ class Coder:
 
         self.auto_commits = auto_commits
         self.dirty_commits = dirty_commits
+        self.background_commits = background_commits
         self.assistant_output_color = assistant_output_color
+        self.stream_fps = stream_fps
+        self.stream_output = stream_output
 
         self.dry_run = dry_run
         self.pretty = pretty
@@ -90,6 +115,19 @@ class Coder:
         self.main_model = main_model
         self.edit_format = self.main_model.edit_format
 
+        self.history = ChatHistory(
+            self.count_message_tokens,
+            self.summarize_messages,
+            main_model.max_chat_history_tokens,
+            summary_prefix=prompts.summary_prefix,
+        )
+
+        # providers either cache prompt prefixes by themselves, or where
+        # they're told to with cache_control breakpoints
+        self.prompt_caching = main_model.cache_control or main_model.caches_by_default
+        if self.prompt_caching and cache_keepalive_pings:
+            self.cache_warmer = CacheWarmer(self.ping_cache, cache_keepalive_pings)
+
         if self.edit_format == "whole":
             self.gpt_prompts = editors.WholeFilePrompts()
         elif self.edit_format == "diff":
@@ -103,14 +141,21 @@ class Coder:
 
         self.commands = Commands(self.io, self)
 
-        self.set_repo(fnames)
+        self.set_repo(fnames, root)
 
         if self.repo:
             rel_repo_dir = os.path.relpath(self.repo.git_dir, os.getcwd())
             self.io.tool_output(f"Git repo: {rel_repo_dir}")
         else:
             self.io.tool_output("Git repo: none")
-            self.find_common_root()
+            self.find_common_root(root)
+
+        if watch_files:
+            # keep a live set of changed paths, so turns where nothing changed
+            # don't have to stat every file in the repo
+            self.watcher = FileWatcher(self.root)
+            self.watcher.start()
+            self.file_changes = self.watcher.subscribe()
 
         if main_model.use_repo_map:
             rm_io = io if self.verbose else None
@@ -120,6 +165,7 @@ class Coder:
                 self.main_model,
                 rm_io,
                 self.gpt_prompts.repo_content_prefix,
+                watcher=self.watcher,
             )
 
             if self.repo_map.use_ctags:
@@ -134,16 +180,18 @@ class Coder:
         for fname in self.get_inchat_relative_files():
             self.io.tool_output(f"Added {fname} to the chat.")
 
-    def find_common_root(self):
-        if self.abs_fnames:
+    def find_common_root(self, root=None):
+        if root:
+            self.root = os.path.abspath(root)
+        elif self.abs_fnames:
             common_prefix = os.path.commonpath(list(self.abs_fnames))
             self.root = os.path.dirname(common_prefix)
         else:
             self.root = os.getcwd()
 
-    def set_repo(self, cmd_line_fnames):
+    def set_repo(self, cmd_line_fnames, root=None):
         if not cmd_line_fnames:
-            cmd_line_fnames = ["."]
+            cmd_line_fnames = [root or "."]
 
         repo_paths = []
         for fname in cmd_line_fnames:
@@ -177,12 +225,12 @@ class Coder:
         repo = git.Repo(repo_paths.pop(), odbt=git.GitDB)
 
         self.root = repo.working_tree_dir
+        git_index = GitFileIndex(repo)
 
         new_files = []
         for fname in self.abs_fnames:
             relative_fname = self.get_rel_fname(fname)
-            tracked_files = set(repo.git.ls_files().splitlines())
-            if relative_fname not in tracked_files:
+            if relative_fname not in git_index:
                 new_files.append(relative_fname)
 
         if new_files:
@@ -205,45 +253,82 @@ class Coder:
                 return
 
         self.repo = repo
+        self.git_index = git_index
+        self.git_batch = GitBatch(repo)
+        if self.background_commits:
+            self.commit_worker = CommitMessageWorker(repo, self.get_background_commit_message)
 
     def get_files_content(self, fnames=None):
         if not fnames:
             fnames = self.abs_fnames
+            self.quoted_files.prune(fnames)
 
-        prompt = ""
+        blocks = []
         for fname in fnames:
             relative_fname = self.get_rel_fname(fname)
-            prompt += utils.quoted_file(fname, relative_fname)
-        return prompt
+            blocks.append(self.quoted_files.get_block(fname, relative_fname))
+        return "".join(blocks)
+
+    def get_repo_messages(self):
+        if not self.repo_map:
+            return []
+
+        other_files = set(self.get_all_abs_files()) - set(self.abs_fnames)
+        repo_content = self.repo_map.get_repo_map(self.abs_fnames, other_files)
+        if not repo_content:
+            return []
+
+        return [
+            dict(role="user", content=repo_content),
+            dict(role="assistant", content="Ok."),
+        ]
 
     def get_files_messages(self):
-        all_content = ""
         if self.abs_fnames:
             files_content = self.gpt_prompts.files_content_prefix
             files_content += self.get_files_content()
         else:
             files_content = self.gpt_prompts.files_no_full_files
 
-        all_content += files_content
-
-        other_files = set(self.get_all_abs_files()) - set(self.abs_fnames)
-        if self.repo_map:
-            repo_content = self.repo_map.get_repo_map(self.abs_fnames, other_files)
-            if repo_content:
-                if all_content:
-                    all_content += "\n"
-                all_content += repo_content
-
-        files_messages = [
-            dict(role="user", content=all_content),
+        return [
+            dict(role="user", content=files_content),
             dict(role="assistant", content="Ok."),
         ]
+
+    def format_chunks(self):
+        main_sys = self.gpt_prompts.main_system
+        if self.main_model.use_repo_map:
+            main_sys += "\n" + self.gpt_prompts.system_reminder
+
+        chunks = ChatChunks(
+            system=[dict(role="system", content=main_sys)],
+            done=self.done_messages,
+            repo=self.get_repo_messages(),
+            chat_files=self.get_files_messages(),
+            cur=self.cur_messages,
+        )
         if self.abs_fnames:
-            files_messages += [
-                dict(role="system", content=self.gpt_prompts.system_reminder),
-            ]
+            chunks.reminder = [dict(role="system", content=self.gpt_prompts.system_reminder)]
 
-        return files_messages
+        if self.main_model.cache_control:
+            chunks.add_cache_control_headers()
+
+        return chunks
+
+    def ping_cache(self, messages):
+        openai.ChatCompletion.create(
+            model=self.main_model.name,
+            messages=messages,
+            temperature=0,
+            max_tokens=1,
+        )
+
+    def close(self):
+        # the session is over, stop what's still running in the background
+        if self.cache_warmer:
+            self.cache_warmer.stop()
+        if self.watcher:
+            self.watcher.stop()
 
     def run(self):
         self.done_messages = []
@@ -263,8 +348,28 @@ class Coder:
                     break
                 self.io.tool_error("^C again or /exit to quit")
             except EOFError:
+                self.flush_commits()
                 return
 
+    def run_one(self, message, max_reflections=3):
+        """
+        Send one message without anyone at the keyboard, and follow up on
+        malformed edits or mentioned files at most max_reflections times.
+        """
+
+        self.check_for_file_mentions(message)
+
+        num_reflections = 0
+        while message:
+            message = self.send_new_user_message(message)
+            if message:
+                num_reflections += 1
+                if num_reflections > max_reflections:
+                    self.io.tool_error(f"Gave up after {max_reflections} follow ups.")
+                    break
+
+        self.flush_commits()
+
     def should_dirty_commit(self, inp):
         is_commit_command = inp and inp.startswith("/commit")
         if is_commit_command:
@@ -274,19 +379,45 @@ class Coder:
             return
         if not self.repo:
             return
-        if not self.repo.is_dirty():
+        if not self.git_batch.is_dirty():
             return
         if self.last_asked_for_commit_time >= self.get_last_modified():
             return
         return True
 
+    @property
+    def done_messages(self):
+        return self.history.get_messages()
+
+    @done_messages.setter
+    def done_messages(self, messages):
+        self.history.reset(messages)
+
+    def count_message_tokens(self, message):
+        # a few tokens for the role and message framing
+        return self.commands.count_tokens(message["content"]) + 4
+
+    def summarize_messages(self, messages):
+        content = ""
+        for msg in messages:
+            content += "# " + msg["role"].upper() + "\n" + msg["content"] + "\n"
+
+        return self.complete(
+            [
+                dict(role="system", content=prompts.summarize_system),
+                dict(role="user", content=content),
+            ],
+            self.main_model.weak_model.name,
+        ).strip()
+
     def move_back_cur_messages(self, message):
-        self.done_messages += self.cur_messages
+        done_messages = self.cur_messages
         if message:
-            self.done_messages += [
+            done_messages = done_messages + [
                 dict(role="user", content=message),
                 dict(role="assistant", content="Ok."),
             ]
+        self.history.extend(done_messages)
         self.cur_messages = []
 
     def run_loop(self):
@@ -324,23 +455,19 @@ class Coder:
             dict(role="user", content=inp),
         ]
 
-        main_sys = self.gpt_prompts.main_system
-        if self.main_model.use_repo_map:
-            main_sys += "\n" + self.gpt_prompts.system_reminder
-
-        messages = [
-            dict(role="system", content=main_sys),
-        ]
-
-        messages += self.done_messages
-
-        messages += self.get_files_messages()
-        messages += self.cur_messages
+        chunks = self.format_chunks()
+        messages = chunks.all_messages()
 
         if self.verbose:
             utils.show_messages(messages)
 
+        if self.cache_warmer:
+            self.cache_warmer.pause()
+
         content, interrupted = self.send(messages)
+
+        if self.cache_warmer:
+            self.cache_warmer.warm(chunks.cacheable_messages())
         if interrupted:
             self.io.tool_error("\n\n^C KeyboardInterrupt")
             content += "\n^C KeyboardInterrupt"
@@ -375,7 +502,7 @@ class Coder:
             return add_rel_files_message
 
     def auto_commit(self):
-        res = self.commit(history=self.cur_messages, prefix="bosskit: ")
+        res = self.commit(history=self.cur_messages, prefix="bosskit: ", background=True)
         if res:
             commit_hash, commit_message = res
             self.last_bosskit_commit_hash = commit_hash
@@ -404,20 +531,15 @@ class Coder:
         addable_rel_fnames = self.get_addable_relative_files()
 
         mentioned_rel_fnames = set()
-        fname_to_rel_fnames = {}
-        for rel_fname in addable_rel_fnames:
-            fname = os.path.agentname(rel_fname)
-            if fname not in fname_to_rel_fnames:
-                fname_to_rel_fnames[fname] = []
-            fname_to_rel_fnames[fname].append(rel_fname)
-
-        for fname, rel_fnames in fname_to_rel_fnames.items():
-            if len(rel_fnames) == 1 and fname in words:
-                mentioned_rel_fnames.add(rel_fnames[0])
-            else:
-                for rel_fname in rel_fnames:
-                    if rel_fname in words:
-                        mentioned_rel_fnames.add(rel_fname)
+        if self.git_index:
+            for word in words:
+                if word in addable_rel_fnames:
+                    mentioned_rel_fnames.add(word)
+
+                # a bare file name counts if only one addable file has it
+                rel_fnames = [rel for rel in self.git_index.get_by_basename(word) if rel in addable_rel_fnames]
+                if len(rel_fnames) == 1:
+                    mentioned_rel_fnames.add(rel_fnames[0])
 
         if not mentioned_rel_fnames:
             return
@@ -465,13 +587,26 @@ class Coder:
         return self.resp, interrupted
 
     def show_send_output(self, completion, silent):
-        live = None
-        if self.pretty and not silent:
-            live = Live(vertical_overflow="scroll")
+        mdstream = None
+        if self.pretty and not silent and self.stream_output:
+            mdstream = MarkdownStream(
+                style=self.assistant_output_color,
+                code_theme="default",
+                fps=self.stream_fps,
+            )
+
+        self.whole_preview = None
+        if self.edit_format == "whole":
+            self.whole_preview = diffs.WholeFilePreview(self.root, self.get_inchat_relative_files())
+
+        # apply edit blocks to the chat files as soon as each one is complete
+        self.edit_stream = None
+        if self.edit_format == "diff" and not silent:
+            self.edit_stream = StreamingEdits(self.root, self.can_stream_edit, self.dry_run)
 
         try:
-            if live:
-                live.start()
+            if mdstream:
+                mdstream.start()
 
             for chunk in completion:
                 if chunk.choices[0].finish_reason not in (None, "stop"):
@@ -483,34 +618,51 @@ class Coder:
                 except AttributeError:
                     continue
 
-                if silent:
+                if self.edit_stream and "\n" in text:
+                    self.edit_stream.update(self.resp)
+
+                if silent or not self.stream_output:
                     continue
 
                 if self.pretty:
-                    show_resp = self.resp
-                    if self.edit_format == "whole":
-                        try:
-                            show_resp = self.update_files_gpt35(self.resp, mode="diff")
-                        except ValueError:
-                            pass
-                    md = Markdown(show_resp, style=self.assistant_output_color, code_theme="default")
-                    live.update(md)
+                    if mdstream.due():
+                        mdstream.update(self.get_show_resp())
                 else:
                     sys.stdout.write(text)
                     sys.stdout.flush()
+
+            if mdstream:
+                mdstream.update(self.get_show_resp(), final=True)
+        except BaseException:
+            # interrupted, or failed, so the reply won't be applied
+            if self.edit_stream:
+                self.edit_stream.rollback()
+                self.edit_stream = None
+            raise
         finally:
-            if live:
-                live.stop()
+            if mdstream:
+                mdstream.stop()
+
+    def can_stream_edit(self, path):
+        # edits to other files need confirming first, which waits for the end
+        full_path = os.path.abspath(os.path.join(self.root, path))
+        return full_path in self.abs_fnames
 
-    def update_files_gpt35(self, content, mode="update"):
+    def get_show_resp(self):
+        show_resp = self.resp
+        if self.whole_preview:
+            try:
+                show_resp = self.whole_preview.update(self.resp)
+            except ValueError:
+                pass
+        return show_resp
+
+    def update_files_gpt35(self, content):
         edited = set()
         chat_files = self.get_inchat_relative_files()
         if not chat_files:
-            if mode == "diff":
-                return content
             return
 
-        output = []
         lines = content.splitlines(keepends=True)
         fname = None
         new_lines = []
@@ -520,20 +672,9 @@ class Coder:
                     # ending an existing block
                     full_path = os.path.abspath(os.path.join(self.root, fname))
 
-                    if mode == "diff":
-                        with open(full_path, "r") as f:
-                            orig_lines = f.readlines()
-
-                        show_diff = diffs.diff_partial_update(
-                            orig_lines,
-                            new_lines,
-                            final=True,
-                        ).splitlines()
-                        output += show_diff
-                    else:
-                        new_lines = "".join(new_lines)
-                        Path(full_path).write_text(new_lines)
-                        edited.add(fname)
+                    new_lines = "".join(new_lines)
+                    Path(full_path).write_text(new_lines)
+                    edited.add(fname)
 
                     fname = None
                     new_lines = []
@@ -553,25 +694,6 @@ class Coder:
 
             elif fname:
                 new_lines.append(line)
-            else:
-                output.append(line)
-
-        if mode == "diff":
-            if fname:
-                # ending an existing block
-                full_path = os.path.abspath(os.path.join(self.root, fname))
-
-                if mode == "diff":
-                    with open(full_path, "r") as f:
-                        orig_lines = f.readlines()
-
-                    show_diff = diffs.diff_partial_update(
-                        orig_lines,
-                        new_lines,
-                    ).splitlines()
-                    output += show_diff
-
-            return "\n".join(output)
 
         if fname:
             raise ValueError("Started a ``` block without closing it")
@@ -579,45 +701,61 @@ class Coder:
         return edited
 
     def update_files_gpt4(self, content):
-        # might raise ValueError for malformed ORIG/UPD blocks
-        edits = list(utils.find_original_update_blocks(content))
+        edit_stream = self.edit_stream
+        self.edit_stream = None
+        if not edit_stream:
+            edit_stream = StreamingEdits(self.root, lambda path: False, self.dry_run)
+
+        try:
+            for path, original, updated in edit_stream.finish(content):
+                self.apply_deferred_edit(edit_stream, path, original, updated)
+        except BaseException:
+            # malformed ORIG/UPD blocks, a failed write or git add, or an
+            # interrupt: undo everything applied, while streaming too
+            edit_stream.rollback()
+            raise
 
         edited = set()
-        for path, original, updated in edits:
-            full_path = os.path.abspath(os.path.join(self.root, path))
+        for path, applied in edit_stream.results:
+            edited.add(path)
+            if not applied:
+                self.io.tool_error(f"Failed to apply edit to {path}")
+            elif self.dry_run:
+                self.io.tool_output(f"Dry run, did not apply edit to {path}")
+            else:
+                self.io.tool_output(f"Applied edit to {path}")
 
-            if full_path not in self.abs_fnames:
-                if not Path(full_path).exists():
-                    question = f"Allow creation of new file {path}?"  # noqa: E501
-                else:
-                    question = f"Allow edits to {path} which was not previously provided?"  # noqa: E501
-                if not self.io.confirm_ask(question):
-                    self.io.tool_error(f"Skipping edit to {path}")
-                    continue
+        return edited
 
-                if not Path(full_path).exists():
-                    Path(full_path).parent.mkdir(parents=True, exist_ok=True)
-                    Path(full_path).touch()
+    def apply_deferred_edit(self, edit_stream, path, original, updated):
+        full_path = os.path.abspath(os.path.join(self.root, path))
 
-                self.abs_fnames.add(full_path)
+        add_to_git = False
+        if full_path not in self.abs_fnames:
+            if not Path(full_path).exists():
+                question = f"Allow creation of new file {path}?"  # noqa: E501
+            else:
+                question = f"Allow edits to {path} which was not previously provided?"  # noqa: E501
+            if not self.io.confirm_ask(question):
+                self.io.tool_error(f"Skipping edit to {path}")
+                return
 
-                # Check if the file is already in the repo
-                if self.repo:
-                    tracked_files = set(self.repo.git.ls_files().splitlines())
-                    relative_fname = self.get_rel_fname(full_path)
-                    if relative_fname not in tracked_files and self.io.confirm_ask(f"Add {path} to git?"):
-                        self.repo.git.add(full_path)
+            self.abs_fnames.add(full_path)
 
-            edited.add(path)
-            if utils.do_replace(full_path, original, updated, self.dry_run):
-                if self.dry_run:
-                    self.io.tool_output(f"Dry run, did not apply edit to {path}")
-                else:
-                    self.io.tool_output(f"Applied edit to {path}")
-            else:
-                self.io.tool_error(f"Failed to apply edit to {path}")
+            # Check if the file is already in the repo
+            if self.repo:
+                relative_fname = self.get_rel_fname(full_path)
+                add_to_git = relative_fname not in self.git_index and self.io.confirm_ask(f"Add {path} to git?")
 
-        return edited
+        # a new file is created by its edit, so a rollback removes it again
+        if edit_stream.apply(path, original, updated) and add_to_git and not self.dry_run:
+            self.repo.git.add(full_path)
+
+    def complete(self, messages, model):
+        # collects the whole reply, without printing it or touching self.resp,
+        # for use off the main thread
+        completion = self.send_with_retries(model, messages)
+        return "".join(chunk.choices[0].delta.get("content", "") for chunk in completion)
 
     def get_context_from_history(self, history):
         context = ""
@@ -627,9 +765,10 @@ class Coder:
                 context += msg["role"].upper() + ": " + msg["content"] + "\n"
         return context
 
-    def get_commit_message(self, diffs, context):
+    def get_commit_message(self, diffs, context, background=False):
         if len(diffs) >= 4 * 1024 * 4:
-            self.io.tool_error(f"Diff is too large for {models.GPT35.name} to generate a commit message.")
+            if not background:
+                self.io.tool_error(f"Diff is too large for {models.GPT35.name} to generate a commit message.")
             return
 
         diffs = "# Diffs:\n" + diffs
@@ -640,13 +779,18 @@ class Coder:
         ]
 
         try:
-            commit_message, interrupted = self.send(
-                messages,
-                model=models.GPT35.name,
-                silent=True,
-            )
+            if background:
+                commit_message = self.complete(messages, models.GPT35.name)
+                interrupted = False
+            else:
+                commit_message, interrupted = self.send(
+                    messages,
+                    model=models.GPT35.name,
+                    silent=True,
+                )
         except openai.error.InvalidRequestError:
-            self.io.tool_error(f"Failed to generate commit message using {models.GPT35.name} due to an invalid" " request.")
+            if not background:
+                self.io.tool_error(f"Failed to generate commit message using {models.GPT35.name} due to an invalid" " request.")
             return
 
         commit_message = commit_message.strip()
@@ -659,56 +803,79 @@ class Coder:
 
         return commit_message
 
-    def get_diffs(self, *args):
+    def get_background_commit_message(self, diffs, context):
+        # the placeholder just stays if this fails, there's no one to tell
+        try:
+            return self.get_commit_message(diffs, context, background=True)
+        except Exception:  # noqa: BLE001
+            return
+
+    def flush_commits(self):
+        # wait for messages still being written, so the commit hashes we hand
+        # out and compare against are the final ones
+        if not self.commit_worker:
+            return
+        self.commit_worker.flush()
+        self.last_bosskit_commit_hash = self.commit_worker.get_current(self.last_bosskit_commit_hash)
+
+    def get_diffs(self, *args, fnames=None):
         if self.pretty:
             args = ["--color"] + list(args)
 
+        if fnames is not None:
+            return self.git_batch.get_diff(fnames, *args)
+
         diffs = self.repo.git.diff(*args)
         return diffs
 
-    def commit(self, history=None, prefix=None, ask=False, message=None, which="chat_files"):
+    def commit(self, history=None, prefix=None, ask=False, message=None, which="chat_files", background=False):
         repo = self.repo
         if not repo:
             return
 
-        if not repo.is_dirty():
-            return
-
-        def get_dirty_files_and_diffs(file_list):
-            diffs = ""
-            relative_dirty_files = []
-            for fname in file_list:
-                relative_fname = self.get_rel_fname(fname)
-                relative_dirty_files.append(relative_fname)
-
-                try:
-                    current_branch_commit_count = len(list(self.repo.iter_commits(self.repo.active_branch)))
-                except git.exc.GitCommandError:
-                    current_branch_commit_count = None
-
-                if not current_branch_commit_count:
-                    continue
-
-                these_diffs = self.get_diffs("HEAD", "--", relative_fname)
-
-                if these_diffs:
-                    diffs += these_diffs + "\n"
+        background = background and self.commit_worker and not message and not ask
+        if not background:
+            self.flush_commits()
 
-            return relative_dirty_files, diffs
+        status = self.git_batch.get_status()
+        if not any(code != UNTRACKED for code in status.values()):
+            return
 
         if which == "repo_files":
-            all_files = [os.path.join(self.root, f) for f in self.get_all_relative_files()]
-            relative_dirty_fnames, diffs = get_dirty_files_and_diffs(all_files)
+            relative_dirty_fnames = sorted(fname for fname, code in status.items() if code != UNTRACKED)
         elif which == "chat_files":
-            relative_dirty_fnames, diffs = get_dirty_files_and_diffs(self.abs_fnames)
+            relative_dirty_fnames = [fname for fname in self.get_inchat_relative_files() if fname in status]
         else:
             raise ValueError(f"Invalid value for 'which': {which}")
 
+        if not relative_dirty_fnames:
+            return
+
+        diffs = ""
+        if self.git_batch.head_exists():
+            tracked_fnames = [fname for fname in relative_dirty_fnames if status[fname] != UNTRACKED]
+            diffs = self.get_diffs("HEAD", fnames=tracked_fnames)
+            if diffs:
+                diffs += "\n"
+
         if self.show_diffs or ask:
             # don't use io.tool_output() because we don't want to log or further colorize
             print(diffs)
 
         context = self.get_context_from_history(history)
+        if background:
+            # the real message gets written into the commit once it's ready
+            placeholder = "Edit " + ", ".join(relative_dirty_fnames)
+            commit_hash = self.commit_worker.commit(
+                relative_dirty_fnames,
+                (prefix or "") + placeholder + "\n\n" + context,
+                prefix,
+                diffs,
+                context,
+            )[:7]
+            self.io.tool_output(f"Commit {commit_hash} {(prefix or '')}{placeholder}")
+            return commit_hash, placeholder
+
         if message:
             commit_message = message
         else:
@@ -758,11 +925,9 @@ class Coder:
 
     def get_all_relative_files(self):
         if self.repo:
-            files = self.repo.git.ls_files().splitlines()
-        else:
-            files = self.get_inchat_relative_files()
+            return list(self.git_index.get_files())
 
-        return sorted(set(files))
+        return self.get_inchat_relative_files()
 
     def get_all_abs_files(self):
         files = self.get_all_relative_files()
@@ -770,13 +935,33 @@ class Coder:
         return files
 
     def get_last_modified(self):
-        files = self.get_all_abs_files()
-        if not files:
-            return 0
-        return max(Path(path).stat().st_mtime for path in files)
+        changed = None
+        if self.file_changes:
+            changed = self.file_changes.drain()
+
+        if changed is None:
+            files = self.get_all_abs_files()
+            if not files:
+                self.last_modified = 0
+            else:
+                self.last_modified = max(Path(path).stat().st_mtime for path in files)
+            return self.last_modified
+
+        if changed:
+            changed = changed.intersection(self.get_all_abs_files())
+        for path in changed:
+            try:
+                mtime = Path(path).stat().st_mtime
+            except FileNotFoundError:
+                continue
+            self.last_modified = max(self.last_modified, mtime)
+
+        return self.last_modified
 
     def get_addable_relative_files(self):
-        return set(self.get_all_relative_files()) - set(self.get_inchat_relative_files())
+        if self.repo:
+            return self.git_index.get_file_set() - set(self.get_inchat_relative_files())
+        return set()
 
     def apply_updates(self, content):
         if self.edit_format == "diff":
@@ -0,0 +1,89 @@
+import json
+import os
+import typing as t
+
+from bosskit.coders import Coder
+from bosskit.io import InputOutput
+from bosskit.tools.batch import BatchRunner, load_manifest, parse_provider_limits
+
+
+def make_job_runner(args) -> t.Callable:
+    """A run_job() for BatchRunner which gives each job its own Coder and InputOutput.
+
+    Args:
+        args: The parsed command line arguments, shared by all the jobs.
+
+    Returns:
+        A function running one job, and returning its result fields.
+    """
+
+    def run_job(job):
+        chat_history_file = None
+        if args.batch_logs:
+            chat_history_file = os.path.join(args.batch_logs, f"{job.id}.md")
+
+        with open(os.devnull, "w") as devnull:
+            io = InputOutput(pretty=False, yes=True, chat_history_file=chat_history_file, output=devnull)
+            coder = Coder(
+                io,
+                main_model=job.model,
+                fnames=job.get_abs_files(),
+                root=job.repo,
+                pretty=False,
+                show_diffs=False,
+                auto_commits=args.auto_commits,
+                dirty_commits=False,
+                background_commits=False,
+                dry_run=args.dry_run,
+                map_tokens=args.map_tokens,
+                openai_api_key=args.openai_api_key,
+                openai_api_base=args.openai_api_base,
+                stream_output=False,
+            )
+            try:
+                coder.run_one(job.prompt)
+            finally:
+                coder.close()
+
+        return dict(
+            commit=coder.last_bosskit_commit_hash,
+            num_errors=io.num_error_outputs,
+        )
+
+    return run_job
+
+
+def run_batch(args, io: InputOutput) -> int:
+    """Run every job of the --batch manifest, and report on the batch.
+
+    Args:
+        args: The parsed command line arguments.
+        io: Where to report progress and the batch metrics.
+
+    Returns:
+        The exit status, 1 if the manifest is invalid or any job failed.
+    """
+    try:
+        jobs = load_manifest(args.batch, args.model)
+        provider_limits = parse_provider_limits(args.provider_limit)
+    except (OSError, ValueError) as err:
+        io.tool_error(str(err))
+        return 1
+
+    if args.batch_logs:
+        os.makedirs(args.batch_logs, exist_ok=True)
+
+    io.tool_output(f"Running {len(jobs)} jobs on {args.batch_workers} workers, results in {args.batch_results}")
+    runner = BatchRunner(make_job_runner(args), args.batch_results, args.batch_workers, provider_limits)
+    metrics = runner.run(jobs)
+
+    io.tool_output(
+        f"{metrics['ok']}/{metrics['jobs']} jobs ok in {metrics['wall_time']:.1f}s,"
+        f" {metrics['jobs_per_minute']:.1f} jobs/min,"
+        f" latency p50 {metrics['latency']['p50']:.1f}s p90 {metrics['latency']['p90']:.1f}s"
+    )
+    if args.batch_metrics:
+        with open(args.batch_metrics, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, indent=2)
+
+    return 1 if metrics["failed"] else 0
@@ -9,7 +9,7 @@ import git
 import tiktoken
 from prompt_toolkit.completion import Completion
 
-from bosskit import prompts, utils
+from bosskit import prompts
 
 
 class Commands:
@@ -85,6 +85,9 @@ class Commands:
         self.coder.done_messages = []
         self.coder.cur_messages = []
 
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text))
+
     def cmd_tokens(self, args):
         "Report on the number of tokens used by the current chat context"
 
@@ -117,8 +120,7 @@ class Commands:
         # files
         for fname in self.coder.abs_fnames:
             relative_fname = self.coder.get_rel_fname(fname)
-            quoted = utils.quoted_file(fname, relative_fname)
-            tokens = len(self.tokenizer.encode(quoted))
+            tokens = self.coder.quoted_files.get_tokens(fname, relative_fname, self.count_tokens)
             res.append((tokens, f"{relative_fname}", "use /drop to drop from chat"))
 
         self.io.tool_output("Approximate context window usage, in tokens:")
@@ -154,6 +156,9 @@ class Commands:
             self.io.tool_error("No git repository found.")
             return
 
+        # the last commit may still be waiting for its message
+        self.coder.flush_commits()
+
         if self.coder.repo.is_dirty():
             self.io.tool_error("The repository has uncommitted changes. Please commit or stash them before" " undoing.")
             return
@@ -191,6 +196,7 @@ class Commands:
             self.io.tool_error("No git repository found.")
             return
 
+        self.coder.flush_commits()
         if not self.coder.last_bosskit_commit_hash:
             self.io.tool_error("No previous bosskit commit found.")
             return
@@ -229,6 +235,7 @@ class Commands:
 
                     matched_files = [word]
                     if self.coder.repo is not None:
+                        self.coder.flush_commits()
                         self.coder.repo.git.add(os.path.join(self.coder.root, word))
                         commit_message = f"bosskit: Created and added {word} to git."
                         self.coder.repo.git.commit("-m", commit_message, "--no-verify")
@@ -6,6 +6,7 @@ import configargparse
 import git
 
 from bosskit import __version__, models
+from bosskit.cli.batch import run_batch
 from bosskit.coders import Coder
 from bosskit.io import InputOutput
 
@@ -131,11 +132,56 @@ def main(args: t.Optional[t.List[str]] = None, input: t.Optional[t.TextIO] = Non
         default="blue",
         help="Set the color for assistant output (default: blue)",
     )
+    parser.add_argument(
+        "--stream-fps",
+        type=int,
+        default=20,
+        help="Max redraws per second of the reply while it streams in (default: 20)",
+    )
+    parser.add_argument(
+        "--cache-keepalive-pings",
+        type=int,
+        default=0,
+        help="Number of times to ping at 5 minute intervals to keep the prompt cache warm (default: 0)",
+    )
     parser.add_argument(
         "--apply",
         metavar="FILE",
         help="Apply the changes from the given file instead of running the chat (debug)",
     )
+    parser.add_argument(
+        "--batch",
+        metavar="MANIFEST",
+        help="Run the jobs of a JSON lines manifest of repo, files and prompt without a chat, then exit",
+    )
+    parser.add_argument(
+        "--batch-workers",
+        type=int,
+        default=4,
+        help="Number of batch jobs to run at once (default: 4)",
+    )
+    parser.add_argument(
+        "--provider-limit",
+        metavar="PROVIDER=N",
+        action="append",
+        help="Run at most N batch jobs at once against PROVIDER, can be given more than once",
+    )
+    parser.add_argument(
+        "--batch-results",
+        metavar="FILE",
+        default="batch_results.jsonl",
+        help="Write each batch job's result to FILE as a JSON line (default: batch_results.jsonl)",
+    )
+    parser.add_argument(
+        "--batch-metrics",
+        metavar="FILE",
+        help="Write the throughput and latency metrics of the batch to FILE as JSON",
+    )
+    parser.add_argument(
+        "--batch-logs",
+        metavar="DIR",
+        help="Keep the chat history of each batch job in DIR",
+    )
     parser.add_argument(
         "--auto-commits",
         action="store_true",
@@ -150,6 +196,19 @@ def main(args: t.Optional[t.List[str]] = None, input: t.Optional[t.TextIO] = Non
         dest="auto_commits",
         help="Disable auto commit of GPT changes (implies --no-dirty-commits)",
     )
+    parser.add_argument(
+        "--background-commits",
+        action="store_true",
+        dest="background_commits",
+        default=True,
+        help="Commit GPT changes right away and write the commit message in the background (default: True)",
+    )
+    parser.add_argument(
+        "--no-background-commits",
+        action="store_false",
+        dest="background_commits",
+        help="Wait for the commit message before committing GPT changes",
+    )
     parser.add_argument(
         "--dirty-commits",
         action="store_true",
@@ -233,6 +292,9 @@ def main(args: t.Optional[t.List[str]] = None, input: t.Optional[t.TextIO] = Non
         io.tool_error("No OpenAI API key provided. Use --openai-api-key or env OPENAI_API_KEY.")
         return 1
 
+    if args.batch:
+        return run_batch(args, io)
+
     coder = Coder(
         io,
         main_model=args.model,
@@ -241,25 +303,31 @@ def main(args: t.Optional[t.List[str]] = None, input: t.Optional[t.TextIO] = Non
         show_diffs=args.show_diffs,
         auto_commits=args.auto_commits,
         dirty_commits=args.dirty_commits,
+        background_commits=args.background_commits,
         dry_run=args.dry_run,
         map_tokens=args.map_tokens,
         verbose=args.verbose,
         openai_api_key=args.openai_api_key,
         openai_api_base=args.openai_api_base,
         assistant_output_color=args.assistant_output_color,
+        stream_fps=args.stream_fps,
+        cache_keepalive_pings=args.cache_keepalive_pings,
     )
 
-    if args.dirty_commits:
-        coder.commit(ask=True, which="repo_files")
+    try:
+        if args.dirty_commits:
+            coder.commit(ask=True, which="repo_files")
 
-    if args.apply:
-        with open(args.apply, "r") as f:
-            content = f.read()
-        coder.apply_updates(content)
-        return
+        if args.apply:
+            with open(args.apply, "r") as f:
+                content = f.read()
+            coder.apply_updates(content)
+            return
 
-    io.tool_output("Use /help to see in-chat commands.")
-    coder.run()
+        io.tool_output("Use /help to see in-chat commands.")
+        coder.run()
+    finally:
+        coder.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import git
+
+# models without a provider/ prefix go to the OpenAI API
+DEFAULT_PROVIDER = "openai"
+
+
+def get_repo_root(path):
+    # the git working tree path is in, or path itself outside of git
+    try:
+        return git.Repo(path, search_parent_directories=True).working_tree_dir
+    except (git.exc.InvalidGitRepositoryError, git.exc.NoSuchPathError):
+        return path
+
+
+class BatchJob:
+    __slots__ = ("id", "repo", "files", "prompt", "model", "repo_root")
+
+    def __init__(self, id, repo, files, prompt, model):
+        self.id = id
+        self.repo = repo
+        self.files = files
+        self.prompt = prompt
+        self.model = model
+        # jobs in different directories of one git repo share its index
+        self.repo_root = get_repo_root(repo)
+
+    def get_abs_files(self):
+        return [os.path.abspath(os.path.join(self.repo, fname)) for fname in self.files]
+
+
+def get_provider(model):
+    if "/" in model:
+        return model.split("/", 1)[0]
+    return DEFAULT_PROVIDER
+
+
+def load_manifest(fname, default_model):
+    """
+    Read the jobs of a manifest, one JSON object per line with a repo, a
+    prompt, and optionally files, a model and an id. Relative repo paths
+    are relative to the manifest, and each has to be an existing directory.
+    """
+
+    base = os.path.dirname(os.path.abspath(fname))
+    jobs = []
+    with open(fname, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as err:
+                raise ValueError(f"{fname}:{lineno}: {err}")
+            if not isinstance(entry, dict) or not entry.get("repo") or not entry.get("prompt"):
+                raise ValueError(f"{fname}:{lineno}: each job needs a repo and a prompt")
+
+            repo = os.path.abspath(os.path.join(base, entry["repo"]))
+            if not os.path.isdir(repo):
+                raise ValueError(f"{fname}:{lineno}: repo {repo} is not a directory")
+
+            files = entry.get("files") or []
+            if isinstance(files, str):
+                files = [files]
+
+            jobs.append(
+                BatchJob(
+                    str(entry.get("id") or f"job-{lineno}"),
+                    repo,
+                    files,
+                    entry["prompt"],
+                    entry.get("model") or default_model,
+                )
+            )
+    return jobs
+
+
+def parse_provider_limits(specs):
+    """["openai=4", "anthropic=2"] as {"openai": 4, "anthropic": 2}."""
+    limits = dict()
+    for spec in specs or ():
+        provider, _, limit = spec.partition("=")
+        if not provider or not limit.isdigit() or int(limit) < 1:
+            raise ValueError(f"Invalid provider limit {spec!r}, expected PROVIDER=N with N at least 1")
+        limits[provider] = int(limit)
+    return limits
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize_times(values):
+    return dict(
+        mean=sum(values) / len(values) if values else 0,
+        p50=percentile(values, 50),
+        p90=percentile(values, 90),
+        p99=percentile(values, 99),
+        max=max(values, default=0),
+    )
+
+
+class BatchRunner:
+    """
+    Runs jobs on max_workers threads with run_job(job), which returns a
+    dict of extra result fields. Each job's result is appended to
+    results_fname as a JSON line as soon as it finishes.
+
+    A job only starts once its provider is under its limit, and no other
+    job is running in the same git repo, even from another directory of
+    it, so waiting jobs never hold a worker that some other job could use.
+    """
+
+    def __init__(self, run_job, results_fname, max_workers=4, provider_limits=None):
+        self.run_job = run_job
+        self.results_fname = results_fname
+        self.max_workers = max_workers
+        self.provider_limits = provider_limits or dict()
+
+        self.cond = threading.Condition()
+        self.pending = []
+        self.running = Counter()
+        self.busy_repos = set()
+
+        self.write_lock = threading.Lock()
+        self.records = []
+        self.start_time = 0
+
+    def run(self, jobs):
+        """Run all the jobs, and return the metrics of the whole batch."""
+        self.pending = list(jobs)
+        self.records = []
+        self.start_time = time.monotonic()
+
+        # start with an empty results file, lines are appended as jobs finish
+        open(self.results_fname, "w").close()
+
+        threads = [threading.Thread(target=self.work, daemon=True) for _ in range(min(self.max_workers, len(jobs)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return self.get_metrics(time.monotonic() - self.start_time)
+
+    def can_start(self, job):
+        provider = get_provider(job.model)
+        limit = self.provider_limits.get(provider)
+        if limit is not None and self.running[provider] >= limit:
+            return False
+        return job.repo_root not in self.busy_repos
+
+    def next_job(self):
+        with self.cond:
+            while self.pending:
+                for i, job in enumerate(self.pending):
+                    if self.can_start(job):
+                        del self.pending[i]
+                        self.running[get_provider(job.model)] += 1
+                        self.busy_repos.add(job.repo_root)
+                        return job
+                # a running job finishing will make room
+                self.cond.wait()
+
+    def work(self):
+        while True:
+            job = self.next_job()
+            if not job:
+                return
+
+            try:
+                self.run_one(job)
+            finally:
+                with self.cond:
+                    self.running[get_provider(job.model)] -= 1
+                    self.busy_repos.discard(job.repo_root)
+                    self.cond.notify_all()
+
+    def run_one(self, job):
+        started = time.monotonic()
+        record = dict(
+            id=job.id,
+            repo=job.repo,
+            files=job.files,
+            model=job.model,
+            provider=get_provider(job.model),
+            status="ok",
+            error=None,
+        )
+
+        try:
+            record.update(self.run_job(job) or dict())
+        except Exception as err:  # noqa: BLE001
+            record.update(status="error", error=f"{type(err).__name__}: {err}")
+
+        record.update(
+            queued=started - self.start_time,
+            duration=time.monotonic() - started,
+        )
+        self.write(record)
+        return record
+
+    def write(self, record):
+        with self.write_lock:
+            self.records.append(record)
+            with open(self.results_fname, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def get_metrics(self, wall_time):
+        records = self.records
+        durations = [record["duration"] for record in records]
+        num_failed = sum(record["status"] != "ok" for record in records)
+
+        providers = dict()
+        for provider in sorted(set(record["provider"] for record in records)):
+            provider_records = [record for record in records if record["provider"] == provider]
+            providers[provider] = dict(
+                jobs=len(provider_records),
+                failed=sum(record["status"] != "ok" for record in provider_records),
+                latency=summarize_times([record["duration"] for record in provider_records]),
+            )
+
+        return dict(
+            jobs=len(records),
+            ok=len(records) - num_failed,
+            failed=num_failed,
+            wall_time=wall_time,
+            jobs_per_minute=60 * len(records) / wall_time if wall_time else 0,
+            latency=summarize_times(durations),
+            queued=summarize_times([record["queued"] for record in records]),
+            providers=providers,
+        )
@@ -0,0 +1,117 @@
+import queue
+import threading
+
+
+class CommitJob:
+    __slots__ = ("hexsha", "prefix", "diffs", "context")
+
+    def __init__(self, hexsha, prefix, diffs, context):
+        self.hexsha = hexsha
+        self.prefix = prefix
+        self.diffs = diffs
+        self.context = context
+
+
+class CommitMessageWorker:
+    """
+    Commits right away with a placeholder message, then writes the real
+    message on a background thread with get_message(diffs, context) and
+    rewords the commit once it's ready.
+
+    Rewording goes through commit-tree and a compare and swap of HEAD, so it
+    never touches the index or the working tree. Commits made on top of the
+    one being reworded are replayed onto it, as long as they were all made
+    through this worker; if anything else moved HEAD the placeholder stays.
+    At most max_pending messages are in flight, commit() waits beyond that.
+    """
+
+    def __init__(self, repo, get_message, max_pending=4):
+        self.repo = repo
+        self.get_message = get_message
+
+        # held by anything here which moves HEAD
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue(maxsize=max_pending)
+        # the commits made through commit(), oldest first, as long as they
+        # are the tip of HEAD's history
+        self.chain = []
+        # old sha -> the sha it was reworded or replayed as
+        self.renames = dict()
+        self.thread = None
+
+    def commit(self, fnames, message, prefix, diffs, context):
+        """Commit fnames now, and queue up writing the real message. Returns the sha."""
+        with self.lock:
+            self.repo.git.add(*fnames)
+            self.repo.git.commit("-m", message, "--no-verify")
+            commit = self.repo.head.commit
+
+            parents = [parent.hexsha for parent in commit.parents]
+            if not self.chain or parents != self.chain[-1:]:
+                self.chain = []
+            self.chain.append(commit.hexsha)
+
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+        self.jobs.put(CommitJob(commit.hexsha, prefix, diffs, context))
+        return commit.hexsha
+
+    def flush(self):
+        """Wait until every queued message has been written and swapped in."""
+        self.jobs.join()
+
+    def get_current(self, hexsha):
+        # what a commit (or an abbreviation of its sha) ended up as
+        if not hexsha:
+            return hexsha
+        while True:
+            new = next((new for old, new in self.renames.items() if old.startswith(hexsha)), None)
+            if new is None:
+                return hexsha
+            hexsha = new[: len(hexsha)]
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                message = self.get_message(job.diffs, job.context)
+                if message:
+                    full_message = (job.prefix or "") + message + "\n\n" + job.context
+                    with self.lock:
+                        self.reword(job.hexsha, full_message)
+            except Exception:  # noqa: BLE001
+                # the commit keeps its placeholder message
+                pass
+            finally:
+                self.jobs.task_done()
+
+    def reword(self, hexsha, message):
+        hexsha = self.get_current(hexsha)
+        head = self.repo.head.commit.hexsha
+        if not self.chain or self.chain[-1] != head or hexsha not in self.chain:
+            # HEAD moved on without us, or was undone
+            return False
+
+        index = self.chain.index(hexsha)
+        commit = self.repo.commit(hexsha)
+        new_sha = self.commit_tree(commit, [parent.hexsha for parent in commit.parents], message)
+        new_chain = [new_sha]
+        for later in self.chain[index + 1 :]:
+            commit = self.repo.commit(later)
+            new_chain.append(self.commit_tree(commit, new_chain[-1:], commit.message))
+
+        # fails if HEAD moved since it was read above
+        self.repo.git.update_ref("-m", "bosskit: reword commit message", "HEAD", new_chain[-1], head)
+
+        for old, new in zip(self.chain[index:], new_chain):
+            self.renames[old] = new
+        self.chain[index:] = new_chain
+        return True
+
+    def commit_tree(self, commit, parents, message):
+        args = [commit.tree.hexsha]
+        for parent in parents:
+            args += ["-p", parent]
+        return self.repo.git.commit_tree(*args, "-m", message)
@@ -1,5 +1,8 @@
 import difflib
+import os
 import sys
+from bisect import bisect_left
+from collections import defaultdict
 
 from .dump import dump  # noqa: F401
 
@@ -33,6 +36,36 @@ def create_progress_bar(percentage):
     return bar
 
 
+def format_progress(last_non_deleted, num_orig_lines):
+    if num_orig_lines:
+        pct = last_non_deleted * 100 / num_orig_lines
+    else:
+        pct = 50
+    bar = create_progress_bar(pct)
+    return f" {last_non_deleted:3d} / {num_orig_lines:3d} lines [{bar}] {pct:3.0f}%\n"
+
+
+def fence_diff(diff, fname=None):
+    if not diff.endswith("\n"):
+        diff += "\n"
+
+    for i in range(3, 10):
+        backticks = "`" * i
+        if backticks not in diff:
+            break
+
+    show = f"{backticks}diff\n"
+    if fname:
+        show += f"--- {fname} original\n"
+        show += f"+++ {fname} updated\n"
+
+    show += diff
+
+    show += f"{backticks}\n\n"
+
+    return show
+
+
 def assert_newlines(lines):
     if not lines:
         return
@@ -64,65 +97,477 @@ def diff_partial_update(lines_orig, lines_updated, final=False, fname=None):
     if last_non_deleted is None:
         return ""
 
-    if num_orig_lines:
-        pct = last_non_deleted * 100 / num_orig_lines
-    else:
-        pct = 50
-    bar = create_progress_bar(pct)
-    bar = f" {last_non_deleted:3d} / {num_orig_lines:3d} lines [{bar}] {pct:3.0f}%\n"
+    bar = format_progress(last_non_deleted, num_orig_lines)
 
     lines_orig = lines_orig[:last_non_deleted]
 
     if not final:
         lines_updated = lines_updated[:-1] + [bar]
 
-    diff = difflib.unified_diff(lines_orig, lines_updated, n=5)
-
-    diff = list(diff)[2:]
+    opcodes = align_lines(lines_orig, lines_updated)
+    diff = [format_hunk(group, lines_orig, lines_updated) for group in group_opcodes(opcodes, n=5)]
 
     diff = "".join(diff)
-    if not diff.endswith("\n"):
-        diff += "\n"
 
-    for i in range(3, 10):
-        backticks = "`" * i
-        if backticks not in diff:
-            break
+    # print(diff)
 
-    show = f"{backticks}diff\n"
-    if fname:
-        show += f"--- {fname} original\n"
-        show += f"+++ {fname} updated\n"
+    return fence_diff(diff, fname)
 
-    show += diff
 
-    show += f"{backticks}\n\n"
+def find_last_non_deleted(lines_orig, lines_updated):
+    # the number of orig lines up to the last one still in the update. The
+    # update is only the start of the new file, so its last lines mustn't be
+    # matched up with the end of the original just for being alike
+    blocks = match_lines(*intern_lines(lines_orig, lines_updated), trim_suffix=False)
+    if not blocks:
+        return None
 
-    # print(diff)
+    i, _j, size = blocks[-1]
+    return i + size
 
-    return show
 
+# gaps without any unique lines in common fall back to difflib when they are
+# at most this big, and are treated as replaced wholesale above it
+MAX_FALLBACK_CELLS = 250_000
 
-def find_last_non_deleted(lines_orig, lines_updated):
-    diff = list(difflib.ndiff(lines_orig, lines_updated))
-
-    num_orig = 0
-    last_non_deleted_orig = None
-
-    for line in diff:
-        # print(f"{num_orig:2d} {num_updated:2d} {line}", end="")
-        code = line[0]
-        if code == " ":
-            num_orig += 1
-            last_non_deleted_orig = num_orig
-        elif code == "-":
-            # line only in orig
-            num_orig += 1
-        elif code == "+":
-            # line only in updated
-            pass
-
-    return last_non_deleted_orig
+
+def intern_lines(lines_orig, lines_updated):
+    # lines as small ints, so all the comparisons below are cheap
+    ids = dict()
+    orig = [ids.setdefault(line, len(ids)) for line in lines_orig]
+    updated = [ids.setdefault(line, len(ids)) for line in lines_updated]
+    return orig, updated
+
+
+def align_lines(lines_orig, lines_updated):
+    """
+    Opcodes turning lines_orig into lines_updated, in the same form as
+    SequenceMatcher.get_opcodes(), but found with patience diff which is
+    about linear in the number of lines rather than quadratic.
+    """
+
+    blocks = match_lines(*intern_lines(lines_orig, lines_updated))
+
+    opcodes = []
+    i = j = 0
+    for ai, bj, size in blocks + [(len(lines_orig), len(lines_updated), 0)]:
+        if i < ai and j < bj:
+            opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(("delete", i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(("insert", i, ai, j, bj))
+        i, j = ai + size, bj + size
+        if size:
+            opcodes.append(("equal", ai, i, bj, j))
+    return opcodes
+
+
+def match_lines(a, b, trim_suffix=True):
+    """
+    The (i, j, size) blocks of matching lines between a and b, ascending and
+    with adjacent blocks merged.
+
+    Patience diff: after trimming the common prefix and suffix, the lines
+    which occur exactly once in both a and b are matched up along their
+    longest common subsequence, and the gaps between them are diffed the
+    same way. Without trim_suffix only the common prefix is trimmed, for
+    when b is just the start of an update.
+    """
+
+    blocks = []
+    ranges = [(0, len(a), 0, len(b))]
+    while ranges:
+        alo, ahi, blo, bhi = ranges.pop()
+
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        if alo > start:
+            blocks.append((start, blo - (alo - start), alo - start))
+
+        end = ahi
+        while trim_suffix and alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        if ahi < end:
+            blocks.append((ahi, bhi, end - ahi))
+
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = find_unique_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            for i, j in anchors:
+                ranges.append((alo, i, blo, j))
+                blocks.append((i, j, 1))
+                alo, blo = i + 1, j + 1
+            ranges.append((alo, ahi, blo, bhi))
+        elif (ahi - alo) * (bhi - blo) <= MAX_FALLBACK_CELLS:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, size in matcher.get_matching_blocks():
+                if size:
+                    blocks.append((alo + i, blo + j, size))
+
+    blocks.sort()
+
+    merged = []
+    for i, j, size in blocks:
+        if merged:
+            last_i, last_j, last_size = merged[-1]
+            if last_i + last_size == i and last_j + last_size == j:
+                merged[-1] = (last_i, last_j, last_size + size)
+                continue
+        merged.append((i, j, size))
+    return merged
+
+
+def find_unique_anchors(a, alo, ahi, b, blo, bhi):
+    # (i, j) pairs of lines unique in both ranges, along the longest
+    # increasing run of i
+    in_a = dict()
+    for i in range(alo, ahi):
+        in_a[a[i]] = -1 if a[i] in in_a else i
+
+    in_b = dict()
+    for j in range(blo, bhi):
+        line = b[j]
+        if in_a.get(line, -1) >= 0:
+            in_b[line] = -1 if line in in_b else j
+
+    # in order of j, as dicts keep insertion order
+    pairs = [(in_a[line], j) for line, j in in_b.items() if j >= 0]
+
+    # patience sorting, tails[k] is the smallest i ending a run of length k + 1
+    tails = []
+    tail_pairs = []
+    prev_pair = [None] * len(pairs)
+    for k, (i, _j) in enumerate(pairs):
+        pos = bisect_left(tails, i)
+        if pos == len(tails):
+            tails.append(i)
+            tail_pairs.append(k)
+        else:
+            tails[pos] = i
+            tail_pairs[pos] = k
+        if pos:
+            prev_pair[k] = tail_pairs[pos - 1]
+
+    anchors = []
+    k = tail_pairs[-1] if tail_pairs else None
+    while k is not None:
+        anchors.append(pairs[k])
+        k = prev_pair[k]
+    anchors.reverse()
+    return anchors
+
+
+def group_opcodes(opcodes, n=3):
+    """
+    Hunks of opcodes with n lines of context, as in
+    SequenceMatcher.get_grouped_opcodes().
+    """
+
+    codes = list(opcodes)
+    if not codes:
+        return
+
+    tag, i1, i2, j1, j2 = codes[0]
+    if tag == "equal":
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    tag, i1, i2, j1, j2 = codes[-1]
+    if tag == "equal":
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > n + n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def format_range(start, stop):
+    # a unified diff line range, as difflib writes them
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def format_hunk(group, lines_orig, lines_updated, extra_line=None):
+    """
+    One unified diff hunk from a group of difflib style opcodes. extra_line
+    stands in for the updated line just past the end of lines_updated.
+    """
+
+    first, last = group[0], group[-1]
+    hunk = [f"@@ -{format_range(first[1], last[2])} +{format_range(first[3], last[4])} @@\n"]
+    for tag, i1, i2, j1, j2 in group:
+        if tag == "equal":
+            hunk += [" " + line for line in lines_orig[i1:i2]]
+            continue
+        if tag in ("replace", "delete"):
+            hunk += ["-" + line for line in lines_orig[i1:i2]]
+        if tag in ("replace", "insert"):
+            hunk += ["+" + line for line in lines_updated[j1:j2]]
+            if extra_line is not None and j2 > len(lines_updated):
+                hunk.append("+" + extra_line)
+    return "".join(hunk)
+
+
+class PartialDiff:
+    """
+    The diff of lines_orig against an updated version that arrives a line at
+    a time, shown the way diff_partial_update() shows it.
+
+    The alignment is only ever extended. A new line which matches the next
+    original line, or which occurs just once in the rest of the original,
+    anchors it, and only the lines between two anchors get diffed. Hunks are
+    rendered once they can no longer change, so the cost of each line and
+    of each show() depends on the size of the edits rather than the file.
+    """
+
+    context = 5
+
+    def __init__(self, lines_orig):
+        self.lines_orig = lines_orig
+        self.lines_updated = []
+
+        # line -> ascending indexes in lines_orig
+        self.positions = defaultdict(list)
+        for i, line in enumerate(lines_orig):
+            self.positions[line].append(i)
+
+        # lines_orig[:orig_pos] is aligned with lines_updated[:updated_pos],
+        # the updated lines past that wait for the next anchor
+        self.orig_pos = 0
+        self.updated_pos = 0
+        self.last_non_deleted = None
+
+        # opcodes are grouped into hunks as in SequenceMatcher's
+        # get_grouped_opcodes(). The last opcode may still grow, the group
+        # holds the ones after the last finished hunk.
+        self.last_op = None
+        self.grouped_any = False
+        self.group = []
+        self.hunks = []
+
+    def add_line(self, line):
+        self.lines_updated.append(line)
+
+        # the line right after the last anchor, when the lines since were
+        # inserted, or the line past as many original lines as they might
+        # have replaced
+        num_pending = len(self.lines_updated) - 1 - self.updated_pos
+        for pos in (self.orig_pos, self.orig_pos + num_pending):
+            if pos < len(self.lines_orig) and line == self.lines_orig[pos]:
+                self.match(pos)
+                return
+
+        positions = self.positions.get(line)
+        if not positions:
+            return
+
+        # else the nearest copy a few lines on, past deleted lines, or a copy
+        # which is the only one left
+        index = bisect_left(positions, self.orig_pos)
+        if index == len(positions):
+            return
+        if index == len(positions) - 1 or (not num_pending and positions[index] <= self.orig_pos + self.context):
+            self.match(positions[index])
+
+    def finish(self):
+        # the update is complete, everything left is diffed
+        self.align(len(self.lines_orig), len(self.lines_updated))
+
+    def match(self, orig_index):
+        updated_index = len(self.lines_updated) - 1
+        self.align(orig_index, updated_index)
+        self.add_op("equal", orig_index, orig_index + 1, updated_index, updated_index + 1)
+        self.orig_pos = orig_index + 1
+        self.updated_pos = updated_index + 1
+        self.last_non_deleted = self.orig_pos
+
+    def align(self, orig_end, updated_end):
+        orig_start, updated_start = self.orig_pos, self.updated_pos
+        if orig_start == orig_end and updated_start == updated_end:
+            return
+
+        opcodes = align_lines(self.lines_orig[orig_start:orig_end], self.lines_updated[updated_start:updated_end])
+        for tag, i1, i2, j1, j2 in opcodes:
+            self.add_op(tag, orig_start + i1, orig_start + i2, updated_start + j1, updated_start + j2)
+        self.orig_pos = orig_end
+        self.updated_pos = updated_end
+
+    def add_op(self, tag, i1, i2, j1, j2):
+        last_op = self.last_op
+        if last_op and last_op[0] == tag == "equal":
+            self.last_op = (tag, last_op[1], i2, last_op[3], j2)
+            return
+
+        if last_op:
+            self.group, self.grouped_any = self.group_op(last_op, self.group, self.hunks, self.grouped_any)
+        self.last_op = (tag, i1, i2, j1, j2)
+
+    def group_op(self, op, group, hunks, grouped_any, is_last=False):
+        # one step of get_grouped_opcodes(), finished hunks are rendered
+        # onto hunks
+        n = self.context
+        tag, i1, i2, j1, j2 = op
+        if tag == "equal":
+            if not grouped_any:
+                i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+            if is_last:
+                i2, j2 = min(i2, i1 + n), min(j2, j1 + n)
+
+        if tag == "equal" and i2 - i1 > n + n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            hunks.append(format_hunk(group, self.lines_orig, self.lines_updated))
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+        return group, True
+
+    def show(self, final=False):
+        """
+        The diff so far, shown as diff_partial_update() shows it. final
+        should only be set after finish(), and gives exactly the diff of
+        diff_partial_update(final=True), as the whole update is aligned
+        once it's complete.
+        """
+
+        if final:
+            return diff_partial_update(self.lines_orig, self.lines_updated, final=True)
+
+        num_orig_lines = len(self.lines_orig)
+        last_non_deleted = self.last_non_deleted
+        if last_non_deleted is None:
+            return ""
+
+        # the pending lines and the progress bar, past the last anchor
+        bar = format_progress(last_non_deleted, num_orig_lines)
+        ops = [self.last_op] if self.last_op else []
+        ops.append(("insert", self.orig_pos, self.orig_pos, self.updated_pos, len(self.lines_updated) + 1))
+
+        group = list(self.group)
+        grouped_any = self.grouped_any
+        hunks = []
+        for i, op in enumerate(ops):
+            group, grouped_any = self.group_op(op, group, hunks, grouped_any, is_last=i == len(ops) - 1)
+        if group and not (len(group) == 1 and group[0][0] == "equal"):
+            hunks.append(format_hunk(group, self.lines_orig, self.lines_updated, bar))
+
+        return fence_diff("".join(self.hunks + hunks))
+
+
+class WholeFilePreview:
+    """
+    Shows a streaming "whole" format reply with each file listing replaced
+    by its diff against the original. Each update() only parses the lines
+    added since the last one, and each original is read once.
+    """
+
+    def __init__(self, root, chat_files):
+        self.root = root
+        self.chat_files = chat_files
+        self.originals = dict()
+
+        # offset in the reply of the first line which isn't parsed yet
+        self.pos = 0
+        self.prev_line = None
+        self.output = []
+        self.fname = None
+        self.diff = None
+        self.error = None
+
+    def update(self, content):
+        """
+        The reply to show for content, which must extend the content of the
+        previous call. Raises ValueError for malformed file listings.
+        """
+
+        if not self.chat_files:
+            return content
+        if self.error:
+            raise self.error
+
+        try:
+            while True:
+                eol = content.find("\n", self.pos)
+                if eol < 0:
+                    break
+                self.add_line(content[self.pos : eol + 1])
+                self.pos = eol + 1
+        except ValueError as err:
+            self.error = err
+            raise
+
+        tail = []
+        partial = content[self.pos :]
+        if self.fname:
+            tail = self.show_diff(self.diff.show())
+        elif partial and not partial.startswith("```"):
+            tail = [partial]
+
+        return "\n".join(self.output + tail)
+
+    def add_line(self, line):
+        if line.startswith("```"):
+            if self.fname:
+                # ending an existing block
+                self.diff.finish()
+                self.output += self.show_diff(self.diff.show(final=True))
+                self.fname = None
+                self.diff = None
+            else:
+                # starting a new block
+                if self.prev_line is None:
+                    raise ValueError("No filename provided before ``` block")
+
+                fname = self.prev_line.strip()
+                if fname not in self.chat_files:
+                    if len(self.chat_files) == 1:
+                        fname = list(self.chat_files)[0]
+                    else:
+                        show_chat_files = " ".join(self.chat_files)
+                        raise ValueError(f"{fname} is not one of: {show_chat_files}")
+
+                self.fname = fname
+                self.diff = PartialDiff(self.get_original(fname))
+        elif self.fname:
+            self.diff.add_line(line)
+        else:
+            # output is joined back up with newlines
+            self.output.append(line.rstrip("\n"))
+
+        self.prev_line = line
+
+    def show_diff(self, show):
+        # as the lines of show would be joined back up
+        if not show:
+            return []
+        return [show[:-1]]
+
+    def get_original(self, fname):
+        lines = self.originals.get(fname)
+        if lines is None:
+            full_path = os.path.abspath(os.path.join(self.root, fname))
+            try:
+                with open(full_path, "r") as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                lines = []
+            self.originals[fname] = lines
+        return lines
 
 
 if __name__ == "__main__":
@@ -0,0 +1,284 @@
+from difflib import SequenceMatcher
+
+MOD = (1 << 61) - 1
+BASE = 1_000_003
+
+# how many places a block may be tried at when it has no exact match, and
+# how close the best of them has to be
+MAX_FUZZY_CANDIDATES = 64
+FUZZY_THRESHOLD = 0.9
+
+# anchor lines tried per block when looking for fuzzy candidates
+NUM_FUZZY_ANCHORS = 3
+
+
+def hash_lines(keys):
+    """Prefix hashes of keys, so any run of keys hashes in constant time."""
+    prefix = [0]
+    for key in keys:
+        prefix.append((prefix[-1] * BASE + (hash(key) & MOD)) % MOD)
+    return prefix
+
+
+def hash_keys(keys):
+    h = 0
+    for key in keys:
+        h = (h * BASE + (hash(key) & MOD)) % MOD
+    return h
+
+
+def get_indent(line):
+    return line[: len(line) - len(line.lstrip())]
+
+
+class EditIndex:
+    """
+    Finds where the ORIGINAL lines of an edit block are in a file, without
+    scanning the whole file per block.
+
+    Lines are indexed by their stripped text, and every run of lines can be
+    hashed in constant time from prefix hashes. A block is looked for at the
+    places where its rarest line occurs, first with trailing whitespace
+    ignored, then with all indentation ignored, and last by fuzzy scoring a
+    bounded number of candidate runs.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.exact_keys = [line.rstrip() for line in lines]
+        self.loose_keys = [key.lstrip() for key in self.exact_keys]
+        self.exact_hashes = hash_lines(self.exact_keys)
+        self.loose_hashes = hash_lines(self.loose_keys)
+
+        self.positions = dict()
+        for i, key in enumerate(self.loose_keys):
+            self.positions.setdefault(key, []).append(i)
+
+        self.powers = [1]
+        self.num_lines = len(lines)
+
+    def get_power(self, n):
+        while len(self.powers) <= n:
+            self.powers.append(self.powers[-1] * BASE % MOD)
+        return self.powers[n]
+
+    def get_hash(self, prefix, start, end):
+        return (prefix[end] - prefix[start] * self.get_power(end - start)) % MOD
+
+    def get_anchors(self, loose_keys):
+        # offsets of the block's non blank lines, rarest in the file first
+        offsets = [i for i, key in enumerate(loose_keys) if key]
+        return sorted(offsets, key=lambda i: len(self.positions.get(loose_keys[i], ())))
+
+    def get_candidates(self, loose_keys, anchor):
+        num = len(loose_keys)
+        for pos in self.positions.get(loose_keys[anchor], ()):
+            start = pos - anchor
+            if start >= 0 and start + num <= self.num_lines:
+                yield start
+
+    def find(self, original_lines):
+        """
+        Yield (start, exact) for the runs of lines which original_lines
+        matches, best match first. exact is false when only the stripped
+        lines match. A fuzzy match comes last, and only if there is no
+        other.
+        """
+
+        num = len(original_lines)
+        if not num or num > self.num_lines:
+            return
+
+        exact_keys = [line.rstrip() for line in original_lines]
+        loose_keys = [key.lstrip() for key in exact_keys]
+        anchors = self.get_anchors(loose_keys)
+
+        if anchors:
+            starts = list(self.get_candidates(loose_keys, anchors[0]))
+        else:
+            # only blank lines, any run of the right length might do
+            starts = range(self.num_lines - num + 1)
+
+        exact_hash = hash_keys(exact_keys)
+        loose_hash = hash_keys(loose_keys)
+
+        loose_starts = []
+        found = False
+        for start in starts:
+            end = start + num
+            if self.get_hash(self.exact_hashes, start, end) == exact_hash and self.exact_keys[start:end] == exact_keys:
+                found = True
+                yield start, True
+            elif self.get_hash(self.loose_hashes, start, end) == loose_hash and self.loose_keys[start:end] == loose_keys:
+                loose_starts.append(start)
+
+        for start in loose_starts:
+            found = True
+            yield start, False
+
+        if found or not anchors:
+            return
+
+        match = self.find_fuzzy(loose_keys, anchors)
+        if match is not None:
+            yield match, False
+
+    def find_fuzzy(self, loose_keys, anchors):
+        starts = []
+        for anchor in anchors[:NUM_FUZZY_ANCHORS]:
+            for start in self.get_candidates(loose_keys, anchor):
+                if start not in starts:
+                    starts.append(start)
+                if len(starts) >= MAX_FUZZY_CANDIDATES:
+                    break
+
+        original = "\n".join(loose_keys)
+        best_start = None
+        best_ratio = FUZZY_THRESHOLD
+        for start in starts:
+            matcher = SequenceMatcher(None, "\n".join(self.loose_keys[start : start + len(loose_keys)]), original)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best_start = start
+                best_ratio = ratio
+        return best_start
+
+
+def reindent(original_lines, matched_lines, updated_lines):
+    """
+    updated_lines, shifted by however much more the matched lines are
+    indented than original_lines, if that's the same for all of them.
+    """
+
+    prefix = None
+    for original, matched in zip(original_lines, matched_lines):
+        if not original.strip():
+            continue
+        original_indent = get_indent(original)
+        matched_indent = get_indent(matched)
+        if not matched_indent.endswith(original_indent):
+            return updated_lines
+        extra = matched_indent[: len(matched_indent) - len(original_indent)]
+        if prefix is None:
+            prefix = extra
+        elif extra != prefix:
+            return updated_lines
+
+    if not prefix:
+        return updated_lines
+    return [prefix + line if line.strip() else line for line in updated_lines]
+
+
+class IndexedFile:
+    """
+    The content of one file while the edit blocks of a reply get applied
+    to it. The file is indexed once, and edits are kept as replaced runs of
+    the indexed lines, so each block is located in the index rather than
+    in the edited text. Only a block which matches none of the indexed
+    lines left untouched, or which also matches the text around an earlier
+    edit, makes it reindex the edited text. Blocks end up where they would
+    have been applied one at a time to the edited text.
+    """
+
+    def __init__(self, content):
+        self.reset(content)
+
+    def reset(self, content):
+        self.index = EditIndex(content.splitlines(keepends=True))
+        # (start, end, lines) runs of index lines replaced so far, by start
+        self.edits = []
+
+    def get_content(self):
+        lines = self.index.lines
+        pieces = []
+        pos = 0
+        for start, end, new_lines in self.edits:
+            pieces.extend(lines[pos:start])
+            pieces.extend(new_lines)
+            pos = end
+        pieces.extend(lines[pos:])
+        return "".join(pieces)
+
+    def overlaps(self, start, end):
+        return any(start < edit_end and edit_start < end for edit_start, edit_end, _ in self.edits)
+
+    def replace(self, original, updated):
+        """Replace original with updated, return False if original can't be found."""
+        if not original.strip():
+            content = self.get_content()
+            if content and not content.endswith("\n"):
+                content += "\n"
+            self.reset(content + updated)
+            return True
+
+        # the text an earlier edit added or joined up comes first wherever
+        # it is earlier in the file, and the index doesn't have it
+        if self.matches_edited_text(original):
+            self.reset(self.get_content())
+
+        if self.replace_indexed(original, updated):
+            return True
+
+        # original might be part of a line, span an earlier edit, or be text
+        # an edit added
+        content = self.get_content()
+        if original in content:
+            self.reset(content.replace(original, updated, 1))
+            return True
+        if not self.edits:
+            return False
+
+        self.reset(content)
+        return self.replace_indexed(original, updated)
+
+    def matches_edited_text(self, original):
+        """Whether original matches a run of the edited text which might include edited lines."""
+        if not self.edits:
+            return False
+
+        keys = [line.strip() for line in original.splitlines()]
+        num = len(keys)
+        lines = self.index.loose_keys
+
+        # each edit with the num - 1 lines on either side of it, edits closer
+        # than that share one window
+        windows = []
+        window = None
+        pos = 0
+        for start, end, new_lines in self.edits:
+            if window is None or start - pos >= num:
+                if window is not None:
+                    window.extend(lines[pos : pos + num - 1])
+                window = lines[max(pos, start - num + 1) : start]
+                windows.append(window)
+            else:
+                window.extend(lines[pos:start])
+            window.extend(line.strip() for line in new_lines)
+            pos = end
+        window.extend(lines[pos : pos + num - 1])
+
+        return any(window[i : i + num] == keys for window in windows for i in range(len(window) - num + 1))
+
+    def replace_indexed(self, original, updated):
+        original_lines = original.splitlines(keepends=True)
+        num = len(original_lines)
+
+        for start, exact in self.index.find(original_lines):
+            end = start + num
+            if self.overlaps(start, end):
+                continue
+
+            matched_lines = self.index.lines[start:end]
+            updated_lines = updated.splitlines(keepends=True)
+            if not exact:
+                updated_lines = reindent(original_lines, matched_lines, updated_lines)
+            if updated_lines and not updated_lines[-1].endswith("\n") and matched_lines[-1].endswith("\n"):
+                updated_lines[-1] += "\n"
+
+            self.edits.append((start, end, updated_lines))
+            self.edits.sort(key=lambda edit: edit[0])
+            return True
+
+        return False
@@ -0,0 +1,214 @@
+import os
+import re
+from pathlib import Path
+
+from .editmatch import IndexedFile
+
+HEAD = re.compile(r"^<{5,9} (ORIGINAL|SEARCH)\s*$")
+DIVIDER = re.compile(r"^={5,9}\s*$")
+UPDATED = re.compile(r"^>{5,9} (UPDATED|REPLACE)\s*$")
+
+
+def strip_filename(line):
+    return line.strip().strip("*`:#").strip()
+
+
+def replace_block(content, original, updated):
+    """
+    content with original replaced by updated, or None if original isn't
+    in content. An empty original appends updated, which is how new files
+    are created.
+    """
+
+    indexed = IndexedFile(content)
+    if not indexed.replace(original, updated):
+        return
+    return indexed.get_content()
+
+
+class EditBlockParser:
+    """
+    Parses ORIGINAL/UPDATED (or SEARCH/REPLACE) edit blocks out of a reply
+    while it streams in. feed() gets the whole reply so far and returns the
+    blocks completed since the last call, only looking at the new complete
+    lines. Malformed blocks raise ValueError, from then on and from finish().
+    """
+
+    def __init__(self):
+        self.pos = 0
+        self.error = None
+
+        self.state = None
+        self.fname = None
+        self.original = []
+        self.updated = []
+        # the last two lines outside of a block, the filename comes before
+        # the block, possibly with a ``` fence in between
+        self.prev_lines = ["", ""]
+
+    def feed(self, text):
+        if self.error:
+            raise self.error
+
+        blocks = []
+        while True:
+            eol = text.find("\n", self.pos)
+            if eol < 0:
+                break
+            line = text[self.pos : eol + 1]
+            self.pos = eol + 1
+
+            try:
+                block = self.add_line(line)
+            except ValueError as err:
+                self.error = err
+                raise
+            if block:
+                blocks.append(block)
+        return blocks
+
+    def finish(self, text):
+        if not text.endswith("\n"):
+            text += "\n"
+        blocks = self.feed(text)
+        if self.state:
+            self.error = ValueError(f"Incomplete edit block for {self.fname}, missing the closing >>>>>>> UPDATED")
+            raise self.error
+        return blocks
+
+    def add_line(self, line):
+        stripped = line.rstrip("\r\n")
+
+        if self.state is None:
+            if HEAD.match(stripped):
+                fname = self.prev_lines[-1]
+                if fname.strip().startswith("```"):
+                    fname = self.prev_lines[-2]
+                fname = strip_filename(fname)
+                if not fname:
+                    raise ValueError("Missing the filename before an edit block")
+                self.fname = fname
+                self.state = "original"
+            elif DIVIDER.match(stripped) or UPDATED.match(stripped):
+                raise ValueError(f"Found {stripped} outside of an edit block")
+            elif stripped.strip():
+                self.prev_lines = [self.prev_lines[-1], stripped]
+            return
+
+        if HEAD.match(stripped):
+            raise ValueError(f"Edit block for {self.fname} started again before it was finished")
+
+        if self.state == "original":
+            if DIVIDER.match(stripped):
+                self.state = "updated"
+            elif UPDATED.match(stripped):
+                raise ValueError(f"Edit block for {self.fname} is missing its ======= divider")
+            else:
+                self.original.append(line)
+            return
+
+        if DIVIDER.match(stripped):
+            raise ValueError(f"Edit block for {self.fname} has more than one ======= divider")
+        if not UPDATED.match(stripped):
+            self.updated.append(line)
+            return
+
+        block = (self.fname, "".join(self.original), "".join(self.updated))
+        self.state = None
+        self.fname = None
+        self.original = []
+        self.updated = []
+        self.prev_lines = ["", ""]
+        return block
+
+
+class StreamingEdits:
+    """
+    Applies edit blocks to the working tree as they stream in, so the files
+    are ready as soon as the reply is. Blocks for files where can_apply(path)
+    is false are deferred to the end, along with any later blocks for the
+    same file so edits stay in order. The blocks of one update() are
+    written out once per file they touched. Every file keeps its content
+    from before its first edit, and rollback() puts them all back.
+    """
+
+    def __init__(self, root, can_apply, dry_run=False):
+        self.root = root
+        self.can_apply = can_apply
+        self.dry_run = dry_run
+
+        self.parser = EditBlockParser()
+        self.deferred = []
+        # full path -> content before the first edit, None if it didn't exist
+        self.backups = dict()
+        # full path -> IndexedFile, each file is indexed once per reply
+        self.files = dict()
+        # (path, applied) for each block that was tried, in order
+        self.results = []
+
+    def update(self, text):
+        # a malformed block stops the streaming, finish() reports it
+        try:
+            blocks = self.parser.feed(text)
+        except ValueError:
+            return
+
+        self.add_blocks(blocks)
+
+    def finish(self, text):
+        """Apply what's left of the reply, and return the deferred blocks."""
+        self.add_blocks(self.parser.finish(text))
+        return self.deferred
+
+    def add_blocks(self, blocks):
+        touched = set()
+        for block in blocks:
+            path = block[0]
+            if self.can_apply(path) and not any(path == deferred[0] for deferred in self.deferred):
+                if self.edit(*block):
+                    touched.add(self.get_full_path(path))
+            else:
+                self.deferred.append(block)
+        self.write(touched)
+
+    def get_full_path(self, path):
+        return os.path.abspath(os.path.join(self.root, path))
+
+    def apply(self, path, original, updated):
+        applied = self.edit(path, original, updated)
+        if applied:
+            self.write([self.get_full_path(path)])
+        return applied
+
+    def edit(self, path, original, updated):
+        full_path = self.get_full_path(path)
+        indexed = self.files.get(full_path)
+        if not indexed:
+            content = Path(full_path).read_text() if Path(full_path).exists() else None
+            self.backups.setdefault(full_path, content)
+            indexed = self.files[full_path] = IndexedFile(content or "")
+
+        applied = indexed.replace(original, updated)
+        self.results.append((path, applied))
+        return applied
+
+    def write(self, full_paths):
+        if self.dry_run:
+            return
+        for full_path in full_paths:
+            Path(full_path).parent.mkdir(parents=True, exist_ok=True)
+            Path(full_path).write_text(self.files[full_path].get_content())
+
+    def rollback(self):
+        if not self.dry_run:
+            for full_path, content in self.backups.items():
+                if content is None:
+                    if os.path.exists(full_path):
+                        os.remove(full_path)
+                else:
+                    Path(full_path).write_text(content)
+
+        self.backups = dict()
+        self.files = dict()
+        self.deferred = []
+        self.results = []
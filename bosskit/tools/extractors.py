@@ -0,0 +1,170 @@
+import io
+import keyword
+import os
+import re
+import tokenize
+
+# Fast identifier extractors for the languages that make up most repos.
+# Each one takes the file content and returns a dict of ident -> count in
+# order of first use, or None to fall back to the pygments lexer.
+
+IDENT_EXTRACTORS = dict()
+
+
+def register_ident_extractor(suffixes, extractor):
+    for suffix in suffixes:
+        IDENT_EXTRACTORS[suffix.lower()] = extractor
+
+
+def get_ident_extractor(fname):
+    suffix = os.path.splitext(fname)[1].lower()
+    return IDENT_EXTRACTORS.get(suffix)
+
+
+def count_idents(idents, skip=()):
+    counts = dict()
+    for ident in idents:
+        if ident in skip:
+            continue
+        counts[ident] = counts.get(ident, 0) + 1
+    return counts
+
+
+PYTHON_SKIP = set(keyword.kwlist)
+
+PYTHON_NAME = re.compile(r"[A-Za-z_]\w*")
+QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"")
+FSTRING_FIELD = re.compile(r"\{([^{}]*)\}")
+# the !r conversion and :>10 format spec trailing a replacement field
+FSTRING_SPEC = re.compile(r"(?:![rsa])?(?::[^\])]*)?$")
+
+
+def get_fstring_idents(token):
+    # before 3.12 tokenize hands back f-strings as one STRING token, so the
+    # names used in their replacement fields have to be dug out by hand
+    body = token.replace("{{", "").replace("}}", "")
+    for field in FSTRING_FIELD.findall(body):
+        field = FSTRING_SPEC.sub("", QUOTED.sub("", field))
+        yield from PYTHON_NAME.findall(field)
+
+
+def extract_python_idents(content):
+    readline = io.StringIO(content).readline
+    idents = []
+    try:
+        for tok in tokenize.generate_tokens(readline):
+            if tok.type == tokenize.NAME:
+                idents.append(tok.string)
+            elif tok.type == tokenize.STRING:
+                prefix = tok.string[: tok.string.find(tok.string[-1])]
+                if "f" in prefix.lower():
+                    idents.extend(get_fstring_idents(tok.string))
+    except (tokenize.TokenError, SyntaxError):
+        return
+
+    return count_idents(idents, PYTHON_SKIP)
+
+
+def make_scanner(skip_preprocessor, template_strings):
+    # One alternation which consumes comments, strings and numbers whole, so
+    # that only real identifiers are left in the ident group.
+    parts = [
+        r"//[^\n]*",
+        r"/\*.*?(?:\*/|\Z)",
+        r'"(?:[^"\\\n]|\\.)*"',
+        r"'(?:[^'\\\n]|\\.)*'",
+    ]
+    if template_strings:
+        parts.append(r"(?P<template>`(?:[^`\\]|\\.)*`)")
+    if skip_preprocessor:
+        parts.append(r"^[ \t]*#(?:\\\n|[^\n])*")
+    parts.append(r"\.?[0-9][\w.]*")
+    parts.append(r"(?P<ident>[A-Za-z_$][\w$]*)")
+
+    return re.compile("|".join(parts), re.DOTALL | re.MULTILINE)
+
+
+TEMPLATE_FIELD = re.compile(r"\$\{([^{}]*)\}")
+
+
+def make_scanner_extractor(scanner, keywords):
+    keywords = frozenset(keywords)
+
+    def scan(content):
+        for m in scanner.finditer(content):
+            if m.group("ident"):
+                yield m.group("ident")
+            elif m.lastgroup == "template":
+                for field in TEMPLATE_FIELD.findall(m.group("template")):
+                    yield from scan(field)
+
+    def extract(content):
+        return count_idents(scan(content), keywords)
+
+    return extract
+
+
+C_KEYWORDS = """
+auto break case char const continue default do double else enum extern float for goto if
+inline int long register restrict return short signed sizeof static struct switch typedef
+union unsigned void volatile while _Bool _Complex _Imaginary _Alignas _Alignof _Atomic
+_Generic _Noreturn _Static_assert _Thread_local
+""".split()
+
+CPP_KEYWORDS = (
+    C_KEYWORDS
+    + """
+alignas alignof and and_eq asm bitand bitor bool catch char8_t char16_t char32_t class
+compl concept consteval constexpr constinit const_cast co_await co_return co_yield decltype
+delete dynamic_cast explicit export false friend mutable namespace new noexcept not not_eq
+nullptr operator or or_eq private protected public reinterpret_cast requires static_assert
+static_cast template this thread_local throw true try typeid typename using virtual wchar_t
+xor xor_eq override final
+""".split()
+)
+
+JAVA_KEYWORDS = """
+abstract assert boolean break byte case catch char class const continue default do double
+else enum extends final finally float for goto if implements import instanceof int interface
+long native new package private protected public return short static strictfp super switch
+synchronized this throw throws transient try void volatile while true false null var record
+sealed permits yield
+""".split()
+
+CSHARP_KEYWORDS = """
+abstract as base bool break byte case catch char checked class const continue decimal default
+delegate do double else enum event explicit extern false finally fixed float for foreach goto
+if implicit in int interface internal is lock long namespace new null object operator out
+override params private protected public readonly ref return sbyte sealed short sizeof
+stackalloc static string struct switch this throw true try typeof uint ulong unchecked unsafe
+ushort using virtual void volatile while var async await get set value
+""".split()
+
+JS_KEYWORDS = """
+break case catch class const continue debugger default delete do else export extends false
+finally for function if import in instanceof let new null return super switch this throw true
+try typeof var void while with yield async await of static get set undefined from
+""".split()
+
+TS_KEYWORDS = (
+    JS_KEYWORDS
+    + """
+abstract any as boolean constructor declare enum implements interface is keyof module
+namespace never number private protected public readonly require string symbol type unknown
+""".split()
+)
+
+c_scanner = make_scanner(skip_preprocessor=True, template_strings=False)
+java_scanner = make_scanner(skip_preprocessor=False, template_strings=False)
+js_scanner = make_scanner(skip_preprocessor=False, template_strings=True)
+
+register_ident_extractor([".py", ".pyi", ".pyw"], extract_python_idents)
+register_ident_extractor([".c", ".h"], make_scanner_extractor(c_scanner, C_KEYWORDS))
+register_ident_extractor(
+    [".cc", ".cpp", ".cxx", ".c++", ".hh", ".hpp", ".hxx", ".h++"],
+    make_scanner_extractor(c_scanner, CPP_KEYWORDS),
+)
+register_ident_extractor([".cs"], make_scanner_extractor(c_scanner, CSHARP_KEYWORDS))
+register_ident_extractor([".java"], make_scanner_extractor(java_scanner, JAVA_KEYWORDS))
+register_ident_extractor([".js", ".jsx", ".mjs", ".cjs"], make_scanner_extractor(js_scanner, JS_KEYWORDS))
+register_ident_extractor([".ts", ".tsx", ".mts", ".cts"], make_scanner_extractor(js_scanner, TS_KEYWORDS))
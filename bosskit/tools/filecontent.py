@@ -0,0 +1,53 @@
+import os
+
+
+class QuotedFile:
+    __slots__ = ("key", "block", "tokens")
+
+    def __init__(self, key, block):
+        self.key = key
+        self.block = block
+        # counted on first use
+        self.tokens = None
+
+
+class QuotedFileCache:
+    """
+    The quoted prompt block of each chat file, only rebuilt once the file's
+    size or mtime changes, along with its token count. quote(fname,
+    rel_fname) builds a block.
+    """
+
+    def __init__(self, quote):
+        self.quote = quote
+        # abs fname -> QuotedFile
+        self.entries = dict()
+
+    def get(self, fname, rel_fname):
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            # let quote() report it
+            return QuotedFile(None, self.quote(fname, rel_fname))
+
+        # stat before reading, so a write racing with quote() is seen next time
+        key = (rel_fname, stat.st_size, stat.st_mtime_ns)
+        entry = self.entries.get(fname)
+        if entry is None or entry.key != key:
+            entry = QuotedFile(key, self.quote(fname, rel_fname))
+            self.entries[fname] = entry
+        return entry
+
+    def get_block(self, fname, rel_fname):
+        return self.get(fname, rel_fname).block
+
+    def get_tokens(self, fname, rel_fname, count_tokens):
+        entry = self.get(fname, rel_fname)
+        if entry.tokens is None:
+            entry.tokens = count_tokens(entry.block)
+        return entry.tokens
+
+    def prune(self, fnames):
+        # forget files which left the chat
+        for fname in set(self.entries) - set(fnames):
+            del self.entries[fname]
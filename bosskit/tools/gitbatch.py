@@ -0,0 +1,70 @@
+import threading
+
+UNTRACKED = "??"
+
+
+class GitBatch:
+    """
+    The git queries Coder makes around each commit, each answered in one
+    round trip however many files or commits are involved. Revisions are
+    resolved through GitPython's long lived `git cat-file --batch-check`
+    process, the dirty files come from a single `git status --porcelain=v2`
+    and the diffs of any number of files from a single `git diff`.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        # the cat-file process is shared and takes one request at a time
+        self.lock = threading.Lock()
+
+    def resolve(self, rev):
+        """The sha rev points at, or None if it doesn't exist yet."""
+        with self.lock:
+            try:
+                hexsha, _kind, _size = self.repo.git.get_object_header(rev)
+            except ValueError:
+                return None
+        return hexsha.decode()
+
+    def head_exists(self):
+        # False until the first commit
+        return self.resolve("HEAD") is not None
+
+    def get_status(self, untracked=True):
+        """
+        {rel_fname: XY status code} of every file which differs between
+        HEAD, the index and the working tree, with untracked files as "??".
+        """
+
+        untracked_files = "all" if untracked else "no"
+        output = self.repo.git.status("--porcelain=v2", "-z", f"--untracked-files={untracked_files}")
+
+        status = dict()
+        entries = iter(output.split("\0"))
+        for entry in entries:
+            kind = entry[:1]
+            if kind == "1":
+                fields = entry.split(" ", 8)
+            elif kind == "2":
+                fields = entry.split(" ", 9)
+                # the path it was renamed or copied from
+                next(entries, None)
+            elif kind == "u":
+                fields = entry.split(" ", 10)
+            elif kind == "?":
+                status[entry[2:]] = UNTRACKED
+                continue
+            else:
+                continue
+            status[fields[-1]] = fields[1]
+        return status
+
+    def is_dirty(self):
+        # like Repo.is_dirty(), ignoring untracked files
+        return bool(self.get_status(untracked=False))
+
+    def get_diff(self, rel_fnames, *args):
+        """One diff of all of rel_fnames, args go before the paths."""
+        if not rel_fnames:
+            return ""
+        return self.repo.git.diff(*args, "--", *rel_fnames)
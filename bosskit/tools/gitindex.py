@@ -0,0 +1,67 @@
+import os
+
+
+class GitFileIndex:
+    """
+    The files tracked by a git repo, from a single `git ls-files -z` which is
+    only rerun once the index file changes. git rewrites the index on add,
+    rm, commit, checkout and the like, so its mtime and size tell when the
+    listing may be stale. The sorted list, the set and the lookup by
+    basename are all answered from memory.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.index_fname = os.path.join(repo.git_dir, "index")
+
+        self.stamp = None
+        self.files = None
+        self.file_set = frozenset()
+        self.basenames = dict()
+        # how many times ls-files ran
+        self.num_loads = 0
+
+    def get_stamp(self):
+        try:
+            stat = os.stat(self.index_fname)
+        except FileNotFoundError:
+            # there is no index until something is added
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        # stat before listing, so a change racing with ls-files is seen next time
+        stamp = self.get_stamp()
+        if self.files is not None and stamp == self.stamp:
+            return
+
+        files = self.repo.git.ls_files("-z").split("\0")
+        self.files = sorted(set(fname for fname in files if fname))
+        self.file_set = frozenset(self.files)
+
+        self.basenames = dict()
+        for fname in self.files:
+            self.basenames.setdefault(os.path.basename(fname), []).append(fname)
+
+        self.stamp = stamp
+        self.num_loads += 1
+
+    def invalidate(self):
+        self.files = None
+
+    def get_files(self):
+        """All tracked files, sorted, relative to the root of the repo."""
+        self.refresh()
+        return self.files
+
+    def get_file_set(self):
+        self.refresh()
+        return self.file_set
+
+    def get_by_basename(self, basename):
+        self.refresh()
+        return self.basenames.get(basename, [])
+
+    def __contains__(self, rel_fname):
+        self.refresh()
+        return rel_fname in self.file_set
@@ -0,0 +1,116 @@
+import threading
+
+
+class ChatHistory:
+    """
+    The done messages of a chat, kept within max_tokens.
+
+    Token counts are kept per message, so adding a turn only counts that
+    turn. Once the history is over budget, the oldest turns get summarized
+    by summarize(messages) on a background thread while the chat goes on,
+    and the summary is swapped in for them in one step, as long as those
+    turns are still at the front of the history. If summaries can't keep
+    up, or keep failing, the oldest turns are dropped once the history
+    gets to twice its budget, so requests stay bounded either way.
+    """
+
+    def __init__(self, count_tokens, summarize, max_tokens, summary_prefix=""):
+        self.count_tokens = count_tokens
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.summary_prefix = summary_prefix
+
+        # guards messages and counts, which are only ever replaced whole
+        self.lock = threading.Lock()
+        self.messages = []
+        self.counts = []
+        self.thread = None
+        # the message holding the latest summary
+        self.summary = None
+
+    def get_messages(self):
+        return list(self.messages)
+
+    def get_tokens(self):
+        return sum(self.counts)
+
+    def clear(self):
+        self.reset([])
+
+    def reset(self, messages):
+        counts = [self.count_tokens(message) for message in messages]
+        with self.lock:
+            self.messages = list(messages)
+            self.counts = counts
+
+    def extend(self, messages):
+        counts = [self.count_tokens(message) for message in messages]
+        with self.lock:
+            self.messages = self.messages + list(messages)
+            self.counts = self.counts + counts
+            if sum(self.counts) > 2 * self.max_tokens:
+                self.drop_oldest()
+            if sum(self.counts) > self.max_tokens:
+                self.start_summary()
+
+    def find_split(self, max_tokens):
+        """
+        The start of the oldest turn from which the history fits into
+        max_tokens, or its length if even the last turn doesn't fit.
+        """
+
+        split = len(self.messages)
+        tokens = 0
+        for i in range(len(self.messages) - 1, -1, -1):
+            tokens += self.counts[i]
+            if tokens > max_tokens:
+                break
+            if self.messages[i]["role"] == "user":
+                split = i
+        return split
+
+    def drop_oldest(self):
+        split = self.find_split(self.max_tokens)
+        self.messages = self.messages[split:]
+        self.counts = self.counts[split:]
+
+    def start_summary(self):
+        if self.thread and self.thread.is_alive():
+            return
+
+        # summarize enough to leave room for a few more turns
+        split = self.find_split(self.max_tokens // 2)
+        if split < 2 or (split == 2 and self.messages[0] is self.summary):
+            return
+
+        head = self.messages[:split]
+        self.thread = threading.Thread(target=self.run_summary, args=(head,), daemon=True)
+        self.thread.start()
+
+    def run_summary(self, head):
+        try:
+            summary = self.summarize(head)
+        except Exception:  # noqa: BLE001
+            # try again once the history grows
+            return
+        if not summary:
+            return
+
+        summary_messages = [
+            dict(role="user", content=self.summary_prefix + summary),
+            dict(role="assistant", content="Ok."),
+        ]
+        counts = [self.count_tokens(message) for message in summary_messages]
+
+        with self.lock:
+            # turns were dropped, or the history was cleared, meanwhile
+            if len(self.messages) < len(head) or any(a is not b for a, b in zip(head, self.messages)):
+                return
+            self.messages = summary_messages + self.messages[len(head) :]
+            self.counts = counts + self.counts[len(head) :]
+            self.summary = summary_messages[0]
+
+    def wait(self):
+        thread = self.thread
+        if thread:
+            thread.join()
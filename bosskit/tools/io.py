@@ -123,10 +123,10 @@ class InputOutput:
 
         self.encoding = encoding
 
-        if pretty:
+        if self.pretty:
             self.console = Console()
         else:
-            self.console = Console(force_terminal=False, no_color=True)
+            self.console = Console(force_terminal=False, no_color=True, file=output)
 
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.append_chat_history(f"\n# bosskit chat started at {current_time}\n\n")
@@ -0,0 +1,108 @@
+import re
+import time
+
+from rich.live import Live
+from rich.markdown import Markdown
+
+FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+LIST_ITEM = re.compile(r"^([-*+]|\d+[.)])\s")
+
+
+def find_frozen_end(text, start=0):
+    """
+    The offset in text up to which the markdown can no longer change as
+    more text is appended, scanning from start which must be a block
+    boundary. A block is only finished once a blank line outside of any
+    code fence is followed by a line that starts a new block, rather than
+    continuing a list or an indented block.
+    """
+
+    frozen_end = start
+    fence = None
+    after_blank = False
+
+    pos = start
+    while True:
+        eol = text.find("\n", pos)
+        if eol < 0:
+            break
+        line = text[pos:eol]
+        line_start = pos
+        pos = eol + 1
+
+        if fence:
+            stripped = line.strip()
+            if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                fence = None
+            continue
+
+        if not line.strip():
+            after_blank = True
+            continue
+
+        if after_blank and not line[0].isspace() and not LIST_ITEM.match(line):
+            frozen_end = line_start
+        after_blank = False
+
+        match = FENCE.match(line)
+        if match:
+            fence = match.group(1)
+
+    return frozen_end
+
+
+class MarkdownStream:
+    """
+    Shows a markdown reply as it streams in. Blocks which are finished get
+    printed once above the live area and are never rendered again, so only
+    the trailing open block is re-rendered on each update, and at most fps
+    times a second.
+
+    The text passed to update() is expected to only grow at the end, apart
+    from its trailing open block.
+    """
+
+    # when the open block gets slow to render (a long code block), back off
+    # so that rendering takes at most this share of the time
+    max_busy = 0.25
+
+    def __init__(self, console=None, style="none", code_theme="default", fps=20):
+        self.style = style
+        self.code_theme = code_theme
+        self.min_delay = 1.0 / fps if fps else 0
+
+        self.live = Live(console=console, vertical_overflow="scroll", auto_refresh=False)
+        self.frozen_end = 0
+        self.last_update = 0
+        self.delay = self.min_delay
+
+    def start(self):
+        self.live.start()
+
+    def stop(self):
+        self.live.stop()
+
+    def render(self, text):
+        return Markdown(text, style=self.style, code_theme=self.code_theme)
+
+    def due(self):
+        # whether update() would redraw now, so callers can skip building text
+        return time.monotonic() - self.last_update >= self.delay
+
+    def update(self, text, final=False):
+        now = time.monotonic()
+        if not final and now - self.last_update < self.delay:
+            return
+        self.last_update = now
+
+        frozen_end = find_frozen_end(text, self.frozen_end)
+        if frozen_end > self.frozen_end:
+            self.live.console.print(self.render(text[self.frozen_end : frozen_end]))
+            # rich puts a blank line between blocks, but not after the last
+            self.live.console.print()
+            self.frozen_end = frozen_end
+
+        self.live.update(self.render(text[self.frozen_end :]), refresh=True)
+
+        render_time = time.monotonic() - now
+        self.delay = max(self.min_delay, render_time / self.max_busy)
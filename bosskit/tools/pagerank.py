@@ -0,0 +1,138 @@
+from collections import deque
+
+import numpy as np
+import scipy.sparse as sparse
+
+
+def weighted_adjacency(src, dst, weights, num_nodes):
+    # parallel edges between the same pair of nodes are summed by the
+    # coo -> csr conversion
+    return sparse.coo_array(
+        (np.asarray(weights, dtype=float), (np.asarray(src), np.asarray(dst))),
+        shape=(num_nodes, num_nodes),
+    ).tocsr()
+
+
+def pagerank(
+    src,
+    dst,
+    weights,
+    num_nodes,
+    personalization=None,
+    alpha=0.85,
+    max_iter=100,
+    tol=1.0e-6,
+    nstart=None,
+):
+    """
+    Personalized PageRank by power iteration over a CSR matrix built from
+    parallel arrays of edges. Mirrors nx.pagerank(G, weight="weight",
+    personalization=p, dangling=p) and returns an array indexed by node.
+
+    Raises ZeroDivisionError if personalization puts no weight on any node,
+    just like networkx does.
+    """
+
+    if not num_nodes:
+        return np.zeros(0)
+
+    A = weighted_adjacency(src, dst, weights, num_nodes)
+    out_weight = np.asarray(A.sum(axis=1)).ravel()
+    is_dangling = out_weight == 0
+
+    # row normalizing A is folded into scaling x on each step, and x @ A is
+    # done as A.T @ x which is the fast direction for csr
+    scale = np.zeros(num_nodes)
+    scale[~is_dangling] = 1.0 / out_weight[~is_dangling]
+    AT = A.T.tocsr()
+
+    if nstart is None:
+        x = np.full(num_nodes, 1.0 / num_nodes)
+    else:
+        x = np.asarray(nstart, dtype=float)
+        x = x / x.sum()
+
+    if personalization is None:
+        p = np.full(num_nodes, 1.0 / num_nodes)
+    else:
+        p = np.asarray(personalization, dtype=float)
+        if p.sum() == 0:
+            raise ZeroDivisionError
+        p = p / p.sum()
+
+    for _ in range(max_iter):
+        xlast = x
+        x = alpha * (AT @ (x * scale) + x[is_dangling].sum() * p) + (1 - alpha) * p
+        err = np.absolute(x - xlast).sum()
+        if err < num_nodes * tol:
+            break
+
+    return x
+
+
+def distribute_rank(ranks, src, dst, weights, num_nodes):
+    """
+    Spread the rank of each source node across its out edges in proportion
+    to their weight. Returns the rank carried by each edge.
+    """
+
+    src = np.asarray(src)
+    weights = np.asarray(weights, dtype=float)
+    if not len(src):
+        return np.zeros(0)
+
+    out_weight = np.bincount(src, weights=weights, minlength=num_nodes)
+    return ranks[src] * weights / out_weight[src]
+
+
+def local_push_pagerank(seeds, out_edges, alpha=0.85, tol=1.0e-4):
+    """
+    Approximate personalized PageRank by local push, in the style of
+    Andersen, Chung & Lang. Only nodes reachable from the seeds are ever
+    visited, so the cost depends on tol and not on the size of the graph.
+
+    seeds maps node -> personalization weight, and out_edges(node) returns
+    a list of (dst, weight, ...) tuples. Like pagerank(), mass that reaches
+    a dangling node goes back to the seeds. A node is only pushed while it
+    holds at least tol of unassigned rank, which bounds the error per node.
+
+    Returns a dict of node -> approximate rank for the visited nodes.
+    """
+
+    total = sum(seeds.values())
+    if not total:
+        raise ZeroDivisionError
+    seeds = {node: weight / total for node, weight in seeds.items() if weight}
+
+    rank = dict()
+    residual = dict(seeds)
+    queue = deque(residual)
+    queued = set(queue)
+
+    def maybe_enqueue(node):
+        if node in queued:
+            return
+        if residual[node] >= tol:
+            queue.append(node)
+            queued.add(node)
+
+    while queue:
+        node = queue.popleft()
+        queued.discard(node)
+
+        mass = residual[node]
+        residual[node] = 0.0
+        rank[node] = rank.get(node, 0.0) + (1 - alpha) * mass
+
+        edges = out_edges(node)
+        if edges:
+            out_weight = sum(edge[1] for edge in edges)
+            targets = [(edge[0], edge[1] / out_weight) for edge in edges]
+        else:
+            targets = seeds.items()
+
+        for dst, share in targets:
+            residual[dst] = residual.get(dst, 0.0) + alpha * mass * share
+            maybe_enqueue(dst)
+
+    return rank
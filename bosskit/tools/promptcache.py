@@ -0,0 +1,139 @@
+import threading
+import time
+
+# how long providers keep a cached prompt prefix after its last use, anthropic's is 5 minutes
+CACHE_TTL = 5 * 60
+
+
+def add_cache_control(messages):
+    # mark the end of messages as a cache breakpoint, without touching the
+    # message dicts which are shared with the chat history
+    if not messages:
+        return
+
+    message = messages[-1]
+    content = message["content"]
+    if isinstance(content, str):
+        content = [dict(type="text", text=content)]
+    else:
+        content = [dict(part) for part in content]
+    content[-1]["cache_control"] = {"type": "ephemeral"}
+    messages[-1] = dict(message, content=content)
+
+
+def has_cache_control(message):
+    content = message["content"]
+    return not isinstance(content, str) and any("cache_control" in part for part in content)
+
+
+class ChatChunks:
+    """
+    The messages of one request, laid out from the most to the least stable
+    so that as much as possible of each request is a prefix of the next one
+    and can be served from the provider's prompt cache: the system prompt,
+    the chat history, the repo map, the chat files, then the reminder and
+    the current exchange. The history only grows between requests, while
+    the files and the map change with every edit, so they come after it.
+
+    Only the system prompt and the history are ever a prefix of the next
+    request, so they are the stable chunks, and the only ones cached.
+    """
+
+    def __init__(self, system=(), done=(), repo=(), chat_files=(), reminder=(), cur=()):
+        self.system = list(system)
+        self.done = list(done)
+        self.repo = list(repo)
+        self.chat_files = list(chat_files)
+        self.reminder = list(reminder)
+        self.cur = list(cur)
+
+    def all_messages(self):
+        return self.system + self.done + self.repo + self.chat_files + self.reminder + self.cur
+
+    def add_cache_control_headers(self):
+        """
+        Add breakpoints at the end of the system prompt and of the history.
+        The next request grows the history, so a breakpoint after it, on
+        the repo map or the chat files, could never be hit.
+        """
+
+        add_cache_control(self.system)
+        add_cache_control(self.done)
+
+    def cacheable_messages(self):
+        # the stable chunks, which is what cache warming resends, whether or
+        # not the provider needs breakpoints
+        return self.system + self.done
+
+
+class CacheWarmer:
+    """
+    Keeps the prompt cache of the last request warm while the user is idle,
+    by resending its cacheable prefix through ping(messages) just before
+    the cache would expire, up to max_pings times.
+    """
+
+    def __init__(self, ping, max_pings, interval=CACHE_TTL - 5):
+        self.ping = ping
+        self.max_pings = max_pings
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.messages = None
+        self.pings_left = 0
+        self.next_ping = None
+        self.num_pings = 0
+        self.thread = None
+        self.stopped = False
+
+    def warm(self, messages):
+        """Start keeping messages warm, they were just sent."""
+        if not self.max_pings:
+            return
+
+        with self.lock:
+            self.messages = messages
+            self.pings_left = self.max_pings
+            self.next_ping = time.monotonic() + self.interval
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def pause(self):
+        # a real request is about to refresh the cache anyway
+        with self.lock:
+            self.messages = None
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.messages = None
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.stopped:
+                    return
+                messages = self.messages
+                delay = None if messages is None else self.next_ping - time.monotonic()
+                if delay is not None and delay <= 0:
+                    self.pings_left -= 1
+                    if self.pings_left:
+                        self.next_ping = time.monotonic() + self.interval
+                    else:
+                        self.messages = None
+
+            if delay is None or delay > 0:
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+
+            try:
+                self.ping(messages)
+                self.num_pings += 1
+            except Exception:  # noqa: BLE001
+                # a failed ping only means the next request pays full price
+                pass
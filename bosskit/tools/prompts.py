@@ -10,6 +10,24 @@ It must describe the changes *which have been made* in the diffs!
 Reply with JUST the commit message, without quotes, comments, questions, etc!
 """
 
+# CHAT HISTORY
+summarize_system = """*Briefly* summarize this partial conversation about programming.
+Include less detail about older parts and more detail about the most recent messages.
+Start a new paragraph every time the topic changes!
+
+This is only part of a longer conversation so *DO NOT* conclude the summary with language like "Finally, ...". Because the conversation continues after the summary.
+The summary *MUST* include the function names, libraries, packages that are being discussed.
+The summary *MUST* include the filenames that are being referenced by the assistant inside the ```...``` fenced code blocks!
+The summaries *MUST NOT* include ```...``` fenced code blocks!
+
+Phrase the summary with the USER in first person, telling the ASSISTANT about the conversation.
+Write *as* the user.
+The user should refer to the assistant as *you*.
+Start the summary with "I asked you...".
+"""
+
+summary_prefix = "I spoke to you previously about a number of things.\n"
+
 # COMMANDS
 undo_command_reply = "I did `git reset --hard HEAD~1` to discard the last edits."
 
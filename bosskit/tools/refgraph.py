@@ -0,0 +1,222 @@
+from array import array
+from collections import defaultdict
+
+import numpy as np
+
+
+class Tag:
+    """
+    One definition found by ctags, as a (rel_fname[, scope], kind, name)
+    record. Kept as a slotted object rather than a tuple per definition, and
+    only turned back into a tuple for the tags that make it into the map.
+    """
+
+    __slots__ = ("rel_fname", "scope", "kind", "name")
+
+    def __init__(self, rel_fname, scope, kind, name):
+        self.rel_fname = rel_fname
+        self.scope = scope
+        self.kind = kind
+        self.name = name
+
+    @classmethod
+    def from_tuple(cls, tag):
+        if len(tag) == 4:
+            return cls(*tag)
+        rel_fname, kind, name = tag
+        return cls(rel_fname, None, kind, name)
+
+    def to_tuple(self):
+        if self.scope:
+            return (self.rel_fname, self.scope, self.kind, self.name)
+        return (self.rel_fname, self.kind, self.name)
+
+
+class RefGraph:
+    """
+    The defines/references index behind the repo map, kept up to date one
+    file at a time. Replacing a file only touches the idents that file
+    defines or references, and only those idents have their edges rebuilt.
+
+    Files and idents are interned to small integer ids, and everything past
+    update_file() works in terms of those ids.
+    """
+
+    def __init__(self):
+        # interning tables, ids are never reused
+        self.file_ids = dict()
+        self.files = []
+        self.ident_ids = dict()
+        self.idents = []
+        # and (file id, ident id) definitions, so ranks can be summed into
+        # them by id
+        self.definition_ids = dict()
+        self.definitions = []
+
+        # per file state, by file id
+        self.mtimes = dict()
+        # the generation each file was last updated in
+        self.file_generations = dict()
+        # file id -> {ident id: (Tag, ...)}
+        self.file_definitions = dict()
+        # file id -> (array of ident ids, array of counts)
+        self.file_references = dict()
+
+        # ident id -> set of file ids which define it
+        self.defines = defaultdict(set)
+        # ident id -> {file id: number of references}
+        self.references = defaultdict(dict)
+
+        # ident id -> (referencer ids, definer ids, num_refs, definition ids) arrays
+        self.ident_edges = dict()
+        self.dirty_idents = set()
+
+        # bumped on every change, so callers can tell the graph moved on
+        self.generation = 0
+
+    def __contains__(self, rel_fname):
+        return self.file_ids.get(rel_fname) in self.mtimes
+
+    def __len__(self):
+        return len(self.mtimes)
+
+    def intern_file(self, rel_fname):
+        file_id = self.file_ids.get(rel_fname)
+        if file_id is None:
+            file_id = len(self.files)
+            self.file_ids[rel_fname] = file_id
+            self.files.append(rel_fname)
+        return file_id
+
+    def intern_ident(self, ident):
+        ident_id = self.ident_ids.get(ident)
+        if ident_id is None:
+            ident_id = len(self.idents)
+            self.ident_ids[ident] = ident_id
+            self.idents.append(ident)
+        return ident_id
+
+    def intern_definition(self, file_id, ident_id):
+        key = (file_id, ident_id)
+        definition_id = self.definition_ids.get(key)
+        if definition_id is None:
+            definition_id = len(self.definitions)
+            self.definition_ids[key] = definition_id
+            self.definitions.append(key)
+        return definition_id
+
+    def get_mtime(self, rel_fname):
+        return self.mtimes.get(self.file_ids.get(rel_fname))
+
+    def rel_fnames(self):
+        return [self.files[file_id] for file_id in self.mtimes]
+
+    def update_file(self, rel_fname, mtime, definitions, references):
+        """
+        Replace everything known about rel_fname. definitions maps each ident
+        the file defines to a set of tag tuples, references maps each ident
+        it uses to a count.
+        """
+
+        self.remove_file(rel_fname)
+
+        file_id = self.intern_file(rel_fname)
+        self.mtimes[file_id] = mtime
+        self.file_generations[file_id] = self.generation + 1
+
+        file_definitions = dict()
+        for ident, tags in definitions.items():
+            ident_id = self.intern_ident(ident)
+            file_definitions[ident_id] = tuple(Tag.from_tuple(tag) for tag in tags)
+            self.defines[ident_id].add(file_id)
+            self.intern_definition(file_id, ident_id)
+        self.file_definitions[file_id] = file_definitions
+
+        ref_ids = array("L")
+        ref_counts = array("L")
+        for ident, num_refs in references.items():
+            ident_id = self.intern_ident(ident)
+            ref_ids.append(ident_id)
+            ref_counts.append(num_refs)
+            self.references[ident_id][file_id] = num_refs
+        self.file_references[file_id] = (ref_ids, ref_counts)
+
+        self.dirty_idents.update(file_definitions)
+        self.dirty_idents.update(ref_ids)
+        self.generation += 1
+
+    def remove_file(self, rel_fname):
+        file_id = self.file_ids.get(rel_fname)
+        if file_id not in self.mtimes:
+            return
+
+        del self.mtimes[file_id]
+        del self.file_generations[file_id]
+        old_defines = self.file_definitions.pop(file_id)
+        old_references, _counts = self.file_references.pop(file_id)
+
+        for ident_id in old_defines:
+            self.defines[ident_id].discard(file_id)
+            if not self.defines[ident_id]:
+                del self.defines[ident_id]
+        for ident_id in old_references:
+            self.references[ident_id].pop(file_id, None)
+            if not self.references[ident_id]:
+                del self.references[ident_id]
+
+        self.dirty_idents.update(old_defines)
+        self.dirty_idents.update(old_references)
+        self.generation += 1
+
+    def get_definitions(self, file_id, ident_id):
+        tags = self.file_definitions.get(file_id, {}).get(ident_id, ())
+        return [tag.to_tuple() for tag in tags]
+
+    def get_references(self, file_id):
+        # (ident id, count) pairs for everything file_id references
+        ref_ids, ref_counts = self.file_references.get(file_id, ((), ()))
+        return zip(ref_ids, ref_counts)
+
+    def get_edges(self, with_definitions=False):
+        """
+        All edges as (referencers, definers, num_refs, idents) arrays of ids,
+        after rebuilding the edges of any idents touched since the last call.
+        with_definitions adds a fifth array, of the definition id each edge
+        points at.
+        """
+
+        for ident_id in self.dirty_idents:
+            definers = self.defines.get(ident_id)
+            referencers = self.references.get(ident_id)
+            if not definers or not referencers:
+                self.ident_edges.pop(ident_id, None)
+                continue
+
+            # every referencer points at every definer, except at itself
+            definers = np.fromiter(definers, dtype=np.int32, count=len(definers))
+            definition_ids = np.array([self.definition_ids[(definer, ident_id)] for definer in definers.tolist()], dtype=np.int32)
+            ref_ids = np.fromiter(referencers.keys(), dtype=np.int32, count=len(referencers))
+            ref_counts = np.fromiter(referencers.values(), dtype=np.int32, count=len(referencers))
+
+            src = np.repeat(ref_ids, len(definers))
+            dst = np.tile(definers, len(ref_ids))
+            keep = src != dst
+            if keep.any():
+                weights = np.repeat(ref_counts, len(definers))
+                definition_ids = np.tile(definition_ids, len(ref_ids))
+                self.ident_edges[ident_id] = (src[keep], dst[keep], weights[keep], definition_ids[keep])
+            else:
+                self.ident_edges.pop(ident_id, None)
+
+        self.dirty_idents = set()
+
+        ident_ids = np.fromiter(self.ident_edges.keys(), dtype=np.int32, count=len(self.ident_edges))
+        edges = list(self.ident_edges.values())
+        num_columns = 4 if with_definitions else 3
+        if edges:
+            columns = [np.concatenate(column) for column in list(zip(*edges))[:num_columns]]
+        else:
+            columns = [np.empty(0, dtype=np.int32)] * num_columns
+        idents = np.repeat(ident_ids, [len(ident_edges[0]) for ident_edges in edges])
+
+        return tuple(columns[:3]) + (idents,) + tuple(columns[3:])
@@ -1,13 +1,19 @@
 import colorsys
+import hashlib
 import json
+import multiprocessing
 import os
 import random
+import sqlite3
 import subprocess
 import sys
 import tempfile
-from collections import Counter, defaultdict
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import networkx as nx
+import numpy as np
 import tiktoken
 from diskcache import Cache
 from pygments.lexers import guess_lexer_for_filename
@@ -16,7 +22,11 @@ from pygments.util import ClassNotFound
 
 from bosskit import models
 
+from . import pagerank
 from .dump import dump  # noqa: F402
+from .extractors import get_ident_extractor
+from .refgraph import RefGraph
+from .tagstore import TagStore
 
 
 def to_tree(tags):
@@ -49,6 +59,60 @@ def to_tree(tags):
     return output
 
 
+def common_prefix_len(last, tag):
+    # how many leading items tag shares with the tag printed before it, the
+    # same way to_tree() works it out
+    num_common = 0
+    for i in range(min(len(last), len(tag))):
+        if last[i] != tag[i]:
+            break
+        num_common = i + 1
+    return num_common
+
+
+def compact_tag(tag):
+    # only keep what the map uses, the rest (path in particular) would tie a
+    # cache entry to one checkout
+    return {field: tag[field] for field in ("name", "kind", "scope", "signature") if field in tag}
+
+
+def get_identifier_counts(fname, content):
+    extractor = get_ident_extractor(fname)
+    if extractor:
+        counts = extractor(content)
+        if counts is not None:
+            return counts
+
+    try:
+        lexer = guess_lexer_for_filename(fname, content)
+    except ClassNotFound:
+        return dict()
+
+    # lexer.get_tokens_unprocessed() returns (char position in file, token type, token string)
+    counts = dict()
+    for _pos, token_type, token in lexer.get_tokens_unprocessed(content):
+        if token_type in Token.Name:
+            counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+# lexing workers are started fresh rather than forked, a fork would copy
+# locks held by whatever other threads are running (watcher, commits...)
+LEX_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def lex_file_identifiers(fname, encoding="utf-8"):
+    # runs in a worker process, so it reads the file itself rather than
+    # shipping the content across. None means "let the caller handle it".
+    try:
+        with open(fname, "r", encoding=encoding) as f:
+            content = f.read()
+    except (OSError, UnicodeError):
+        return
+
+    return get_identifier_counts(fname, content)
+
+
 def fname_to_components(fname, with_colon):
     path_components = fname.split(os.sep)
     res = [pc + os.sep for pc in path_components[:-1]]
@@ -59,11 +123,87 @@ def fname_to_components(fname, with_colon):
     return res
 
 
+class ShardEdges:
+    """
+    The edges of a ref graph split by shard, for RepoMap.rank_sharded():
+    those within shards sorted by shard so each shard takes a slice, and
+    those between shards, both as (src, dst, weights, definition_ids).
+    """
+
+    def __init__(self, key, graph, file_shards, num_shards, max_dense_shard_pairs):
+        self.key = key
+        self.file_shards = file_shards
+        self.num_shards = num_shards
+        num_files = len(file_shards)
+
+        referencers, definers, num_refs, _idents, definition_ids = graph.get_edges(with_definitions=True)
+        src_shards = file_shards[referencers]
+        dst_shards = file_shards[definers]
+        inter = src_shards != dst_shards
+        intra = ~inter
+
+        intra_shards = src_shards[intra]
+        order = np.argsort(intra_shards, kind="stable")
+        self.intra_bounds = np.searchsorted(intra_shards[order], np.arange(num_shards + 1))
+        self.intra = tuple(column[intra][order] for column in (referencers, definers, num_refs, definition_ids))
+        self.inter = tuple(column[inter] for column in (referencers, definers, num_refs, definition_ids))
+
+        # references into each file from other shards, where the random
+        # walk enters the shard
+        self.inbound = np.bincount(definers[inter], weights=num_refs[inter], minlength=num_files)
+
+        shard_files = defaultdict(list)
+        for file_id in graph.mtimes:
+            shard_files[file_shards[file_id]].append(file_id)
+        self.shard_files = {shard: np.array(sorted(file_ids), dtype=np.int64) for shard, file_ids in shard_files.items()}
+
+        # the references between shards, summing parallel edges up front
+        # when there are few enough shards
+        shard_src = src_shards[inter]
+        shard_dst = dst_shards[inter]
+        shard_weights = num_refs[inter]
+        if num_shards**2 <= max_dense_shard_pairs:
+            pair_weights = np.bincount(
+                shard_src.astype(np.int64) * num_shards + shard_dst,
+                weights=shard_weights,
+                minlength=num_shards**2,
+            )
+            pairs = np.flatnonzero(pair_weights)
+            shard_src, shard_dst, shard_weights = pairs // num_shards, pairs % num_shards, pair_weights[pairs]
+        self.shard_pairs = (shard_src, shard_dst, shard_weights)
+
+        # how much of each shard's outgoing weight stays inside it
+        total_weights = np.bincount(src_shards, weights=num_refs, minlength=num_shards)
+        intra_weights = np.bincount(intra_shards, weights=num_refs[intra], minlength=num_shards)
+        self.intra_share = np.divide(intra_weights, total_weights, out=np.ones(num_shards), where=total_weights > 0)
+
+
 class RepoMap:
-    CACHE_VERSION = 1
+    CACHE_VERSION = 3
     ctags_cmd = ["ctags", "--fields=+S", "--extras=-F", "--output-format=json"]
-    IDENT_CACHE_DIR = f".bosskit.ident.cache.v{CACHE_VERSION}"
-    TAGS_CACHE_DIR = f".bosskit.tags.cache.v{CACHE_VERSION}"
+    TAG_STORE_FILE = os.path.join("~", ".bosskit", f"repomap.cache.v{CACHE_VERSION}.db")
+    GRAPH_CACHE_DIR = f".bosskit.graph.cache.v{CACHE_VERSION}"
+
+    # files handed to each ctags process in batch mode, and how many of
+    # those processes may run at once
+    ctags_batch_size = 256
+    ctags_workers = os.cpu_count() or 1
+
+    # below this many uncached files, lexing in a process pool isn't worth
+    # the cost of starting one
+    ident_parallel_min_files = 32
+    ident_workers = os.cpu_count() or 1
+
+    max_line_tokens_cache = 100_000
+
+    # how many finished maps to remember, see get_repo_map()
+    map_cache_size = 8
+
+    # how many shards may be ranked at once in sharded mode
+    shard_workers = os.cpu_count() or 1
+    # above this many shard pairs, parallel edges between shards are left
+    # for the sparse matrix to sum
+    max_dense_shard_pairs = 1 << 22
 
     ctags_disabled_reason = "ctags not initialized"
 
@@ -75,16 +215,58 @@ class RepoMap:
         io=None,
         repo_content_prefix=None,
         verbose=False,
+        ident_mode="parallel",
+        rank_engine="sparse",
+        ppr_tolerance=None,
+        persist_graph=False,
+        watcher=None,
+        shard_depth=None,
     ):
         self.io = io
         self.verbose = verbose
 
+        if ident_mode not in ("serial", "parallel"):
+            raise ValueError(f"Unknown ident_mode {ident_mode}, expected serial or parallel")
+        self.ident_mode = ident_mode
+
+        if rank_engine not in ("sparse", "networkx"):
+            raise ValueError(f"Unknown rank_engine {rank_engine}, expected sparse or networkx")
+        self.rank_engine = rank_engine
+
+        # if set, rank with approximate local push whenever there are chat
+        # files to personalize to, instead of ranking the whole repo
+        self.ppr_tolerance = ppr_tolerance
+
+        # if set, rank each directory this many levels deep as its own shard
+        # and combine the shards through a graph of the references between
+        # them, so a change only re-ranks the shard it happened in
+        if shard_depth is not None and shard_depth < 1:
+            raise ValueError(f"shard_depth must be at least 1, got {shard_depth}")
+        self.shard_depth = shard_depth
+        self.shard_ids = dict()
+        self.file_shards = []
+        self.shard_cache = dict()
+        self.shard_edges = None
+
         if not root:
             root = os.getcwd()
         self.root = root
 
-        self.load_ident_cache()
-        self.load_tags_cache()
+        self.load_tag_store()
+
+        # the reference graph lives across calls and is patched file by file,
+        # and the last ranking is kept to warm start the next one
+        self.ref_graph = RefGraph()
+        self.last_ranked = None
+        self.persist_graph = persist_graph
+        if persist_graph:
+            self.load_graph_cache()
+
+        # with a FileWatcher, only files it reports as changed get stat'ed
+        if watcher:
+            self.file_changes = watcher.subscribe()
+        else:
+            self.file_changes = None
 
         self.max_map_tokens = map_tokens
         self.has_ctags = self.check_for_ctags()
@@ -95,9 +277,46 @@ class RepoMap:
             self.use_ctags = False
 
         self.tokenizer = tiktoken.encoding_for_model(main_model.name)
+        self.line_tokens = dict()
+
+        self.map_cache = OrderedDict()
+        self.map_cache_hits = 0
+        self.map_cache_misses = 0
         self.repo_content_prefix = repo_content_prefix
 
     def get_repo_map(self, chat_files, other_files):
+        # The map only depends on the chat files, the state of the repo and
+        # the token budget, so repeated calls with none of those changed
+        # (every message, /tokens) reuse the last result.
+        if self.use_ctags and self.max_map_tokens > 0 and other_files:
+            self.update_ref_graph(set(chat_files).union(set(other_files)))
+
+        key = (
+            frozenset(chat_files),
+            self.get_repo_fingerprint(other_files),
+            self.max_map_tokens,
+        )
+        if key in self.map_cache:
+            self.map_cache_hits += 1
+            self.map_cache.move_to_end(key)
+            if self.verbose:
+                self.io.tool_output(f"repo map cache hit ({self.map_cache_hits} hits, {self.map_cache_misses} misses)")
+            return self.map_cache[key]
+
+        self.map_cache_misses += 1
+        repo_content = self.get_repo_map_uncached(chat_files, other_files)
+
+        self.map_cache[key] = repo_content
+        while len(self.map_cache) > self.map_cache_size:
+            self.map_cache.popitem(last=False)
+
+        return repo_content
+
+    def get_repo_fingerprint(self, other_files):
+        # the ref graph's generation moves whenever a file's content does
+        return (self.ref_graph.generation, frozenset(other_files))
+
+    def get_repo_map_uncached(self, chat_files, other_files):
         res = self.choose_files_listing(chat_files, other_files)
         if not res:
             return
@@ -129,7 +348,8 @@ class RepoMap:
             return
 
         if self.use_ctags:
-            files_listing = self.get_ranked_tags_map(chat_files, other_files)
+            # get_repo_map() already brought the ref graph up to date
+            files_listing = self.get_ranked_tags_map(chat_files, other_files, refresh=False)
             if files_listing:
                 num_tokens = self.token_count(files_listing)
                 if self.verbose:
@@ -164,22 +384,134 @@ class RepoMap:
         path = os.path.relpath(path, self.root)
         return [path + ":"]
 
+    def load_tag_store(self):
+        path = os.path.expanduser(self.TAG_STORE_FILE)
+        try:
+            self.tag_store = TagStore(path)
+        except (OSError, sqlite3.Error) as err:
+            if self.io:
+                self.io.tool_error(f"Unable to use tags cache {path}: {err}")
+            self.tag_store = TagStore(":memory:")
+
+        # fname -> (mtime, size, key), so unchanged files aren't re-hashed
+        self.file_keys = dict()
+
+    def get_file_key(self, fname):
+        # Extraction results are cached by content, plus the suffix (or name)
+        # of the file since that picks the ctags parser and pygments lexer.
+        st = os.stat(fname)
+        known = self.file_keys.get(fname)
+        if known and known[0] == st.st_mtime and known[1] == st.st_size:
+            return known[2]
+
+        digest = hashlib.sha1()
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        basename = os.path.basename(fname)
+        suffix = os.path.splitext(basename)[1] or basename
+        key = f"{digest.hexdigest()}:{suffix}"
+
+        self.file_keys[fname] = (st.st_mtime, st.st_size, key)
+        return key
+
     def run_ctags(self, filename):
-        # Check if the file is in the cache and if the modification time has not changed
-        file_mtime = os.path.getmtime(filename)
-        cache_key = filename
-        if cache_key in self.TAGS_CACHE and self.TAGS_CACHE[cache_key]["mtime"] == file_mtime:
-            return self.TAGS_CACHE[cache_key]["data"]
+        cache_key = self.get_file_key(filename)
+        data = self.tag_store.get("tags", cache_key)
+        if data is not None:
+            return data
 
         cmd = self.ctags_cmd + [filename]
         output = subprocess.check_output(cmd, stderr=subprocess.PIPE).decode("utf-8")
         output = output.splitlines()
 
-        data = [json.loads(line) for line in output]
+        data = [compact_tag(json.loads(line)) for line in output]
+
+        self.tag_store.put("tags", cache_key, data)
+        return data
+
+    def run_ctags_batch(self, filenames):
+        # Serve whatever we can from the cache, then split the misses into
+        # batches and run one ctags process per batch instead of one per file.
+        keys = {filename: self.get_file_key(filename) for filename in filenames}
+        cached = self.tag_store.get_many("tags", keys.values())
+
+        res = dict()
+        missing = dict()
+        for filename, cache_key in keys.items():
+            if cache_key in cached:
+                res[filename] = cached[cache_key]
+            elif cache_key in missing:
+                # same content twice, only parse it once
+                continue
+            else:
+                missing[cache_key] = filename
+
+        if missing:
+            batch_size = self.ctags_batch_size
+            missing_fnames = list(missing.values())
+            batches = [missing_fnames[i : i + batch_size] for i in range(0, len(missing_fnames), batch_size)]
+            num_workers = max(1, min(len(batches), self.ctags_workers))
+
+            new_entries = dict()
+            failed = []
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                for batch, (batch_data, batch_failed) in zip(batches, executor.map(self.run_ctags_or_split, batches)):
+                    failed += batch_failed
+                    for filename in batch:
+                        if filename not in batch_failed:
+                            new_entries[keys[filename]] = batch_data.get(filename, [])
+
+            self.tag_store.put_many("tags", new_entries)
+            cached.update(new_entries)
+            if failed and self.io:
+                self.io.tool_error(f"ctags failed on {len(failed)} files, leaving them out of the map: {failed[0]} ...")
+
+        # files ctags failed on have no tags, and aren't cached so they get
+        # another try once they change
+        for filename, cache_key in keys.items():
+            if filename not in res:
+                res[filename] = cached.get(cache_key, [])
+        return res
+
+    def run_ctags_or_split(self, filenames):
+        # (tags by filename, failed filenames) for a batch. One file ctags
+        # can't handle shouldn't cost the rest of its batch their tags, so a
+        # failed batch is rerun file by file.
+        try:
+            return self.run_ctags_on_batch(filenames), []
+        except (subprocess.CalledProcessError, OSError, ValueError):
+            if len(filenames) == 1:
+                return dict(), list(filenames)
+
+        data = dict()
+        failed = []
+        for filename in filenames:
+            file_data, file_failed = self.run_ctags_or_split([filename])
+            data.update(file_data)
+            failed += file_failed
+        return data, failed
+
+    def run_ctags_on_batch(self, filenames):
+        cmd = self.ctags_cmd + filenames
+
+        # parse the json lines as ctags emits them, rather than buffering
+        # the whole output of the batch
+        data = defaultdict(list)
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+            for line in proc.stdout:
+                line = line.strip()
+                if not line:
+                    continue
+                tag = json.loads(line)
+                if tag.get("_type", "tag") != "tag":
+                    continue
+                data[tag.get("path")].append(compact_tag(tag))
+
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
 
-        # Update the cache
-        self.TAGS_CACHE[cache_key] = {"mtime": file_mtime, "data": data}
-        self.save_tags_cache()
         return data
 
     def check_for_ctags(self):
@@ -212,70 +544,126 @@ class RepoMap:
 
         return True
 
-    def load_tags_cache(self):
-        self.TAGS_CACHE = Cache(self.TAGS_CACHE_DIR)
-
-    def save_tags_cache(self):
-        pass
+    def load_graph_cache(self):
+        self.GRAPH_CACHE = Cache(self.GRAPH_CACHE_DIR)
 
-    def load_ident_cache(self):
-        self.IDENT_CACHE = Cache(self.IDENT_CACHE_DIR)
-
-    def save_ident_cache(self):
-        pass
+        # pick up the files under our root, anything stale gets replaced on
+        # the next update_ref_graph()
+        for fname in self.GRAPH_CACHE:
+            rel_fname = self.get_rel_fname(fname)
+            if rel_fname.startswith(os.pardir + os.sep):
+                continue
+            entry = self.GRAPH_CACHE.get(fname)
+            if not entry:
+                continue
+            self.ref_graph.update_file(rel_fname, entry["mtime"], entry["definitions"], entry["references"])
 
     def get_name_identifiers(self, fname, uniq=True):
-        file_mtime = os.path.getmtime(fname)
-        cache_key = fname
-        if cache_key in self.IDENT_CACHE and self.IDENT_CACHE[cache_key]["mtime"] == file_mtime:
-            idents = self.IDENT_CACHE[cache_key]["data"]
-        else:
+        # a set of the identifiers in fname, or a dict of ident -> count if not uniq
+        cache_key = self.get_file_key(fname)
+        idents = self.tag_store.get("idents", cache_key)
+        if idents is None:
             idents = self.get_name_identifiers_uncached(fname)
-            self.IDENT_CACHE[cache_key] = {"mtime": file_mtime, "data": idents}
-            self.save_ident_cache()
+            self.tag_store.put("idents", cache_key, idents)
 
         if uniq:
             idents = set(idents)
         return idents
 
     def get_name_identifiers_uncached(self, fname):
-        content = self.io.read_text(fname)
-        if content is None:
-            return list()
+        # read and lexed just like in the worker processes, so the results
+        # don't depend on the ident_mode
+        idents = lex_file_identifiers(fname, getattr(self.io, "encoding", "utf-8"))
+        if idents is None:
+            if self.io:
+                self.io.tool_error(f"Unable to read {fname}")
+            return dict()
 
-        try:
-            lexer = guess_lexer_for_filename(fname, content)
-        except ClassNotFound:
-            return list()
+        return idents
 
-        # lexer.get_tokens_unprocessed() returns (char position in file, token type, token string)
-        tokens = list(lexer.get_tokens_unprocessed(content))
-        res = [token[2] for token in tokens if token[1] in Token.Name]
-        return res
+    def get_name_identifiers_batch(self, fnames):
+        # ident -> count dicts for all of fnames, lexing the cache misses in a
+        # process pool when there are enough of them to be worth it
+        keys = {fname: self.get_file_key(fname) for fname in fnames}
+        cached = self.tag_store.get_many("idents", keys.values())
+
+        missing = dict()
+        for fname, cache_key in keys.items():
+            if cache_key not in cached and cache_key not in missing:
+                missing[cache_key] = fname
+
+        new_entries = dict()
+        if self.ident_mode == "parallel" and len(missing) >= self.ident_parallel_min_files:
+            encoding = getattr(self.io, "encoding", "utf-8")
+            missing_fnames = list(missing.values())
+            num_workers = max(1, min(len(missing), self.ident_workers))
+            chunksize = max(1, len(missing) // (num_workers * 4))
+
+            mp_context = multiprocessing.get_context(LEX_START_METHOD)
+            with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context) as executor:
+                results = executor.map(
+                    lex_file_identifiers,
+                    missing_fnames,
+                    [encoding] * len(missing_fnames),
+                    chunksize=chunksize,
+                )
+                for fname, idents in zip(missing_fnames, results):
+                    if idents is None:
+                        # unreadable, leave it to the serial path to report
+                        continue
+                    new_entries[keys[fname]] = idents
 
-    def get_ranked_tags(self, chat_fnames, other_fnames):
-        defines = defaultdict(set)
-        references = defaultdict(list)
-        definitions = defaultdict(set)
+        for cache_key, fname in missing.items():
+            if cache_key not in new_entries:
+                new_entries[cache_key] = self.get_name_identifiers_uncached(fname)
 
-        personalization = dict()
+        self.tag_store.put_many("idents", new_entries)
+        cached.update(new_entries)
 
-        fnames = set(chat_fnames).union(set(other_fnames))
-        chat_rel_fnames = set()
+        return {fname: cached[cache_key] for fname, cache_key in keys.items()}
 
+    def update_ref_graph(self, fnames):
+        # Bring the reference graph in line with fnames, re-extracting only
+        # the files which are new or have changed since the last call.
+        graph = self.ref_graph
+
+        changed_paths = None
+        if self.file_changes:
+            changed_paths = self.file_changes.drain()
+
+        changed = []
+        rel_fnames = set()
         for fname in sorted(fnames):
-            # dump(fname)
-            rel_fname = os.path.relpath(fname, self.root)
+            rel_fname = self.get_rel_fname(fname)
+            if changed_paths is not None and rel_fname in graph and fname not in changed_paths:
+                rel_fnames.add(rel_fname)
+                continue
 
-            if fname in chat_fnames:
-                personalization[rel_fname] = 1.0
-                chat_rel_fnames.add(rel_fname)
+            try:
+                file_mtime = os.path.getmtime(fname)
+            except FileNotFoundError:
+                continue
+
+            rel_fnames.add(rel_fname)
+            if graph.get_mtime(rel_fname) != file_mtime:
+                changed.append((fname, rel_fname, file_mtime))
 
-            data = self.run_ctags(fname)
+        for rel_fname in set(graph.rel_fnames()) - rel_fnames:
+            graph.remove_file(rel_fname)
+            if self.persist_graph:
+                self.GRAPH_CACHE.pop(os.path.join(self.root, rel_fname), None)
+
+        if not changed:
+            return
 
-            for tag in data:
+        changed_fnames = [fname for fname, _rel_fname, _mtime in changed]
+        all_tags = self.run_ctags_batch(changed_fnames)
+        all_idents = self.get_name_identifiers_batch(changed_fnames)
+
+        for fname, rel_fname, file_mtime in changed:
+            definitions = defaultdict(set)
+            for tag in all_tags[fname]:
                 ident = tag["name"]
-                defines[ident].add(rel_fname)
 
                 scope = tag.get("scope")
                 kind = tag.get("kind")
@@ -291,61 +679,56 @@ class RepoMap:
                     res.append(scope)
                 res += [kind, last]
 
-                key = (rel_fname, ident)
-                definitions[key].add(tuple(res))
-                # definitions[key].add((rel_fname,))
+                definitions[ident].add(tuple(res))
 
-            idents = self.get_name_identifiers(fname, uniq=False)
-            for ident in idents:
-                # dump("ref", fname, ident)
-                references[ident].append(rel_fname)
+            definitions = dict(definitions)
+            references = all_idents[fname]
+            graph.update_file(rel_fname, file_mtime, definitions, references)
 
-        idents = set(defines.keys()).intersection(set(references.keys()))
+            if self.persist_graph:
+                self.GRAPH_CACHE[fname] = dict(
+                    mtime=file_mtime,
+                    definitions=definitions,
+                    references=references,
+                )
 
-        G = nx.MultiDiGraph()
+    def get_ranked_tags(self, chat_fnames, other_fnames, refresh=True):
+        fnames = set(chat_fnames).union(set(other_fnames))
 
-        for ident in idents:
-            definers = defines[ident]
-            for referencer, num_refs in Counter(references[ident]).items():
-                for definer in definers:
-                    if referencer == definer:
-                        continue
-                    G.add_edge(referencer, definer, weight=num_refs, ident=ident)
+        if refresh:
+            self.update_ref_graph(fnames)
+        graph = self.ref_graph
 
-        if personalization:
-            pers_args = dict(personalization=personalization, dangling=personalization)
-        else:
-            pers_args = dict()
+        # ranking works on the graph's file and ident ids, names only come
+        # back for the tags that are returned
+        personalization = dict()
+        for fname in chat_fnames:
+            personalization[graph.intern_file(self.get_rel_fname(fname))] = 1.0
 
         try:
-            ranked = nx.pagerank(G, weight="weight", **pers_args)
+            if self.shard_depth:
+                ranked, ranked_definitions = self.rank_sharded(graph, personalization)
+            elif personalization and self.ppr_tolerance:
+                ranked, ranked_definitions = self.rank_local_push(graph, personalization)
+            else:
+                ranked, ranked_definitions = self.rank_edges(graph, personalization)
+                self.last_ranked = ranked
         except ZeroDivisionError:
             return []
 
-        # distribute the rank from each source node, across all of its out edges
-        ranked_definitions = defaultdict(float)
-        for src in G.nodes:
-            src_rank = ranked[src]
-            total_weight = sum(data["weight"] for _src, _dst, data in G.out_edges(src, data=True))
-            # dump(src, src_rank, total_weight)
-            for _src, dst, data in G.out_edges(src, data=True):
-                data["rank"] = src_rank * data["weight"] / total_weight
-                ident = data["ident"]
-                ranked_definitions[(dst, ident)] += data["rank"]
-
         ranked_tags = []
         ranked_definitions = sorted(ranked_definitions.items(), reverse=True, key=lambda x: x[1])
-        for (fname, ident), rank in ranked_definitions:
-            # print(f"{rank:.03f} {fname} {ident}")
-            if fname in chat_rel_fnames:
+        for (file_id, ident_id), rank in ranked_definitions:
+            # print(f"{rank:.03f} {graph.files[file_id]} {graph.idents[ident_id]}")
+            if file_id in personalization:
                 continue
-            ranked_tags += list(definitions.get((fname, ident), []))
+            ranked_tags += graph.get_definitions(file_id, ident_id)
 
         rel_other_fnames_without_tags = set(os.path.relpath(fname, self.root) for fname in other_fnames)
 
         fnames_already_included = set(rt[0] for rt in ranked_tags)
 
-        top_rank = sorted([(rank, node) for (node, rank) in ranked.items()], reverse=True)
+        top_rank = sorted([(rank, graph.files[node]) for (node, rank) in ranked.items()], reverse=True)
         for rank, fname in top_rank:
             if fname in rel_other_fnames_without_tags:
                 rel_other_fnames_without_tags.remove(fname)
@@ -357,31 +740,355 @@ class RepoMap:
 
         return ranked_tags
 
-    def get_ranked_tags_map(self, chat_fnames, other_fnames=None):
+    def rank_edges(self, graph, personalization):
+        edges = graph.get_edges()
+
+        if self.rank_engine == "sparse":
+            return self.rank_edges_sparse(edges, personalization, nstart=self.last_ranked)
+        return self.rank_edges_networkx(edges, personalization, nstart=self.last_ranked)
+
+    def rank_edges_networkx(self, edges, personalization, nstart=None):
+        G = nx.MultiDiGraph()
+        for referencer, definer, num_refs, ident in zip(*(column.tolist() for column in edges)):
+            G.add_edge(referencer, definer, weight=num_refs, ident=ident)
+
+        if personalization:
+            pers_args = dict(personalization=personalization, dangling=personalization)
+        else:
+            pers_args = dict()
+
+        if nstart:
+            nstart = {node: rank for node, rank in nstart.items() if node in G}
+        if nstart and sum(nstart.values()):
+            pers_args["nstart"] = nstart
+
+        ranked = nx.pagerank(G, weight="weight", **pers_args)
+
+        # distribute the rank from each source node, across all of its out edges
+        ranked_definitions = defaultdict(float)
+        for src in G.nodes:
+            src_rank = ranked[src]
+            total_weight = sum(data["weight"] for _src, _dst, data in G.out_edges(src, data=True))
+            # dump(src, src_rank, total_weight)
+            for _src, dst, data in G.out_edges(src, data=True):
+                data["rank"] = src_rank * data["weight"] / total_weight
+                ident = data["ident"]
+                ranked_definitions[(dst, ident)] += data["rank"]
+
+        return ranked, ranked_definitions
+
+    def rank_edges_sparse(self, edges, personalization, nstart=None):
+        referencers, definers, num_refs, edge_ident_ids = edges
+        num_edges = len(referencers)
+        if not num_edges:
+            return dict(), dict()
+        weights = num_refs.astype(float)
+
+        # renumber the file ids densely, in order of first appearance, which
+        # is the node order networkx would use for the same edges
+        num_file_ids = int(max(referencers.max(), definers.max())) + 1
+        first = np.full(num_file_ids, 2 * num_edges, dtype=np.int64)
+        np.minimum.at(first, referencers, np.arange(0, 2 * num_edges, 2))
+        np.minimum.at(first, definers, np.arange(1, 2 * num_edges, 2))
+        file_ids = np.flatnonzero(first < 2 * num_edges)
+        file_ids = file_ids[np.argsort(first[file_ids])]
+        node_index = np.empty(num_file_ids, dtype=np.int32)
+        node_index[file_ids] = np.arange(len(file_ids))
+        src = node_index[referencers]
+        dst = node_index[definers]
+
+        # and the ident ids too, in any order
+        ident_counts = np.bincount(edge_ident_ids)
+        ident_ids = np.flatnonzero(ident_counts)
+        ident_index = np.zeros(len(ident_counts), dtype=np.int32)
+        ident_index[ident_ids] = np.arange(len(ident_ids))
+        edge_idents = ident_index[edge_ident_ids]
+
+        nodes = file_ids.tolist()
+        num_nodes = len(nodes)
+
+        pers = None
+        if personalization:
+            pers = [personalization.get(node, 0) for node in nodes]
+
+        x0 = None
+        if nstart:
+            x0 = [nstart.get(node, 0) for node in nodes]
+            if not sum(x0):
+                x0 = None
+
+        ranks = pagerank.pagerank(src, dst, weights, num_nodes, personalization=pers, nstart=x0)
+        ranked = dict(zip(nodes, ranks.tolist()))
+
+        edge_ranks = pagerank.distribute_rank(ranks, src, dst, weights, num_nodes)
+
+        # walk the edges grouped by source node, then by destination, the
+        # same way G.out_edges() would, so ties come out in the same order.
+        # Stable sorts keep the edges in their original order within each
+        # group, and each (src, dst) group is placed by its first edge.
+        order = np.argsort(src.astype(np.int64) * num_nodes + dst, kind="stable")
+        pair_sorted = src[order].astype(np.int64) * num_nodes + dst[order]
+        new_pair = np.empty(num_edges, dtype=bool)
+        new_pair[0] = True
+        np.not_equal(pair_sorted[1:], pair_sorted[:-1], out=new_pair[1:])
+        del pair_sorted
+        pair_starts = np.flatnonzero(new_pair)
+        del new_pair
+        pair_first = np.repeat(order[pair_starts], np.diff(np.append(pair_starts, num_edges)))
+        walk = np.argsort(src[order].astype(np.int64) * num_edges + pair_first, kind="stable")
+        del pair_first
+        order = order[walk]
+        del walk
+
+        # sum the edge ranks into their (definer, ident) definitions
+        num_idents = len(ident_ids)
+        keys = dst[order].astype(np.int64) * num_idents + edge_idents[order]
+        def_keys, def_first, def_inverse = np.unique(keys, return_index=True, return_inverse=True)
+        del keys
+        def_ranks = np.bincount(def_inverse, weights=edge_ranks[order])
+        def_order = np.argsort(def_first)
+
+        idents = ident_ids.tolist()
+        ranked_definitions = dict()
+        for key, rank in zip(def_keys[def_order].tolist(), def_ranks[def_order].tolist()):
+            ranked_definitions[(nodes[key // num_idents], idents[key % num_idents])] = rank
+
+        return ranked, ranked_definitions
+
+    def rank_local_push(self, graph, personalization):
+        # Only the files reachable from the chat files get visited, and
+        # their out edges are worked out on demand from what they reference.
+        out_edges_cache = dict()
+
+        def out_edges(src):
+            edges = out_edges_cache.get(src)
+            if edges is None:
+                edges = []
+                for ident_id, num_refs in graph.get_references(src):
+                    for definer in graph.defines.get(ident_id, ()):
+                        if definer != src:
+                            edges.append((definer, num_refs, ident_id))
+                out_edges_cache[src] = edges
+            return edges
+
+        def in_graph(file_id):
+            if out_edges(file_id):
+                return True
+            for ident_id in graph.file_definitions.get(file_id, ()):
+                if any(referencer != file_id for referencer in graph.references.get(ident_id, ())):
+                    return True
+            return False
+
+        # like nx.pagerank, ignore chat files which aren't part of the graph
+        seeds = {file_id: weight for file_id, weight in personalization.items() if in_graph(file_id)}
+
+        ranked = pagerank.local_push_pagerank(seeds, out_edges, tol=self.ppr_tolerance)
+
+        # distribute the rank from each visited node, across all of its out edges
+        ranked_definitions = defaultdict(float)
+        for src, src_rank in ranked.items():
+            edges = out_edges(src)
+            total_weight = sum(num_refs for _dst, num_refs, _ident in edges)
+            for dst, num_refs, ident in edges:
+                ranked_definitions[(dst, ident)] += src_rank * num_refs / total_weight
+
+        return ranked, ranked_definitions
+
+    def get_shard(self, rel_fname):
+        path_components = os.path.dirname(rel_fname).split(os.sep)
+        return os.sep.join(path_components[: self.shard_depth])
+
+    def get_file_shards(self, graph):
+        # shard index of every file id; ids are never reused, so only the
+        # files interned since the last call need looking at
+        for rel_fname in graph.files[len(self.file_shards) :]:
+            shard = self.get_shard(rel_fname)
+            self.file_shards.append(self.shard_ids.setdefault(shard, len(self.shard_ids)))
+        return np.array(self.file_shards, dtype=np.int32)
+
+    def get_shard_edges(self, graph):
+        # the edges split by shard don't depend on the chat files, so they
+        # are only redone when the graph changed
+        file_shards = self.get_file_shards(graph)
+        key = (graph.generation, len(file_shards))
+        if not self.shard_edges or self.shard_edges.key != key:
+            self.shard_edges = ShardEdges(key, graph, file_shards, len(self.shard_ids), self.max_dense_shard_pairs)
+        return self.shard_edges
+
+    def rank_sharded(self, graph, personalization):
+        """
+        Rank each shard's files by the references within it, then weight
+        every shard by a pagerank over the references between shards.
+
+        The ranking of a shard, and the rank it hands to the definitions in
+        it, are cached and only redone when one of its files changed or
+        when the chat files or references coming into it did. The edges
+        are only split by shard again when the graph changed, otherwise
+        just the references between shards are walked.
+        """
+
+        edges = self.get_shard_edges(graph)
+        file_shards = edges.file_shards
+        num_shards = edges.num_shards
+        num_files = len(file_shards)
+        num_definitions = len(graph.definitions)
+
+        dirty = []
+        for shard, file_ids in edges.shard_files.items():
+            pers = np.array([personalization.get(file_id, 0) for file_id in file_ids.tolist()], dtype=float)
+            if not pers.sum():
+                pers = edges.inbound[file_ids]
+            if not pers.sum():
+                pers = None
+
+            # a shard's own edges only change when one of its files does,
+            # and a new file always has the highest generation
+            generation = max(graph.file_generations[file_id] for file_id in file_ids.tolist())
+            key = (generation, len(file_ids), None if pers is None else pers.tobytes())
+            cached = self.shard_cache.get(shard)
+            if not cached or cached[0] != key:
+                dirty.append((shard, key, file_ids, pers))
+
+        for shard in set(self.shard_cache) - set(edges.shard_files):
+            del self.shard_cache[shard]
+
+        if dirty:
+            intra_src, intra_dst, intra_weights, intra_definitions = edges.intra
+            bounds = edges.intra_bounds
+
+            def rank_shard(shard, _key, file_ids, pers):
+                shard_edges = slice(bounds[shard], bounds[shard + 1])
+                src = np.searchsorted(file_ids, intra_src[shard_edges])
+                dst = np.searchsorted(file_ids, intra_dst[shard_edges])
+                weights = intra_weights[shard_edges]
+
+                ranks = pagerank.pagerank(src, dst, weights, len(file_ids), personalization=pers)
+                ranks = ranks / ranks.sum()
+
+                # the share of each definition, as if the shard were the repo
+                edge_ranks = pagerank.distribute_rank(ranks, src, dst, weights, len(file_ids))
+                def_ranks = np.bincount(intra_definitions[shard_edges], weights=edge_ranks, minlength=num_definitions)
+                def_ids = np.flatnonzero(def_ranks)
+                return ranks, def_ids, def_ranks[def_ids]
+
+            num_workers = max(1, min(len(dirty), self.shard_workers))
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                results = executor.map(lambda args: rank_shard(*args), dirty)
+                for (shard, key, file_ids, _pers), result in zip(dirty, results):
+                    self.shard_cache[shard] = (key, file_ids) + result
+
+        # rank the shards themselves by the references between them
+        shard_pers = None
+        if personalization:
+            shard_pers = np.zeros(num_shards)
+            for file_id, weight in personalization.items():
+                if file_id in graph.mtimes:
+                    shard_pers[file_shards[file_id]] += weight
+            if not shard_pers.sum():
+                raise ZeroDivisionError
+
+        shard_src, shard_dst, shard_weights = edges.shard_pairs
+        shard_ranks = pagerank.pagerank(shard_src, shard_dst, shard_weights, num_shards, personalization=shard_pers)
+        intra_share = edges.intra_share
+
+        file_ranks = np.zeros(num_files)
+        def_ranks = np.zeros(num_definitions)
+        for shard, (_key, file_ids, ranks, def_ids, shard_def_ranks) in self.shard_cache.items():
+            file_ranks[file_ids] = shard_ranks[shard] * ranks
+            def_ranks[def_ids] += shard_def_ranks * shard_ranks[shard] * intra_share[shard]
+
+        # and what leaves each file for other shards goes along the
+        # references between them
+        inter_src, inter_dst, inter_weights, inter_definitions = edges.inter
+        if len(inter_src):
+            edge_ranks = pagerank.distribute_rank(file_ranks, inter_src, inter_dst, inter_weights, num_files)
+            edge_ranks *= 1 - intra_share[file_shards[inter_src]]
+            def_ranks += np.bincount(inter_definitions, weights=edge_ranks, minlength=num_definitions)
+
+        ranked = {file_id: float(file_ranks[file_id]) for file_id in graph.mtimes}
+
+        ranked_definitions = dict()
+        def_ids = np.flatnonzero(def_ranks)
+        for def_id, rank in zip(def_ids.tolist(), def_ranks[def_ids].tolist()):
+            ranked_definitions[graph.definitions[def_id]] = rank
+
+        return ranked, ranked_definitions
+
+    def get_ranked_tags_map(self, chat_fnames, other_fnames=None, refresh=True):
         if not other_fnames:
             other_fnames = list()
 
-        ranked_tags = self.get_ranked_tags(chat_fnames, other_fnames)
-        num_tags = len(ranked_tags)
+        ranked_tags = self.get_ranked_tags(chat_fnames, other_fnames, refresh=refresh)
+
+        # the running token totals only estimate a render, so the cut they
+        # give is checked, along with the one after it. Each miss corrects
+        # the estimate by how far off it was, within the cuts not yet ruled
+        # out, or else bisects them. A good estimate takes two renders.
+        prefix_tokens = self.get_tree_prefix_tokens(ranked_tags)
+        num_tags = bisect_left(prefix_tokens, self.max_map_tokens) - 1
 
         lower_bound = 0
-        upper_bound = num_tags
+        upper_bound = len(ranked_tags)
         best_tree = None
-
         while lower_bound <= upper_bound:
-            middle = (lower_bound + upper_bound) // 2
-            tree = to_tree(ranked_tags[:middle])
+            if not lower_bound <= num_tags <= upper_bound:
+                num_tags = (lower_bound + upper_bound) // 2
+
+            tree = to_tree(ranked_tags[:num_tags])
             num_tokens = self.token_count(tree)
-            # dump(middle, num_tokens)
+            error = num_tokens - prefix_tokens[num_tags]
+            guess = bisect_left(prefix_tokens, self.max_map_tokens - error) - 1
 
             if num_tokens < self.max_map_tokens:
                 best_tree = tree
-                lower_bound = middle + 1
+                lower_bound = num_tags + 1
+                num_tags = max(guess, num_tags + 1)
             else:
-                upper_bound = middle - 1
+                upper_bound = num_tags - 1
+                num_tags = min(guess, num_tags - 1)
 
         return best_tree
 
+    def get_tree_prefix_tokens(self, tags):
+        # Token counts of to_tree(tags[:n]) for every n, worked out by adding
+        # the tags one at a time and only counting the lines each one adds or
+        # takes away. Each line's count is cached, so nothing gets encoded
+        # more than once.
+        prefix_tokens = [0]
+        total = 0
+        tree_order = []
+
+        for tag in tags:
+            tag = tuple(tag)
+            pos = bisect_right(tree_order, tag)
+            prev_tag = tree_order[pos - 1] if pos else ()
+            next_tag = tree_order[pos] if pos < len(tree_order) else None
+
+            for level in range(common_prefix_len(prev_tag, tag), len(tag)):
+                total += self.line_token_count(level, tag[level])
+
+            # the next tag now hangs off this one, so it may print fewer lines
+            if next_tag is not None:
+                old_common = common_prefix_len(prev_tag, next_tag)
+                new_common = common_prefix_len(tag, next_tag)
+                for level in range(old_common, new_common):
+                    total -= self.line_token_count(level, next_tag[level])
+
+            tree_order.insert(pos, tag)
+            prefix_tokens.append(total)
+
+        return prefix_tokens
+
+    def line_token_count(self, level, item):
+        key = (level, item)
+        num_tokens = self.line_tokens.get(key)
+        if num_tokens is None:
+            if len(self.line_tokens) >= self.max_line_tokens_cache:
+                self.line_tokens = dict()
+            num_tokens = self.token_count("\t" * level + item + "\n")
+            self.line_tokens[key] = num_tokens
+        return num_tokens
+
 
 def find_py_files(directory):
     if not os.path.isdir(directory):
@@ -0,0 +1,67 @@
+import json
+import os
+import sqlite3
+
+
+class TagStore:
+    """
+    A content-addressed cache of per-file extraction results (ctags output,
+    identifier counts) in one SQLite file. Entries are keyed by a hash of
+    the file's content rather than by its path, so every checkout and
+    worktree on the machine shares them.
+    """
+
+    # stay well under SQLITE_MAX_VARIABLE_NUMBER on older sqlite builds
+    chunk_size = 500
+
+    def __init__(self, path):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (kind, key)"
+            ") WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def get(self, kind, key):
+        return self.get_many(kind, [key]).get(key)
+
+    def get_many(self, kind, keys):
+        res = dict()
+        keys = list(set(keys))
+        for i in range(0, len(keys), self.chunk_size):
+            chunk = keys[i : i + self.chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, data FROM entries WHERE kind = ? AND key IN ({placeholders})",
+                [kind] + chunk,
+            )
+            for key, data in rows:
+                res[key] = json.loads(data)
+        return res
+
+    def put(self, kind, key, data):
+        self.put_many(kind, {key: data})
+
+    def put_many(self, kind, items):
+        if not items:
+            return
+
+        rows = [(kind, key, json.dumps(data)) for key, data in items.items()]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entries (kind, key, data) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,147 @@
+import os
+import threading
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+
+IGNORED_DIRS = {".git"}
+
+
+class ChangeSet:
+    """
+    The paths one consumer hasn't seen yet. drain() returns them and starts
+    over, or returns None if changes may have been missed and the consumer
+    has to look at everything.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = set()
+        # nothing has been observed yet, so the first drain must rescan
+        self.overflow = True
+
+    def add(self, path):
+        with self.lock:
+            self.paths.add(path)
+
+    def invalidate(self):
+        with self.lock:
+            self.overflow = True
+            self.paths = set()
+
+    def drain(self):
+        with self.lock:
+            if self.overflow:
+                res = None
+            else:
+                res = self.paths
+            self.paths = set()
+            self.overflow = False
+        return res
+
+
+class FileWatcher:
+    """
+    Watches a directory tree and fans out the paths that changed to any
+    number of ChangeSets. Uses watchdog (inotify on Linux) when it's
+    installed, otherwise a background thread polls mtimes.
+
+    Each poll walks and stats the whole tree, every poll_interval seconds
+    for as long as the watcher runs, and changes show up to poll_interval
+    late. On trees with many thousands of files that's a steady cost even
+    while nothing changes, so give those a longer poll_interval or install
+    watchdog.
+    """
+
+    def __init__(self, root, poll_interval=1.0, use_polling=False):
+        self.root = os.path.abspath(root)
+        self.poll_interval = poll_interval
+        self.use_polling = use_polling or Observer is None
+
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.observer = None
+        self.poll_thread = None
+        self.stop_event = threading.Event()
+
+    def subscribe(self):
+        changes = ChangeSet()
+        with self.lock:
+            self.subscribers.append(changes)
+        return changes
+
+    def start(self):
+        if self.use_polling:
+            self.snapshot = self.scan()
+            self.poll_thread = threading.Thread(target=self.poll_loop, daemon=True)
+            self.poll_thread.start()
+            return
+
+        self.observer = Observer()
+        self.observer.schedule(self, self.root, recursive=True)
+        self.observer.daemon = True
+        self.observer.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+        if self.poll_thread:
+            self.poll_thread.join()
+            self.poll_thread = None
+
+    def is_ignored(self, path):
+        rel_path = os.path.relpath(path, self.root)
+        return any(part in IGNORED_DIRS for part in rel_path.split(os.sep))
+
+    def notify(self, path):
+        if self.is_ignored(path):
+            return
+        with self.lock:
+            for changes in self.subscribers:
+                changes.add(path)
+
+    def invalidate(self):
+        with self.lock:
+            for changes in self.subscribers:
+                changes.invalidate()
+
+    # watchdog calls this for every event, so no handler subclass is needed
+    def dispatch(self, event):
+        if event.is_directory:
+            if event.event_type == "modified" or self.is_ignored(event.src_path):
+                return
+            # whole subtrees came or went, not worth tracking file by file
+            self.invalidate()
+            return
+
+        self.notify(os.fsdecode(event.src_path))
+        dest_path = getattr(event, "dest_path", None)
+        if dest_path:
+            self.notify(os.fsdecode(dest_path))
+
+    def scan(self):
+        snapshot = dict()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS]
+            for fname in filenames:
+                path = os.path.join(dirpath, fname)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def poll_loop(self):
+        while not self.stop_event.wait(self.poll_interval):
+            snapshot = self.scan()
+            for path in snapshot.keys() | self.snapshot.keys():
+                if snapshot.get(path) != self.snapshot.get(path):
+                    self.notify(path)
+            self.snapshot = snapshot
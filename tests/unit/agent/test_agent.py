@@ -0,0 +1,87 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from bosskit.agent.agent import Coder
+from bosskit.tools.editstream import StreamingEdits
+from bosskit.tools.promptcache import CacheWarmer
+from bosskit.tools.watch import ChangeSet, FileWatcher
+
+
+def make_coder(tmp_path):
+    fnames = []
+    for name in ["a.py", "b.py"]:
+        fname = tmp_path / name
+        fname.write_text("x = 1\n")
+        os.utime(fname, (100, 100))
+        fnames.append(str(fname))
+
+    listed = []
+
+    def get_all_abs_files():
+        listed.append(True)
+        return fnames
+
+    coder = SimpleNamespace(file_changes=ChangeSet(), last_modified=0, get_all_abs_files=get_all_abs_files)
+    return coder, fnames, listed
+
+
+def test_get_last_modified_only_looks_at_changed_files(tmp_path):
+    coder, fnames, listed = make_coder(tmp_path)
+
+    # the first call has nothing reported yet, and stats every file
+    assert Coder.get_last_modified(coder) == 100
+    assert len(listed) == 1
+
+    assert Coder.get_last_modified(coder) == 100
+    assert len(listed) == 1
+
+    os.utime(fnames[1], (200, 200))
+    coder.file_changes.add(fnames[1])
+    coder.file_changes.add(str(tmp_path / "not_in_the_repo.py"))
+    assert Coder.get_last_modified(coder) == 200
+    assert len(listed) == 2
+
+
+def test_streamed_edits_roll_back_when_applying_fails(tmp_path):
+    (tmp_path / "a.py").write_text("x = 1\n")
+    (tmp_path / "b.py").write_text("y = 1\n")
+    reply = "a.py\n<<<<<<< ORIGINAL\nx = 1\n=======\nx = 2\n>>>>>>> UPDATED\n"
+    reply += "b.py\n<<<<<<< ORIGINAL\ny = 1\n=======\ny = 2\n>>>>>>> UPDATED\n"
+
+    edit_stream = StreamingEdits(str(tmp_path), lambda path: path == "a.py")
+    edit_stream.update(reply)
+    assert (tmp_path / "a.py").read_text() == "x = 2\n"
+
+    def apply_deferred_edit(*args):
+        raise OSError("disk full")
+
+    coder = SimpleNamespace(edit_stream=edit_stream, apply_deferred_edit=apply_deferred_edit)
+    with pytest.raises(OSError):
+        Coder.update_files_gpt4(coder, reply)
+
+    assert (tmp_path / "a.py").read_text() == "x = 1\n"
+    assert (tmp_path / "b.py").read_text() == "y = 1\n"
+
+
+def test_close_stops_the_cache_warmer():
+    warmer = CacheWarmer(lambda messages: None, max_pings=5, interval=60)
+    warmer.warm(["prefix"])
+
+    Coder.close(SimpleNamespace(cache_warmer=warmer, watcher=None))
+    warmer.thread.join(5)
+    assert not warmer.thread.is_alive()
+
+    # a Coder without keepalive pings or a watcher has nothing to stop
+    Coder.close(SimpleNamespace(cache_warmer=None, watcher=None))
+
+
+def test_close_stops_the_file_watcher(tmp_path):
+    watcher = FileWatcher(tmp_path, poll_interval=0.01, use_polling=True)
+    watcher.start()
+    poll_thread = watcher.poll_thread
+    assert poll_thread.is_alive()
+
+    Coder.close(SimpleNamespace(cache_warmer=None, watcher=watcher))
+    assert not poll_thread.is_alive()
@@ -0,0 +1,66 @@
+from argparse import Namespace
+from unittest.mock import patch
+
+import pytest
+
+from bosskit.cli.batch import make_job_runner
+from bosskit.tools.batch import BatchJob, BatchRunner
+
+
+@pytest.fixture
+def args(tmp_path):
+    return Namespace(
+        batch_logs=str(tmp_path / "logs"),
+        auto_commits=True,
+        dry_run=False,
+        map_tokens=1024,
+        openai_api_key="key",
+        openai_api_base=None,
+    )
+
+
+@pytest.fixture
+def mock_coder():
+    with patch("bosskit.cli.batch.InputOutput") as mock_io, patch("bosskit.cli.batch.Coder") as mock_coder:
+        mock_io.return_value.num_error_outputs = 0
+        mock_coder.return_value.last_bosskit_commit_hash = "abc1234"
+        yield mock_coder
+
+
+def test_job_runner_passes_the_repo_as_root(tmp_path, args, mock_coder):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    job = BatchJob("one", str(repo), ["x.py"], "fix it", "gpt-4")
+
+    assert make_job_runner(args)(job) == dict(commit="abc1234", num_errors=0)
+
+    kwargs = mock_coder.call_args.kwargs
+    assert kwargs["root"] == str(repo)
+    assert kwargs["fnames"] == [str(repo / "x.py")]
+    mock_coder.return_value.run_one.assert_called_once_with("fix it")
+    mock_coder.return_value.close.assert_called_once_with()
+
+
+def test_job_runner_closes_the_coder_when_the_job_fails(tmp_path, args, mock_coder):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    job = BatchJob("three", str(repo), [], "break it", "gpt-4")
+    mock_coder.return_value.run_one.side_effect = RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        make_job_runner(args)(job)
+    mock_coder.return_value.close.assert_called_once_with()
+
+
+def test_job_runner_without_files(tmp_path, args, mock_coder):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    job = BatchJob("two", str(repo), [], "look around", "gpt-4")
+
+    runner = BatchRunner(make_job_runner(args), str(tmp_path / "results.jsonl"))
+    record = runner.run_one(job)
+
+    assert record["status"] == "ok" and record["commit"] == "abc1234"
+    kwargs = mock_coder.call_args.kwargs
+    assert kwargs["fnames"] == [] and kwargs["root"] == str(repo)
+    assert list(repo.iterdir()) == []
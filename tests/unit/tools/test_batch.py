@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+
+import git
+import pytest
+
+from bosskit.tools.batch import BatchRunner, get_provider, load_manifest, parse_provider_limits
+
+
+def write_manifest(tmp_path, entries):
+    fname = tmp_path / "jobs.jsonl"
+    fname.write_text("\n".join(json.dumps(entry) for entry in entries) + "\n")
+    return str(fname)
+
+
+def make_repos(tmp_path, names):
+    for name in names:
+        (tmp_path / name).mkdir(exist_ok=True)
+
+
+def test_load_manifest(tmp_path):
+    make_repos(tmp_path, ["a", "b"])
+    fname = write_manifest(
+        tmp_path,
+        [
+            dict(repo="a", files="x.py", prompt="fix it"),
+            dict(id="two", repo=str(tmp_path / "b"), prompt="fix it too", model="anthropic/claude"),
+        ],
+    )
+
+    first, second = load_manifest(fname, "gpt-4")
+    assert (first.id, first.repo, first.files, first.model) == ("job-1", str(tmp_path / "a"), ["x.py"], "gpt-4")
+    assert first.get_abs_files() == [str(tmp_path / "a" / "x.py")]
+    assert (second.id, second.repo, get_provider(second.model)) == ("two", str(tmp_path / "b"), "anthropic")
+
+
+def test_load_manifest_needs_repo_and_prompt(tmp_path):
+    with pytest.raises(ValueError, match="jobs.jsonl:1"):
+        load_manifest(write_manifest(tmp_path, [dict(repo="a")]), "gpt-4")
+
+
+def test_load_manifest_needs_existing_repo_dirs(tmp_path):
+    (tmp_path / "file.py").write_text("")
+    for repo in ["missing", "file.py"]:
+        with pytest.raises(ValueError, match="is not a directory"):
+            load_manifest(write_manifest(tmp_path, [dict(repo=repo, prompt="p")]), "gpt-4")
+    assert not (tmp_path / "missing").exists()
+
+
+def test_parse_provider_limits():
+    assert parse_provider_limits(["openai=4", "anthropic=1"]) == dict(openai=4, anthropic=1)
+    with pytest.raises(ValueError):
+        parse_provider_limits(["openai=0"])
+
+
+def test_runs_within_provider_and_repo_limits(tmp_path):
+    entries = [dict(repo=f"r{i}", prompt="p") for i in range(6)]
+    entries += [dict(repo=f"s{i}", prompt="p", model="anthropic/claude") for i in range(4)]
+    entries += [dict(repo="r0", prompt="again")]
+    make_repos(tmp_path, set(entry["repo"] for entry in entries))
+    jobs = load_manifest(write_manifest(tmp_path, entries), "gpt-4")
+
+    lock = threading.Lock()
+    running = dict(openai=0, anthropic=0)
+    peaks = dict(openai=0, anthropic=0)
+    repos = set()
+
+    def run_job(job):
+        provider = get_provider(job.model)
+        with lock:
+            assert job.repo not in repos
+            repos.add(job.repo)
+            running[provider] += 1
+            peaks[provider] = max(peaks[provider], running[provider])
+        time.sleep(0.01)
+        with lock:
+            running[provider] -= 1
+            repos.discard(job.repo)
+        if job.prompt == "again":
+            raise RuntimeError("failed")
+        return dict(commit="abc1234")
+
+    results = tmp_path / "results.jsonl"
+    runner = BatchRunner(run_job, str(results), max_workers=4, provider_limits=dict(anthropic=1))
+    metrics = runner.run(jobs)
+
+    assert peaks["anthropic"] == 1
+    assert metrics["jobs"] == 11 and metrics["failed"] == 1
+    assert metrics["providers"]["anthropic"]["jobs"] == 4
+    assert metrics["jobs_per_minute"] > 0 and metrics["latency"]["p50"] > 0
+
+    records = [json.loads(line) for line in results.read_text().splitlines()]
+    assert len(records) == 11
+    failed = [record for record in records if record["status"] == "error"]
+    assert failed[0]["error"] == "RuntimeError: failed" and failed[0]["repo"] == str(tmp_path / "r0")
+    assert all(record["commit"] == "abc1234" for record in records if record["status"] == "ok")
+
+
+def test_jobs_in_one_git_repo_never_overlap(tmp_path):
+    git.Repo.init(tmp_path / "repo")
+    make_repos(tmp_path, ["repo/a", "repo/b", "other"])
+    entries = [dict(repo="repo/a", prompt="p"), dict(repo="repo/b", prompt="p"), dict(repo="other", prompt="p")]
+    jobs = load_manifest(write_manifest(tmp_path, entries), "gpt-4")
+    assert jobs[0].repo_root == jobs[1].repo_root == str(tmp_path / "repo")
+    assert jobs[2].repo_root == str(tmp_path / "other")
+
+    lock = threading.Lock()
+    intervals = dict()
+
+    def run_job(job):
+        started = time.monotonic()
+        time.sleep(0.05)
+        with lock:
+            intervals[job.repo] = (started, time.monotonic())
+
+    BatchRunner(run_job, str(tmp_path / "results.jsonl"), max_workers=3).run(jobs)
+
+    (a_start, a_end), (b_start, b_end) = intervals[jobs[0].repo], intervals[jobs[1].repo]
+    assert a_end <= b_start or b_end <= a_start
@@ -0,0 +1,92 @@
+import threading
+
+import git
+
+from bosskit.tools.commitworker import CommitMessageWorker
+
+
+def make_repo(tmp_path):
+    repo = git.Repo.init(tmp_path)
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "Test")
+        config.set_value("user", "email", "test@example.com")
+    (tmp_path / "a.py").write_text("a\n")
+    repo.git.add("a.py")
+    repo.git.commit("-m", "first")
+    return repo
+
+
+def edit(tmp_path, worker, content):
+    (tmp_path / "a.py").write_text(content)
+    return worker.commit(["a.py"], "bosskit: placeholder", "bosskit: ", "diff", "context")
+
+
+def test_placeholder_is_reworded(tmp_path):
+    repo = make_repo(tmp_path)
+    worker = CommitMessageWorker(repo, lambda diffs, context: "real message")
+
+    hexsha = edit(tmp_path, worker, "b\n")
+    worker.flush()
+
+    head = repo.head.commit
+    assert head.message == "bosskit: real message\n\ncontext\n"
+    assert head.hexsha != hexsha
+    assert worker.get_current(hexsha) == head.hexsha
+    assert worker.get_current(hexsha[:7]) == head.hexsha[:7]
+    assert head.parents[0].message.strip() == "first"
+    assert not repo.is_dirty()
+
+
+def test_later_commits_are_replayed(tmp_path):
+    repo = make_repo(tmp_path)
+    release = threading.Event()
+
+    def get_message(diffs, context):
+        release.wait()
+        return "real message"
+
+    worker = CommitMessageWorker(repo, get_message)
+    first = edit(tmp_path, worker, "b\n")
+    second = edit(tmp_path, worker, "c\n")
+    release.set()
+    worker.flush()
+
+    head = repo.head.commit
+    assert head.hexsha == worker.get_current(second)
+    assert head.parents[0].hexsha == worker.get_current(first)
+    assert [c.message.split("\n")[0] for c in repo.iter_commits()] == ["bosskit: real message"] * 2 + ["first"]
+    assert (tmp_path / "a.py").read_text() == "c\n"
+
+
+def test_gives_up_when_head_moves(tmp_path):
+    repo = make_repo(tmp_path)
+    release = threading.Event()
+
+    def get_message(diffs, context):
+        release.wait()
+        return "real message"
+
+    worker = CommitMessageWorker(repo, get_message)
+    hexsha = edit(tmp_path, worker, "b\n")
+    repo.git.reset("--hard", "HEAD~1")
+    release.set()
+    worker.flush()
+
+    assert repo.head.commit.message.strip() == "first"
+    assert worker.get_current(hexsha) == hexsha
+    assert repo.commit(hexsha).message.strip() == "bosskit: placeholder"
+
+
+def test_failed_message_keeps_placeholder(tmp_path):
+    repo = make_repo(tmp_path)
+
+    def get_message(diffs, context):
+        raise RuntimeError("no network")
+
+    worker = CommitMessageWorker(repo, get_message)
+    edit(tmp_path, worker, "b\n")
+    worker.flush()
+    edit(tmp_path, worker, "c\n")
+    worker.flush()
+
+    assert repo.head.commit.message.strip() == "bosskit: placeholder"
@@ -0,0 +1,143 @@
+import difflib
+import random
+
+import pytest
+
+from bosskit.tools.diffs import PartialDiff, WholeFilePreview, diff_partial_update, find_last_non_deleted
+
+
+def ndiff_last_non_deleted(lines_orig, lines_updated):
+    # the difflib.ndiff version find_last_non_deleted() replaced
+    num_orig = 0
+    last_non_deleted_orig = None
+    for line in difflib.ndiff(lines_orig, lines_updated):
+        if line[0] == " ":
+            num_orig += 1
+            last_non_deleted_orig = num_orig
+        elif line[0] == "-":
+            num_orig += 1
+    return last_non_deleted_orig
+
+
+def make_funcs(num):
+    lines = []
+    for i in range(num):
+        lines += [f"def func_{i}():\n", f"    return {i}\n", "\n"]
+    return lines
+
+
+def change(lines, i):
+    lines[i] = lines[i].rstrip("\n") + "  # changed\n"
+
+
+def make_update(rnd, lines_orig):
+    # changed, inserted and deleted lines which can only line up one way
+    lines = list(lines_orig)
+    for _ in range(rnd.randint(0, 4)):
+        i = rnd.randrange(len(lines) // 3) * 3 + 1
+        kind = rnd.choice(["change", "insert", "delete"])
+        if kind == "change":
+            change(lines, i)
+        elif kind == "insert":
+            lines.insert(i + 1, f"    log({rnd.random()})\n")
+        else:
+            del lines[i]
+    return lines
+
+
+def stream(lines_orig, lines_updated):
+    partial_diff = PartialDiff(lines_orig)
+    for line in lines_updated:
+        partial_diff.add_line(line)
+    return partial_diff
+
+
+def test_partial_update_is_not_anchored_to_the_end():
+    lines_orig = make_funcs(40)
+    lines_updated = list(lines_orig)
+    change(lines_updated, 13)
+    prefix = lines_updated[:30]
+
+    assert find_last_non_deleted(lines_orig, prefix) == 30 == ndiff_last_non_deleted(lines_orig, prefix)
+
+    show = diff_partial_update(lines_orig, prefix)
+    assert " 30 / 120 lines" in show
+    assert "-def func_" not in show
+
+
+def test_matches_ndiff_on_prefixes_ending_at_full_lines():
+    rnd = random.Random(0)
+    for _ in range(300):
+        lines_orig = make_funcs(rnd.randint(3, 60))
+        lines_updated = list(lines_orig)
+        for _ in range(rnd.randint(0, 4)):
+            # changed lines that can only line up one way
+            change(lines_updated, rnd.randrange(len(lines_orig) // 3) * 3 + 1)
+        prefix = lines_updated[: rnd.randint(1, len(lines_updated))]
+
+        assert find_last_non_deleted(lines_orig, prefix) == ndiff_last_non_deleted(lines_orig, prefix)
+
+
+def test_never_runs_past_the_update():
+    rnd = random.Random(1)
+    for _ in range(300):
+        lines_orig = make_funcs(rnd.randint(3, 60))
+        lines_updated = list(lines_orig)
+        for _ in range(rnd.randint(0, 4)):
+            change(lines_updated, rnd.randrange(len(lines_orig)))
+        prefix = lines_updated[: rnd.randint(1, len(lines_updated))]
+
+        assert (find_last_non_deleted(lines_orig, prefix) or 0) <= len(prefix)
+
+
+def test_partial_diff_progress_matches_diff_partial_update():
+    rnd = random.Random(2)
+    for _ in range(300):
+        lines_orig = make_funcs(rnd.randint(3, 60))
+        lines_updated = make_update(rnd, lines_orig)
+        prefix = lines_updated[: rnd.randint(1, len(lines_updated))]
+
+        partial_diff = stream(lines_orig, prefix)
+        assert partial_diff.last_non_deleted == find_last_non_deleted(lines_orig, prefix)
+
+        # diff_partial_update() takes the last line as the partial one
+        show = diff_partial_update(lines_orig, prefix + [""])
+        assert show.split("\n")[-4] == partial_diff.show().split("\n")[-4]
+
+
+def test_partial_diff_final_show():
+    rnd = random.Random(3)
+    for _ in range(100):
+        lines_orig = make_funcs(rnd.randint(3, 60))
+        lines_updated = make_update(rnd, lines_orig)
+
+        partial_diff = stream(lines_orig, lines_updated)
+        partial_diff.finish()
+        assert partial_diff.show(final=True) == diff_partial_update(lines_orig, lines_updated, final=True)
+
+
+def test_whole_file_preview(tmp_path):
+    lines_orig = make_funcs(10)
+    (tmp_path / "a.py").write_text("".join(lines_orig))
+    lines_updated = list(lines_orig)
+    change(lines_updated, 4)
+
+    reply = "Here it is:\n\na.py\n```\n" + "".join(lines_updated) + "```\n"
+    preview = WholeFilePreview(str(tmp_path), ["a.py", "b.py"])
+    for end in range(1, len(reply)):
+        preview.update(reply[:end])
+    show = preview.update(reply)
+
+    assert show.startswith("Here it is:\n\na.py\n")
+    assert diff_partial_update(lines_orig, lines_updated, final=True).rstrip("\n") in show
+
+
+@pytest.mark.parametrize("reply", ["```\nx = 1\n", "Here:\nc.py\n```\nx = 1\n"])
+def test_whole_file_preview_malformed(tmp_path, reply):
+    preview = WholeFilePreview(str(tmp_path), ["a.py", "b.py"])
+
+    with pytest.raises(ValueError):
+        preview.update(reply)
+    # the error sticks as more of the reply streams in
+    with pytest.raises(ValueError):
+        preview.update(reply + "y = 2\n")
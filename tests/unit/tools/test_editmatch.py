@@ -0,0 +1,74 @@
+from bosskit.tools.editmatch import EditIndex, IndexedFile
+
+CONTENT = """def a():
+    return 1
+
+
+def b():
+    return 1
+
+
+class C:
+    def d(self):
+        return 2
+"""
+
+
+def test_finds_rarest_anchor_first_occurrence():
+    index = EditIndex(CONTENT.splitlines(keepends=True))
+
+    assert list(index.find(["    return 1\n"])) == [(1, True), (5, True)]
+    assert list(index.find(["def b():\n", "    return 1  \n"])) == [(4, True)]
+
+
+def test_loose_match_reindents_update():
+    indexed = IndexedFile(CONTENT)
+
+    assert indexed.replace("def d(self):\n    return 2\n", "def d(self):\n    return 3\n")
+    assert indexed.get_content().endswith("    def d(self):\n        return 3\n")
+
+
+def test_fuzzy_match_is_bounded_by_threshold():
+    indexed = IndexedFile(CONTENT)
+
+    assert indexed.replace("class C:\n    def d(slf):\n        return 2\n", "class C:\n    pass\n")
+    assert indexed.get_content().endswith("class C:\n    pass\n")
+    assert not indexed.replace("def nothing_like_it():\n    pass\n", "x\n")
+
+
+def test_edits_are_applied_against_one_index():
+    indexed = IndexedFile(CONTENT)
+    index = indexed.index
+
+    assert indexed.replace("def a():\n    return 1\n", "def a():\n    return 10\n")
+    # the same text is still further down, and the first one is already edited
+    assert indexed.replace("    return 1\n", "    return 11\n")
+    assert indexed.index is index
+
+    content = indexed.get_content()
+    assert "return 10\n" in content and "return 11\n" in content and "return 1\n" not in content
+
+
+def test_text_added_by_an_edit_can_be_edited():
+    indexed = IndexedFile(CONTENT)
+
+    assert indexed.replace("class C:\n", "class C:\n    x = 'new'\n")
+    assert indexed.replace("    x = 'new'\n", "    x = 'newer'\n")
+    assert "    x = 'newer'\n" in indexed.get_content()
+
+
+def test_text_added_by_an_edit_comes_first():
+    indexed = IndexedFile("x = 1\ny = 2\nz = 3\nx = 2\n")
+
+    assert indexed.replace("x = 1\n", "x = 2\n")
+    # applied in order, the first x = 2 is the one the first block added
+    assert indexed.replace("x = 2\n", "x = 5\n")
+    assert indexed.get_content() == "x = 5\ny = 2\nz = 3\nx = 2\n"
+
+
+def test_lines_joined_by_a_deletion_come_first():
+    indexed = IndexedFile("a\nb\nc\nd\na\nc\n")
+
+    assert indexed.replace("b\n", "")
+    assert indexed.replace("a\nc\n", "e\n")
+    assert indexed.get_content() == "e\nd\na\nc\n"
@@ -0,0 +1,102 @@
+import pytest
+
+from bosskit.tools.editstream import EditBlockParser, StreamingEdits, replace_block
+
+REPLY = """Here are the changes.
+
+a.py
+```python
+<<<<<<< ORIGINAL
+x = 1
+=======
+x = 2
+>>>>>>> UPDATED
+```
+
+b.py
+```python
+<<<<<<< SEARCH
+y = 1
+=======
+y = 3
+>>>>>>> REPLACE
+```
+"""
+
+
+def test_blocks_come_out_as_they_complete():
+    parser = EditBlockParser()
+    end_of_first = REPLY.index("```\n\nb.py")
+
+    assert parser.feed(REPLY[: end_of_first - 10]) == []
+    assert parser.feed(REPLY[:end_of_first]) == [("a.py", "x = 1\n", "x = 2\n")]
+    assert parser.feed(REPLY[: end_of_first + 20]) == []
+    assert parser.finish(REPLY) == [("b.py", "y = 1\n", "y = 3\n")]
+
+
+@pytest.mark.parametrize(
+    "reply",
+    [
+        "a.py\n<<<<<<< ORIGINAL\nx\n>>>>>>> UPDATED\n",
+        "a.py\n<<<<<<< ORIGINAL\nx\n=======\ny\n",
+        "<<<<<<< ORIGINAL\nx\n=======\ny\n>>>>>>> UPDATED\n",
+    ],
+)
+def test_malformed_blocks(reply):
+    with pytest.raises(ValueError):
+        EditBlockParser().finish(reply)
+
+
+def test_replace_block_ignores_trailing_whitespace():
+    assert replace_block("a\nb  \nc\n", "b\n", "B\n") == "a\nB\nc\n"
+    assert replace_block("a\n", "", "new\n") == "a\nnew\n"
+    assert replace_block("a\n", "missing\n", "x\n") is None
+
+
+def test_applies_while_streaming_and_rolls_back(tmp_path):
+    (tmp_path / "a.py").write_text("x = 1\n")
+    (tmp_path / "b.py").write_text("y = 1\n")
+    edits = StreamingEdits(str(tmp_path), lambda path: path == "a.py")
+
+    edits.update(REPLY[: REPLY.index("b.py")])
+    assert (tmp_path / "a.py").read_text() == "x = 2\n"
+
+    deferred = edits.finish(REPLY)
+    assert deferred == [("b.py", "y = 1\n", "y = 3\n")]
+    assert (tmp_path / "b.py").read_text() == "y = 1\n"
+
+    edits.apply(*deferred[0])
+    assert edits.results == [("a.py", True), ("b.py", True)]
+
+    edits.rollback()
+    assert (tmp_path / "a.py").read_text() == "x = 1\n"
+    assert (tmp_path / "b.py").read_text() == "y = 1\n"
+
+
+def test_rollback_removes_created_files(tmp_path):
+    edits = StreamingEdits(str(tmp_path), lambda path: True)
+    edits.finish("new.py\n<<<<<<< ORIGINAL\n=======\nz = 1\n>>>>>>> UPDATED\n")
+    assert (tmp_path / "new.py").read_text() == "z = 1\n"
+
+    edits.rollback()
+    assert not (tmp_path / "new.py").exists()
+
+
+def test_blocks_streamed_together_are_written_once_per_file(tmp_path):
+    (tmp_path / "a.py").write_text("x = 1\ny = 1\n")
+    (tmp_path / "b.py").write_text("y = 1\n")
+    reply = REPLY + "\na.py\n<<<<<<< ORIGINAL\ny = 1\n=======\ny = 2\n>>>>>>> UPDATED\n"
+
+    writes = []
+
+    class RecordingEdits(StreamingEdits):
+        def write(self, full_paths):
+            writes.append(sorted(full_paths))
+            super().write(full_paths)
+
+    edits = RecordingEdits(str(tmp_path), lambda path: True)
+    edits.update(reply)
+
+    assert writes == [[str(tmp_path / "a.py"), str(tmp_path / "b.py")]]
+    assert (tmp_path / "a.py").read_text() == "x = 2\ny = 2\n"
+    assert (tmp_path / "b.py").read_text() == "y = 3\n"
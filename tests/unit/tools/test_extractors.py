@@ -0,0 +1,39 @@
+from bosskit.tools.extractors import extract_python_idents, get_ident_extractor
+
+
+def test_python_idents():
+    content = 'import os\n\ndef foo(bar):\n    return os.path.join(bar, f"{bar!r:>10} {{x}}")\n'
+
+    counts = extract_python_idents(content)
+
+    assert counts == {"os": 2, "foo": 1, "bar": 3, "path": 1, "join": 1}
+
+
+def test_python_tokenize_error_falls_back():
+    assert extract_python_idents("def foo(:\n    '''unterminated") is None
+
+
+def test_c_skips_comments_strings_and_preprocessor():
+    content = (
+        "#include <stdio.h>\n"
+        "#define TWICE(a) \\\n  (a + a)\n"
+        "/* hidden */\n"
+        'int main(int argc, char **argv) { printf("hidden %d", 0x1F); return helper(argc); }\n'
+    )
+
+    counts = get_ident_extractor("main.c")(content)
+
+    assert counts == {"main": 1, "argc": 2, "argv": 1, "printf": 1, "helper": 1}
+
+
+def test_js_template_fields():
+    content = "import {a} from './x'; // hidden\nconst foo = `hidden ${bar}`;\n"
+
+    counts = get_ident_extractor("x.ts")(content)
+
+    assert counts == {"a": 1, "foo": 1, "bar": 1}
+
+
+def test_unknown_suffix_has_no_extractor():
+    assert get_ident_extractor("main.rb") is None
+    assert get_ident_extractor("MAIN.PY") is extract_python_idents
@@ -0,0 +1,45 @@
+import os
+
+from bosskit.tools.filecontent import QuotedFileCache
+
+
+def make_cache():
+    calls = []
+
+    def quote(fname, rel_fname):
+        calls.append(rel_fname)
+        with open(fname) as f:
+            return f"{rel_fname}\n```\n{f.read()}```\n"
+
+    return QuotedFileCache(quote), calls
+
+
+def test_block_is_reused_until_the_file_changes(tmp_path):
+    fname = str(tmp_path / "a.py")
+    with open(fname, "w") as f:
+        f.write("one\n")
+    cache, calls = make_cache()
+
+    assert cache.get_block(fname, "a.py") == "a.py\n```\none\n```\n"
+    assert cache.get_block(fname, "a.py") == "a.py\n```\none\n```\n"
+    assert cache.get_tokens(fname, "a.py", len) == len("a.py\n```\none\n```\n")
+    assert calls == ["a.py"]
+
+    with open(fname, "w") as f:
+        f.write("three\n")
+    stat = os.stat(fname)
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    assert cache.get_block(fname, "a.py") == "a.py\n```\nthree\n```\n"
+    assert calls == ["a.py", "a.py"]
+
+
+def test_prune_forgets_dropped_files(tmp_path):
+    cache, calls = make_cache()
+    for name in ("a.py", "b.py"):
+        (tmp_path / name).write_text(name)
+        cache.get_block(str(tmp_path / name), name)
+
+    cache.prune([str(tmp_path / "a.py")])
+
+    assert list(cache.entries) == [str(tmp_path / "a.py")]
@@ -0,0 +1,51 @@
+import git
+
+from bosskit.tools.gitbatch import UNTRACKED, GitBatch
+
+
+def make_repo(tmp_path):
+    repo = git.Repo.init(tmp_path)
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "Test")
+        config.set_value("user", "email", "test@example.com")
+    return repo
+
+
+def write(tmp_path, fname, content):
+    (tmp_path / fname).write_text(content)
+
+
+def test_head_exists_after_first_commit(tmp_path):
+    repo = make_repo(tmp_path)
+    batch = GitBatch(repo)
+    assert not batch.head_exists()
+
+    write(tmp_path, "a.py", "a\n")
+    repo.git.add("a.py")
+    repo.git.commit("-m", "first")
+
+    assert batch.head_exists()
+    assert batch.resolve("HEAD") == repo.head.commit.hexsha
+
+
+def test_status_and_diff(tmp_path):
+    repo = make_repo(tmp_path)
+    for fname in ("a.py", "b.py", "c.py"):
+        write(tmp_path, fname, f"{fname}\n")
+    repo.git.add("a.py", "b.py", "c.py")
+    repo.git.commit("-m", "first")
+    batch = GitBatch(repo)
+    assert not batch.is_dirty()
+
+    write(tmp_path, "a.py", "changed\n")
+    write(tmp_path, "b.py", "changed\n")
+    repo.git.mv("c.py", "renamed c.py")
+    write(tmp_path, "new.py", "new\n")
+
+    assert batch.get_status() == {"a.py": ".M", "b.py": ".M", "renamed c.py": "R.", "new.py": UNTRACKED}
+    assert batch.get_status(untracked=False).keys() == {"a.py", "b.py", "renamed c.py"}
+    assert batch.is_dirty()
+
+    diff = batch.get_diff(["a.py", "b.py"], "HEAD")
+    assert "+++ b/a.py" in diff and "+++ b/b.py" in diff
+    assert batch.get_diff([], "HEAD") == ""
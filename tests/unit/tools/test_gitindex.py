@@ -0,0 +1,45 @@
+import git
+
+from bosskit.tools.gitindex import GitFileIndex
+
+
+def make_repo(tmp_path, *fnames):
+    repo = git.Repo.init(tmp_path)
+    for fname in fnames:
+        path = tmp_path / fname
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x\n")
+    if fnames:
+        repo.git.add(*fnames)
+    return repo
+
+
+def test_lists_tracked_files_once(tmp_path):
+    repo = make_repo(tmp_path, "b.py", "a.py", "sub/a.py", "odd name.py", "ünicode.py")
+    (tmp_path / "untracked.py").write_text("x\n")
+    index = GitFileIndex(repo)
+
+    assert index.get_files() == ["a.py", "b.py", "odd name.py", "sub/a.py", "ünicode.py"]
+    assert "sub/a.py" in index
+    assert "untracked.py" not in index
+    assert index.get_by_basename("a.py") == ["a.py", "sub/a.py"]
+    assert index.num_loads == 1
+
+
+def test_reloads_when_the_index_changes(tmp_path):
+    repo = make_repo(tmp_path, "a.py")
+    index = GitFileIndex(repo)
+    assert index.get_files() == ["a.py"]
+
+    (tmp_path / "b.py").write_text("x\n")
+    repo.git.add("b.py")
+
+    assert index.get_file_set() == {"a.py", "b.py"}
+    assert index.num_loads == 2
+
+
+def test_repo_without_an_index(tmp_path):
+    index = GitFileIndex(make_repo(tmp_path))
+
+    assert index.get_files() == []
+    assert index.get_by_basename("a.py") == []
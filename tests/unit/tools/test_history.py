@@ -0,0 +1,76 @@
+import threading
+
+from bosskit.tools.history import ChatHistory
+
+
+def count_tokens(message):
+    return len(message["content"].split())
+
+
+def turn(text, words=10):
+    return [dict(role="user", content=text), dict(role="assistant", content=" ".join([text] * words))]
+
+
+def test_counts_tokens_once_per_message():
+    counted = []
+
+    def count(message):
+        counted.append(message["content"])
+        return count_tokens(message)
+
+    history = ChatHistory(count, lambda messages: None, max_tokens=1000)
+    history.extend(turn("one"))
+    history.extend(turn("two"))
+
+    assert counted == ["one", " ".join(["one"] * 10), "two", " ".join(["two"] * 10)]
+    assert history.get_tokens() == 22
+
+
+def test_oldest_turns_are_summarized():
+    summarized = []
+
+    def summarize(messages):
+        summarized.append([m["content"] for m in messages])
+        return "the summary"
+
+    history = ChatHistory(count_tokens, summarize, max_tokens=40, summary_prefix="Earlier: ")
+    for text in ("a", "b", "c", "d"):
+        history.extend(turn(text))
+        history.wait()
+
+    messages = history.get_messages()
+    assert summarized[0][0] == "a"
+    assert messages[0]["content"] == "Earlier: the summary"
+    assert messages[-2]["content"] == "d"
+    assert history.get_tokens() <= 40
+
+
+def test_summary_is_dropped_if_history_changed():
+    release = threading.Event()
+
+    def summarize(messages):
+        release.wait()
+        return "stale"
+
+    history = ChatHistory(count_tokens, summarize, max_tokens=30)
+    for text in ("a", "b", "c"):
+        history.extend(turn(text))
+    history.clear()
+    history.extend(turn("e"))
+    release.set()
+    history.wait()
+
+    assert [m["content"] for m in history.get_messages()][0] == "e"
+
+
+def test_stays_bounded_when_summaries_fail():
+    def summarize(messages):
+        raise RuntimeError("no network")
+
+    history = ChatHistory(count_tokens, summarize, max_tokens=30)
+    for i in range(50):
+        history.extend(turn(str(i)))
+        history.wait()
+        assert history.get_tokens() <= 60
+
+    assert history.get_messages()[-2]["content"] == "49"
@@ -0,0 +1,29 @@
+from bosskit.tools.mdstream import find_frozen_end
+
+
+def test_paragraphs_freeze_once_next_block_starts():
+    # the line starting the next block has to be complete
+    text = "first para\n\nsecond\n"
+
+    assert find_frozen_end(text) == len("first para\n\n")
+    assert find_frozen_end("first para\n\nsec") == 0
+    assert find_frozen_end("first para\n\n") == 0
+
+
+def test_open_fence_does_not_freeze():
+    text = "intro\n\n```python\nx = 1\n\ny = 2\n"
+
+    assert find_frozen_end(text) == len("intro\n\n")
+
+
+def test_closed_fence_needs_matching_marker():
+    text = "````\n```\n\nstill code\n````\n\nafter\n"
+
+    assert find_frozen_end(text) == text.index("after")
+
+
+def test_lists_and_indented_lines_continue_the_block():
+    text = "- one\n\n- two\n\n    more of two\n\n"
+
+    assert find_frozen_end(text) == 0
+    assert find_frozen_end(text + "done\n") == len(text)
@@ -0,0 +1,99 @@
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from bosskit.tools.pagerank import distribute_rank, local_push_pagerank, pagerank
+
+
+@pytest.fixture
+def edges():
+    rnd = random.Random(0)
+    num_nodes = 50
+    edges = []
+    for _ in range(300):
+        src = rnd.randrange(num_nodes)
+        dst = rnd.randrange(num_nodes - 10)
+        if src != dst:
+            edges.append((src, dst, rnd.randint(1, 5)))
+    return num_nodes, edges
+
+
+def to_graph(num_nodes, edges):
+    G = nx.MultiDiGraph()
+    G.add_nodes_from(range(num_nodes))
+    for src, dst, weight in edges:
+        G.add_edge(src, dst, weight=weight)
+    return G
+
+
+def test_pagerank_matches_networkx(edges):
+    num_nodes, edges = edges
+    G = to_graph(num_nodes, edges)
+    src, dst, weights = zip(*edges)
+
+    expected = nx.pagerank(G, weight="weight")
+    ranks = pagerank(src, dst, weights, num_nodes)
+
+    for node, rank in expected.items():
+        assert ranks[node] == pytest.approx(rank, abs=1e-6)
+
+
+def test_pagerank_personalized_matches_networkx(edges):
+    num_nodes, edges = edges
+    G = to_graph(num_nodes, edges)
+    src, dst, weights = zip(*edges)
+
+    personalization = {0: 1.0, 1: 1.0}
+    expected = nx.pagerank(G, weight="weight", personalization=personalization, dangling=personalization)
+
+    pers = [personalization.get(node, 0) for node in range(num_nodes)]
+    ranks = pagerank(src, dst, weights, num_nodes, personalization=pers)
+
+    for node, rank in expected.items():
+        assert ranks[node] == pytest.approx(rank, abs=1e-6)
+
+
+def test_pagerank_zero_personalization():
+    with pytest.raises(ZeroDivisionError):
+        pagerank([0], [1], [1], 2, personalization=[0, 0])
+
+
+def test_distribute_rank():
+    ranks = np.array([0.5, 0.25, 0.25])
+    edge_ranks = distribute_rank(ranks, [0, 0, 1], [1, 2, 2], [1, 3, 2], 3)
+
+    assert edge_ranks.tolist() == pytest.approx([0.125, 0.375, 0.25])
+
+
+def test_local_push_pagerank_approximates_networkx(edges):
+    num_nodes, edges = edges
+    G = to_graph(num_nodes, edges)
+
+    out_edges = {node: [] for node in range(num_nodes)}
+    for src, dst, weight in edges:
+        out_edges[src].append((dst, weight))
+
+    personalization = {0: 1.0, 1: 1.0}
+    expected = nx.pagerank(G, weight="weight", personalization=personalization, dangling=personalization)
+
+    ranks = local_push_pagerank(personalization, out_edges.get, tol=1e-7)
+    total = sum(ranks.values())
+
+    for node, rank in expected.items():
+        assert ranks.get(node, 0) / total == pytest.approx(rank, abs=1e-4)
+
+
+def test_local_push_pagerank_stays_local():
+    out_edges = {
+        0: [(1, 1)],
+        1: [(0, 1)],
+        2: [(3, 1)],
+        3: [(0, 1)],
+    }
+
+    ranks = local_push_pagerank({0: 1.0}, out_edges.get, tol=1e-6)
+
+    assert set(ranks) == {0, 1}
+    assert ranks[0] > ranks[1]
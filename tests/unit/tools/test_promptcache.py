@@ -0,0 +1,83 @@
+import threading
+
+from bosskit.tools.promptcache import CacheWarmer, ChatChunks, has_cache_control
+
+
+def pair(content):
+    return [dict(role="user", content=content), dict(role="assistant", content="Ok.")]
+
+
+def test_layout_and_breakpoints():
+    done = pair("earlier")
+    chunks = ChatChunks(
+        system=[dict(role="system", content="sys")],
+        done=done,
+        repo=pair("repo map"),
+        chat_files=pair("files"),
+        reminder=[dict(role="system", content="reminder")],
+        cur=[dict(role="user", content="now")],
+    )
+    chunks.add_cache_control_headers()
+
+    messages = chunks.all_messages()
+    assert [m["content"] if isinstance(m["content"], str) else m["content"][0]["text"] for m in messages] == [
+        "sys",
+        "earlier",
+        "Ok.",
+        "repo map",
+        "Ok.",
+        "files",
+        "Ok.",
+        "reminder",
+        "now",
+    ]
+    marked = [i for i, m in enumerate(messages) if not isinstance(m["content"], str)]
+    # the repo map and chat files follow the growing history, no breakpoints there
+    assert marked == [0, 2]
+    assert messages[2]["content"] == [dict(type="text", text="Ok.", cache_control={"type": "ephemeral"})]
+    # the history itself is left alone
+    assert done[-1]["content"] == "Ok."
+
+    # warming stops at the history, it never resends the current request
+    assert chunks.cacheable_messages() == messages[:3]
+
+
+def test_edited_chat_file_keeps_the_history_prefix():
+    done = pair("earlier") + pair("later")
+
+    def format_messages(file_content):
+        chunks = ChatChunks(
+            system=[dict(role="system", content="sys")],
+            done=done,
+            repo=pair("repo map"),
+            chat_files=pair(file_content),
+            cur=[dict(role="user", content="now")],
+        )
+        chunks.add_cache_control_headers()
+        return chunks.all_messages()
+
+    before = format_messages("x = 1")
+    after = format_messages("x = 2")
+
+    # the cached prefix runs through the history's breakpoint either way
+    assert has_cache_control(before[4])
+    assert before[:5] == after[:5]
+    assert before[5:] != after[5:]
+
+
+def test_warmer_pings_until_max_pings():
+    pinged = []
+    done = threading.Event()
+
+    def ping(messages):
+        pinged.append(messages)
+        if len(pinged) == 2:
+            done.set()
+
+    warmer = CacheWarmer(ping, max_pings=2, interval=0.01)
+    warmer.warm(["prefix"])
+    assert done.wait(5)
+    warmer.stop()
+    warmer.thread.join(5)
+
+    assert pinged == [["prefix"], ["prefix"]]
@@ -0,0 +1,70 @@
+from bosskit.tools.refgraph import RefGraph, Tag
+
+
+def definitions(fname, *idents):
+    return {ident: {(fname, "function", ident)} for ident in idents}
+
+
+def edge_names(graph):
+    return sorted(
+        (graph.files[referencer], graph.files[definer], num_refs, graph.idents[ident])
+        for referencer, definer, num_refs, ident in zip(*(column.tolist() for column in graph.get_edges()))
+    )
+
+
+def test_get_edges():
+    graph = RefGraph()
+    graph.update_file("a.py", 1, definitions("a.py", "foo"), {"bar": 2})
+    graph.update_file("b.py", 1, definitions("b.py", "bar"), {"foo": 1, "bar": 3})
+
+    assert edge_names(graph) == [
+        ("a.py", "b.py", 2, "bar"),
+        ("b.py", "a.py", 1, "foo"),
+    ]
+
+
+def test_update_file_replaces_old_edges():
+    graph = RefGraph()
+    graph.update_file("a.py", 1, definitions("a.py", "foo"), {"bar": 2})
+    graph.update_file("b.py", 1, definitions("b.py", "bar"), {"foo": 1})
+    graph.get_edges()
+
+    graph.update_file("a.py", 2, definitions("a.py", "baz"), {"bar": 5})
+
+    a_id = graph.file_ids["a.py"]
+    foo_id = graph.ident_ids["foo"]
+    assert graph.get_mtime("a.py") == 2
+    assert foo_id not in graph.defines
+    assert graph.get_definitions(a_id, foo_id) == []
+    assert graph.get_definitions(a_id, graph.ident_ids["baz"]) == [("a.py", "function", "baz")]
+    assert edge_names(graph) == [("a.py", "b.py", 5, "bar")]
+
+
+def test_remove_file():
+    graph = RefGraph()
+    graph.update_file("a.py", 1, definitions("a.py", "foo"), {"bar": 2})
+    graph.update_file("b.py", 1, definitions("b.py", "bar"), {"foo": 1})
+    graph.get_edges()
+
+    graph.remove_file("b.py")
+
+    assert "b.py" not in graph
+    assert len(graph) == 1
+    assert graph.rel_fnames() == ["a.py"]
+    assert edge_names(graph) == []
+
+
+def test_tag_round_trip():
+    for tag in [("a.py", "function", "foo"), ("a.py", "Foo", "method", "bar (self)")]:
+        assert Tag.from_tuple(tag).to_tuple() == tag
+
+
+def test_get_edges_with_definitions():
+    graph = RefGraph()
+    graph.update_file("a.py", 1, definitions("a.py", "foo"), {"bar": 2})
+    graph.update_file("b.py", 1, definitions("b.py", "bar"), {"foo": 1})
+
+    referencers, definers, _num_refs, idents, definition_ids = graph.get_edges(with_definitions=True)
+
+    for definer, ident, definition_id in zip(definers.tolist(), idents.tolist(), definition_ids.tolist()):
+        assert graph.definitions[definition_id] == (definer, ident)
@@ -0,0 +1,316 @@
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from bosskit.tools import repomap
+from bosskit.tools.repomap import RepoMap
+from bosskit.tools.watch import ChangeSet
+
+
+@pytest.fixture
+def repo_map(tmp_path, monkeypatch):
+    monkeypatch.setattr(RepoMap, "TAG_STORE_FILE", str(tmp_path / "tags.db"))
+    monkeypatch.setattr(RepoMap, "check_for_ctags", lambda self: True)
+
+    root = tmp_path / "repo"
+    root.mkdir()
+    for name, content in [("a.py", "def a():\n    pass\n"), ("b.py", "a()\n"), ("c.py", "a()\na()\n")]:
+        (root / name).write_text(content)
+    return RepoMap(1024, str(root))
+
+
+def get_fnames(repo_map):
+    return sorted(os.path.join(repo_map.root, name) for name in os.listdir(repo_map.root))
+
+
+def fake_extraction(repo_map):
+    # stands in for ctags and the lexer, and records what gets extracted
+    extracted = []
+
+    def run_ctags_batch(fnames):
+        extracted.extend(fnames)
+        return {fname: [dict(name=Path(fname).stem, kind="function")] for fname in fnames}
+
+    def get_name_identifiers_batch(fnames):
+        counts = {fname: Path(fname).read_text().count("a(") for fname in fnames}
+        return {fname: {"a": count} if count else {} for fname, count in counts.items()}
+
+    repo_map.run_ctags_batch = run_ctags_batch
+    repo_map.get_name_identifiers_batch = get_name_identifiers_batch
+    return extracted
+
+
+def touch(fname, content):
+    mtime = os.path.getmtime(fname) + 10
+    Path(fname).write_text(content)
+    os.utime(fname, (mtime, mtime))
+
+
+def test_update_ref_graph_skips_unchanged_files(repo_map, monkeypatch):
+    fnames = get_fnames(repo_map)
+    extracted = fake_extraction(repo_map)
+    changes = repo_map.file_changes = ChangeSet()
+
+    # nothing was reported yet, so every file is looked at
+    repo_map.update_ref_graph(fnames)
+    assert extracted == fnames
+    generation = repo_map.ref_graph.generation
+
+    stats = []
+    getmtime = os.path.getmtime
+    monkeypatch.setattr(os.path, "getmtime", lambda fname: stats.append(fname) or getmtime(fname))
+
+    extracted.clear()
+    repo_map.update_ref_graph(fnames)
+    assert stats == [] and extracted == []
+    assert repo_map.ref_graph.generation == generation
+
+    touch(fnames[1], "a()\na()\na()\n")
+    changes.add(fnames[1])
+    stats.clear()
+    repo_map.update_ref_graph(fnames)
+    assert stats == [fnames[1]] and extracted == [fnames[1]]
+    assert repo_map.ref_graph.generation > generation
+
+
+def test_get_repo_map_cache(repo_map):
+    fnames = get_fnames(repo_map)
+    fake_extraction(repo_map)
+    chat_files, other_files = fnames[:1], fnames[1:]
+
+    repo_content = repo_map.get_repo_map(chat_files, other_files)
+    assert "b.py" in repo_content
+    assert (repo_map.map_cache_hits, repo_map.map_cache_misses) == (0, 1)
+
+    # nothing changed
+    assert repo_map.get_repo_map(chat_files, other_files) == repo_content
+    assert (repo_map.map_cache_hits, repo_map.map_cache_misses) == (1, 1)
+
+    # a file update moves the ref graph to a new generation
+    generation = repo_map.ref_graph.generation
+    touch(fnames[2], "pass\n")
+    repo_map.get_repo_map(chat_files, other_files)
+    assert repo_map.ref_graph.generation > generation
+    assert (repo_map.map_cache_hits, repo_map.map_cache_misses) == (1, 2)
+
+    # a new token budget
+    repo_map.max_map_tokens = 512
+    repo_map.get_repo_map(chat_files, other_files)
+    assert (repo_map.map_cache_hits, repo_map.map_cache_misses) == (1, 3)
+
+    # the map for the old budget is still cached
+    repo_map.max_map_tokens = 1024
+    repo_map.get_repo_map(chat_files, other_files)
+    assert (repo_map.map_cache_hits, repo_map.map_cache_misses) == (2, 3)
+
+
+def test_get_repo_map_cache_evicts_least_recently_used(repo_map):
+    fnames = get_fnames(repo_map)
+    fake_extraction(repo_map)
+    repo_map.map_cache_size = 2
+
+    for map_tokens in [1024, 512, 1024, 256]:
+        repo_map.max_map_tokens = map_tokens
+        repo_map.get_repo_map([], fnames)
+    assert (repo_map.map_cache_hits, repo_map.map_cache_misses) == (1, 3)
+
+    # 512 was used least recently, so it made room for 256
+    assert [key[-1] for key in repo_map.map_cache] == [1024, 256]
+
+
+def test_rank_sharded_splits_edges_once_per_graph_change(repo_map):
+    graph = repo_map.ref_graph
+    repo_map.shard_depth = 1
+    for i, (shard, refs) in enumerate([("x", 2), ("x", 1), ("y", 3), ("z", 1)]):
+        definitions = {f"f{i}": {(f"{shard}/m{i}.py", "function", f"f{i}")}}
+        graph.update_file(f"{shard}/m{i}.py", 1, definitions, {f"f{(i + 1) % 4}": refs})
+
+    num_splits = []
+    get_edges = graph.get_edges
+    graph.get_edges = lambda **kwargs: num_splits.append(True) or get_edges(**kwargs)
+
+    ranked, _definitions = repo_map.rank_sharded(graph, dict())
+    personalized, _definitions = repo_map.rank_sharded(graph, {graph.intern_file("y/m2.py"): 1.0})
+    assert len(num_splits) == 1
+    assert personalized != ranked
+
+    graph.update_file("z/m3.py", 2, dict(), {"f0": 1})
+    repo_map.rank_sharded(graph, dict())
+    assert len(num_splits) == 2
+
+
+def test_parallel_identifiers_match_serial(tmp_path, monkeypatch):
+    root = tmp_path / "src"
+    root.mkdir()
+    sources = {
+        "a.py": "def alpha(x):\n    return beta(x) + beta(x)\n",
+        "b.js": "function beta(y) { return gamma(y); }\n",
+        "c.c": "int gamma(int z) { return z; }\n",
+        "d.md": "not code\n",
+    }
+    for name, content in sources.items():
+        (root / name).write_text(content)
+    (root / "e.py").write_bytes(b"\xff\xfe\x00bad")
+    fnames = sorted(str(fname) for fname in root.iterdir())
+
+    pools = []
+
+    class RecordingPool(repomap.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(kwargs["mp_context"].get_start_method())
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(repomap, "ProcessPoolExecutor", RecordingPool)
+
+    def get_identifiers(ident_mode, min_files):
+        monkeypatch.setattr(RepoMap, "TAG_STORE_FILE", str(tmp_path / f"{ident_mode}{min_files}.db"))
+        repo_map = RepoMap(1024, str(root), ident_mode=ident_mode)
+        repo_map.ident_parallel_min_files = min_files
+        return repo_map.get_name_identifiers_batch(fnames)
+
+    serial = get_identifiers("serial", 1)
+    assert serial[str(root / "a.py")] == dict(alpha=1, x=3, beta=2)
+    assert pools == []
+
+    # below the threshold the parallel mode lexes in process too
+    assert get_identifiers("parallel", len(fnames) + 1) == serial
+    assert pools == []
+
+    assert get_identifiers("parallel", 2) == serial
+    assert pools == [repomap.LEX_START_METHOD] and pools[0] != "fork"
+
+
+def fake_ctags(repo_map, fail_on=()):
+    # stands in for one ctags process per batch, failing on any batch with
+    # a file named in fail_on
+    batches = []
+
+    def run_ctags_on_batch(filenames):
+        batches.append(list(filenames))
+        if any(os.path.basename(filename) in fail_on for filename in filenames):
+            raise subprocess.CalledProcessError(1, ["ctags"])
+        return {filename: [dict(name=Path(filename).read_text().strip(), kind="function")] for filename in filenames}
+
+    repo_map.run_ctags_on_batch = run_ctags_on_batch
+    return batches
+
+
+def test_run_ctags_batch(tmp_path, repo_map):
+    root = tmp_path / "many"
+    root.mkdir()
+    fnames = []
+    for i in range(RepoMap.ctags_batch_size * 2 + 1):
+        fname = root / f"f{i}.py"
+        fname.write_text(f"func_{i}\n")
+        fnames.append(str(fname))
+    # same content as f0.py, so the same cache entry
+    (root / "copy.py").write_text("func_0\n")
+    fnames.append(str(root / "copy.py"))
+
+    batches = fake_ctags(repo_map)
+    res = repo_map.run_ctags_batch(fnames)
+
+    assert [len(batch) for batch in batches] == [256, 256, 1]
+    assert str(root / "copy.py") not in sum(batches, [])
+    assert res[str(root / "f7.py")] == [dict(name="func_7", kind="function")]
+    assert res[str(root / "copy.py")] == res[fnames[0]]
+
+    # all served from the tag store now
+    batches.clear()
+    assert repo_map.run_ctags_batch(fnames) == res
+    assert batches == []
+
+
+def test_run_ctags_batch_survives_a_failed_batch(tmp_path, repo_map):
+    root = tmp_path / "some"
+    root.mkdir()
+    for name in ["a.py", "bad.py", "c.py", "d.py"]:
+        (root / name).write_text(f"{name[0]}_func\n")
+    fnames = sorted(str(fname) for fname in root.iterdir())
+
+    repo_map.ctags_batch_size = 2
+    batches = fake_ctags(repo_map, fail_on={"bad.py"})
+    res = repo_map.run_ctags_batch(fnames)
+
+    # the failed batch is rerun file by file, the other batch is unaffected
+    assert sorted(map(len, batches)) == [1, 1, 2, 2]
+    assert res[str(root / "bad.py")] == []
+    assert [tag["name"] for fname in ["a.py", "c.py", "d.py"] for tag in res[str(root / fname)]] == ["a_func", "c_func", "d_func"]
+
+    # only the file which failed is tried again
+    batches.clear()
+    repo_map.run_ctags_batch(fnames)
+    assert batches == [[str(root / "bad.py")]]
+
+
+def binary_search_map(repo_map, ranked_tags):
+    # how get_ranked_tags_map() used to fit the tags, rendering each guess
+    lower_bound, upper_bound = 0, len(ranked_tags)
+    best_tree = None
+    while lower_bound <= upper_bound:
+        middle = (lower_bound + upper_bound) // 2
+        tree = repomap.to_tree(ranked_tags[:middle])
+        if repo_map.token_count(tree) < repo_map.max_map_tokens:
+            best_tree = tree
+            lower_bound = middle + 1
+        else:
+            upper_bound = middle - 1
+    return best_tree
+
+
+def make_ranked_tags():
+    ranked_tags = []
+    for i in range(12):
+        fname = f"pkg{i % 3}/module_{i}.py"
+        ranked_tags.append((fname, f"Class{i}", "class", f"Class{i}"))
+        for j in range(i % 4):
+            ranked_tags.append((fname, f"Class{i}", "member", f"method_{j}(self, value)"))
+        ranked_tags.append((fname, "function", f"helper_{i}(config)"))
+    ranked_tags += [(f"docs/page_{i}.md",) for i in range(5)]
+    return ranked_tags
+
+
+@pytest.mark.parametrize("max_map_tokens", [1, 20, 64, 150, 333, 1000, 10_000])
+def test_ranked_tags_map_fits_like_the_binary_search(repo_map, max_map_tokens):
+    ranked_tags = make_ranked_tags()
+    repo_map.get_ranked_tags = lambda chat_fnames, other_fnames, refresh=True: ranked_tags
+    repo_map.max_map_tokens = max_map_tokens
+
+    tree = repo_map.get_ranked_tags_map([], ["x.py"])
+    assert repo_map.token_count(tree) < max_map_tokens
+    assert tree == binary_search_map(repo_map, ranked_tags)
+
+
+def test_ranked_tags_map_backs_off_short_estimates(repo_map):
+    ranked_tags = make_ranked_tags()
+    repo_map.get_ranked_tags = lambda chat_fnames, other_fnames, refresh=True: ranked_tags
+    repo_map.max_map_tokens = 200
+
+    # every line estimated as free, so the first cut takes every tag
+    repo_map.line_token_count = lambda level, item: 0
+    tree = repo_map.get_ranked_tags_map([], ["x.py"])
+
+    assert repo_map.token_count(tree) < 200
+    assert tree == binary_search_map(repo_map, ranked_tags)
+
+
+def test_files_with_the_same_content_share_a_tag_store_entry(tmp_path, repo_map):
+    first = tmp_path / "one" / "util.py"
+    second = tmp_path / "two" / "util.py"
+    for fname in [first, second]:
+        fname.parent.mkdir()
+        fname.write_text("def shared():\n    pass\n")
+
+    batches = fake_ctags(repo_map)
+    res = repo_map.run_ctags_batch([str(first), str(second)])
+    assert batches == [[str(first)]]
+    assert res[str(first)] == res[str(second)]
+
+    # a fresh map, as in another checkout, finds it in the store too
+    other_map = RepoMap(1024, str(tmp_path / "two"))
+    other_batches = fake_ctags(other_map)
+    assert other_map.run_ctags_batch([str(second)]) == {str(second): res[str(first)]}
+    assert other_batches == []
+    assert repo_map.get_file_key(str(first)) == other_map.get_file_key(str(second))
@@ -0,0 +1,39 @@
+from bosskit.tools.tagstore import TagStore
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "cache" / "tags.db")
+    store = TagStore(path)
+
+    tags = [dict(name="hello", kind="function", signature="()")]
+    store.put("tags", "abc:.py", tags)
+    store.put_many("idents", {"abc:.py": dict(hello=2), "def:.js": dict()})
+
+    assert store.get("tags", "abc:.py") == tags
+    assert store.get("idents", "abc:.py") == dict(hello=2)
+    # kinds don't share keys
+    assert store.get("tags", "def:.js") is None
+    assert store.get_many("idents", ["abc:.py", "def:.js", "missing"]) == {"abc:.py": dict(hello=2), "def:.js": dict()}
+
+    store.put("tags", "abc:.py", [])
+    store.close()
+
+    # and it's all still there for the next process
+    store = TagStore(path)
+    assert store.get("tags", "abc:.py") == []
+    assert store.get("idents", "abc:.py") == dict(hello=2)
+    store.close()
+
+
+def test_many_keys_are_looked_up_in_chunks():
+    store = TagStore(":memory:")
+
+    # more keys than even recent sqlite builds allow variables in one query
+    items = {f"key{i}": [i] for i in range(40_000)}
+    store.put_many("tags", items)
+
+    keys = list(items) + ["missing"]
+    assert store.get_many("tags", keys) == items
+
+    store.chunk_size = 7
+    assert store.get_many("tags", keys[:20] + keys[:20]) == {key: items[key] for key in keys[:20]}
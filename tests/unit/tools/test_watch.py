@@ -0,0 +1,79 @@
+import time
+from types import SimpleNamespace
+
+from bosskit.tools.watch import ChangeSet, FileWatcher
+
+
+def wait_for_changes(changes, expected, timeout=5):
+    seen = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        seen |= changes.drain() or set()
+        if expected <= seen:
+            break
+        time.sleep(0.01)
+    return seen
+
+
+def test_change_set_drain():
+    changes = ChangeSet()
+    # nothing observed yet, the first drain asks for a full rescan
+    assert changes.drain() is None
+    assert changes.drain() == set()
+
+    changes.add("a.py")
+    changes.add("b.py")
+    changes.add("a.py")
+    assert changes.drain() == {"a.py", "b.py"}
+    assert changes.drain() == set()
+
+
+def test_change_set_invalidate():
+    changes = ChangeSet()
+    changes.drain()
+
+    changes.add("a.py")
+    changes.invalidate()
+    changes.add("b.py")
+    assert changes.drain() is None
+    # the rescan covered everything, tracking starts over
+    assert changes.drain() == set()
+
+
+def test_polling_picks_up_write_create_and_delete(tmp_path):
+    written = tmp_path / "written.py"
+    deleted = tmp_path / "deleted.py"
+    created = tmp_path / "sub" / "created.py"
+    written.write_text("x = 1\n")
+    deleted.write_text("y = 1\n")
+    created.parent.mkdir()
+    (tmp_path / ".git").mkdir()
+
+    watcher = FileWatcher(tmp_path, poll_interval=0.01, use_polling=True)
+    changes = watcher.subscribe()
+    watcher.start()
+    try:
+        assert changes.drain() is None
+
+        written.write_text("x = 22\n")
+        deleted.unlink()
+        created.write_text("z = 1\n")
+        (tmp_path / ".git" / "index").write_text("ignored")
+
+        expected = {str(written), str(deleted), str(created)}
+        assert wait_for_changes(changes, expected) == expected
+    finally:
+        watcher.stop()
+
+
+def test_directory_events_invalidate(tmp_path):
+    watcher = FileWatcher(tmp_path)
+    changes = watcher.subscribe()
+    changes.drain()
+
+    src_path, dest_path = str(tmp_path / "a.py"), str(tmp_path / "b.py")
+    watcher.dispatch(SimpleNamespace(is_directory=False, event_type="moved", src_path=src_path, dest_path=dest_path))
+    assert changes.drain() == {src_path, dest_path}
+
+    watcher.dispatch(SimpleNamespace(is_directory=True, event_type="created", src_path=str(tmp_path / "pkg")))
+    assert changes.drain() is None